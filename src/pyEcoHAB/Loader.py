@@ -3,8 +3,10 @@
 #-*- coding: utf-8 -*-
 import os
 import sys
+import copy
+import json
 from datetime import date
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 
 try:
     basestring
@@ -20,7 +22,21 @@ from .utils import for_loading as ufl
 
 
 class EcoHabDataBase(object):
-    def __init__(self, data, mask, visit_threshold, setup_config):
+    DIAGNOSTICS = ("eager", "lazy", "off")
+    VISITS_OUTPUT = ("dict", "array", "records")
+    SAVED_ATTRIBUTES = ("threshold", "visit_threshold", "mask", "prefix",
+                        "res_dir", "max_break", "workers", "diagnostics",
+                        "mice", "session_start", "session_end")
+    DIAGNOSTICS_CHUNK = 1000000
+    diagnostics = "eager"
+    _diagnostics = None
+    memmap_dir = None
+    mask = None
+    _visits_source = None
+    _visits_window = None
+
+    def __init__(self, data, mask, visit_threshold, setup_config,
+                 workers=1):
         """
         Base class for Loader and Merger providing data structure and
         methods for accessing antenna recordings and visits to Eco-HAB
@@ -31,8 +47,9 @@ class EcoHabDataBase(object):
         which describes geometry of the Eco-HAB setup used to collect data.
 
         Args:
-           data: DataBase
-             dataset read in by Loader or Merger
+           data: structured array or Data
+             dataset read in by Loader or Merger (Data is used as it is,
+             without applying mask)
            mask: a list or tuple of floats
              If necessary one can provide time bounds to cut the data.
              Mask bounds have to be specified as seconds from epoch in
@@ -41,15 +58,28 @@ class EcoHabDataBase(object):
              Specify minumum duration (in sec) of visit to Eco-HAB cage.
            setup_config: SetupConfig or ExperimentSetupConfig
              Geometry of the Eco-Hab setup used to collect data.
+           workers: int or None
+             Number of processes calculating visits of animals. None uses
+             all available cores. By default visits are calculated
+             in a single process.
+
+        Visits are calculated on the first access to visits (or to
+        a method querying visits) and kept for every visit threshold
+        used (see visits_for_threshold).
         """
-        self.registrations = BaseFunctions.Data(data, mask)
+        self.workers = workers
+        if isinstance(data, BaseFunctions.Data):
+            self.registrations = data
+        else:
+            self.registrations = BaseFunctions.Data(data, mask)
         self.threshold = visit_threshold
+        self._visits_cache = {}
+        self._set_setup_config(setup_config)
         self.mice = self.get_mice()
-        self.visits = self._calculate_visits(setup_config)
-        self.session_start = sorted(self.get_times(self.mice))[0]
-        self.session_end = sorted(self.get_times(self.mice))[-1]
+        self.session_start = float(np.min(self.get_times(self.mice)))
+        self.session_end = float(np.max(self.get_times(self.mice)))
 
-    def _calculate_animal_positions(self, setup_config):
+    def _calculate_animal_positions(self, setup_config, thresholds=None):
         """Calculate timings of animal visits to Eco-HAB compartments, using
         a modified algorithm by Alicja Puscian and Szymon Leski. Main
         modification -- if there are internal atennas in cages,
@@ -58,29 +88,56 @@ class EcoHabDataBase(object):
 
         Args:
            setup_config: ExperimentSetupConfig or SetupConfig
+           thresholds: list of floats
+             minimum visit durations, by default [self.threshold]
         Returns:
-           list
+           list of numpy arrays of visits (see for_loading.transform_visits),
+           one for every threshold
         """
-        tempdata = []
+        if thresholds is None:
+            thresholds = [self.threshold]
+        if not len(self.mice):
+            return [ufl.transform_visits([]) for threshold in thresholds]
+        times, antennas = [], []
         for mouse in self.mice:
-            times, antennas = utils.get_times_antennas(self.registrations,
-                                                       mouse,
-                                                       0, -1)
-            out = utils.get_animal_position(times, antennas,
-                                            mouse,
-                                            self.threshold,
-                                            setup_config.same_tunnel,
-                                            setup_config.same_address,
-                                            setup_config.opposite_tunnel,
-                                            setup_config.address,
-                                            setup_config.address_surrounding,
-                                            setup_config.address_non_adjacent,
-                                            setup_config.internal_antennas)
-            tempdata.extend(out)
-        tempdata.sort(key=lambda x: x[2])
-        return tempdata
-
-    def _calculate_visits(self, setup_config):
+            times.append(self.registrations.get_times(mouse))
+            antennas.append(self.registrations.getproperty(mouse, "Antenna",
+                                                           codes=True))
+        mouse_ids = np.repeat(np.arange(len(self.mice)),
+                              [len(t) for t in times])
+        return self._animal_positions(np.concatenate(times),
+                                      np.concatenate(antennas),
+                                      self.registrations.categories["Antenna"],
+                                      mouse_ids, self.mice, setup_config,
+                                      thresholds)
+
+    def _animal_positions(self, times, antennas, antenna_names, mouse_ids,
+                          mice, setup_config, thresholds):
+        """Return visits of mice ordered by start time for every threshold.
+        Antennas are indices in antenna_names, mouse_ids are indices
+        in mice and registrations of every animal are kept together."""
+        addresses, table, valid, internal = \
+            setup_config.antenna_transitions(antenna_names)
+        positions = utils.calculate_animal_positions_sweep(times, antennas,
+                                                           mouse_ids,
+                                                           thresholds, table,
+                                                           valid, internal,
+                                                           self.workers)
+        addresses = np.array(addresses, dtype="U30")
+        out = []
+        for address_idx, ids, starts, ends, validity in positions:
+            order = np.argsort(starts, kind="stable")
+            visits = np.empty(len(order), dtype=ufl.VISITS_DTYPE)
+            visits["Address"] = addresses[address_idx[order]]
+            visits["Tag"] = np.asarray(mice)[ids[order]]
+            visits["AbsStartTimecode"] = starts[order]
+            visits["AbsEndTimecode"] = ends[order]
+            visits["VisitDuration"] = ends[order] - starts[order]
+            visits["ValidVisitSolution"] = validity[order]
+            out.append(visits)
+        return out
+
+    def _calculate_visits(self, setup_config, thresholds=None):
         """Calculate EcoHabBase.visits. Calculate timings of animal visits to
         Eco-HAB compartments, using a modified algorithm by Alicja
         Puscian and Szymon Leski. Main modification -- if there are
@@ -89,13 +146,256 @@ class EcoHabDataBase(object):
 
         Args:
            setup_config: ExperimentSetupConfig or SetupConfig
+           thresholds: list of floats
+             minimum visit durations, by default [self.threshold]
+        Returns:
+           list of visits to Eco-HAB cages (Visits), one for every
+           threshold
+
+        """
+        data = self._calculate_animal_positions(setup_config, thresholds)
+        return [BaseFunctions.Visits(visits, None) for visits in data]
+
+    @property
+    def visits(self):
+        """Visits to Eco-HAB compartments (Visits) calculated with
+        the visit threshold of the dataset (self.threshold)."""
+        return self.visits_for_threshold(self.threshold)
+
+    @visits.setter
+    def visits(self, visits):
+        self._visits_cache = {self.threshold: visits}
+
+    def visits_for_threshold(self, threshold):
+        """
+        Return visits to Eco-HAB compartments (Visits) with minimum
+        visit duration threshold. Visits are calculated from the loaded
+        registrations on the first call and kept, later calls with
+        the same threshold return the same table.
+
+        Args:
+           threshold: float
+             minimum visit duration (in sec)
         Returns:
            visits to Eco-HAB cages: Visits
+        """
+        return self.visits_for_thresholds([threshold])[0]
+
+    def visits_for_thresholds(self, thresholds):
+        """
+        Return visits to Eco-HAB compartments (Visits) for a list
+        of minimum visit duration thresholds, e.g. to check how
+        sensitive results are to the visit threshold. Registrations
+        of every animal are traversed once for all the thresholds,
+        which have not been calculated yet. Visits are kept as in
+        visits_for_threshold.
+
+        Args:
+           thresholds: list of floats
+             minimum visit durations (in sec)
+        Returns:
+           list of visits to Eco-HAB cages (Visits), one for every
+           threshold
+        """
+        thresholds = list(thresholds)
+        missing = [threshold for threshold in OrderedDict.fromkeys(thresholds)
+                   if threshold not in self._visits_cache]
+        if missing:
+            if self._visits_source is not None:
+                # a view of a dataset, calculate visits of the whole dataset
+                source = self._visits_source.visits_for_thresholds(missing)
+                calculated = [visits.window(*self._visits_window)
+                              for visits in source]
+            else:
+                calculated = self._calculate_visits(self.setup_config,
+                                                    missing)
+                for threshold, visits in zip(missing, calculated):
+                    if self.memmap_dir is not None:
+                        visits.to_memmap(self.memmap_dir,
+                                         self._visits_name(threshold))
+                    if self.registrations.mask is not None:
+                        visits.mask_data(self.registrations.mask)
+            self._visits_cache.update(zip(missing, calculated))
+        return [self._visits_cache[threshold] for threshold in thresholds]
+
+    def with_visit_threshold(self, threshold):
+        """
+        Return a view of the dataset with visits calculated with minimum
+        visit duration threshold. The view shares registrations and
+        calculated visits with the dataset, so the data does not have
+        to be read in again to compare results of different visit
+        thresholds. The view keeps the mask of the dataset.
+
+        Args:
+           threshold: float
+             minimum visit duration (in sec)
+        Returns:
+           view of the dataset
+        """
+        if self.registrations.mask is not None:
+            view = self.window(*self.registrations.mask)
+        else:
+            view = self.window()
+        view.threshold = threshold
+        view.visit_threshold = threshold
+        return view
+
+    @property
+    def interval_index(self):
+        """Visits of every animal to every compartment as sorted
+        start and end times with cumulative durations
+        (BaseFunctions.IntervalIndex), built once and kept until
+        visits change. Time spent by an animal in a compartment between
+        two time points and visits overlapping a time interval are
+        found with binary search."""
+        return self.visits.interval_index()
+
+    @property
+    def cage_occupancy(self):
+        """Number and tags of animals present in every compartment over
+        time (BaseFunctions.CageOccupancy), calculated once from all
+        visits and kept until visits change."""
+        return self.visits.cage_occupancy()
+
+    def _visits_name(self, threshold):
+        if threshold == self.threshold:
+            return "visits"
+        return "visits_%s" % threshold
+
+    @classmethod
+    def _check_diagnostics(cls, diagnostics):
+        if diagnostics not in cls.DIAGNOSTICS:
+            raise ValueError("diagnostics has to be one of %s, not %r"
+                             % (", ".join(cls.DIAGNOSTICS), diagnostics))
+        return diagnostics
+
+    def get_diagnostics(self):
+        """
+        Return diagnostics counts of antenna registrations (see
+        utils.for_loading.diagnostics_counts). With diagnostics="lazy"
+        the counts are calculated on the first call. Returns None,
+        if diagnostics are turned off.
+        """
+        if self._diagnostics is None and self.diagnostics != "off":
+            if self.memmap_dir is None:
+                self._diagnostics = ufl.diagnostics_counts(
+                    self.registrations.data, self.setup_config,
+                    self.max_break)
+            else:
+                self._diagnostics = self._diagnostics_in_chunks()
+        return self._diagnostics
+
+    def _diagnostics_in_chunks(self):
+        """Calculate diagnostics counts of memory-mapped registrations
+        reading in DIAGNOSTICS_CHUNK registrations at a time."""
+        registrations = self.registrations
+        counts = None
+        for first in range(0, len(registrations), self.DIAGNOSTICS_CHUNK):
+            data = registrations.decode(slice(first,
+                                              first + self.DIAGNOSTICS_CHUNK))
+            if counts is None:
+                counts = ufl.diagnostics_counts(data, self.setup_config,
+                                                self.max_break)
+                continue
+            last_registrations = registrations.last_rows(
+                np.unique(data["Tag"]), before=first)
+            last_registrations.sort(order="Time")
+            ufl.update_diagnostics(counts, last_registrations, data,
+                                   self.setup_config, self.max_break)
+        return counts
+
+    def save_diagnostics(self):
+        """
+        Save diagnostics of antenna registrations in "diagnostics"
+        directory of res_dir and return saved texts (see
+        utils.for_loading.run_diagnostics). Returns None, if diagnostics
+        are turned off.
+        """
+        counts = self.get_diagnostics()
+        if counts is None:
+            return None
+        return ufl.save_diagnostics(counts, self.res_dir)
 
+    def memory_map(self, directory):
         """
-        temp_data = self._calculate_animal_positions(setup_config)
-        data = ufl.transform_visits(temp_data)
-        return BaseFunctions.Visits(data, None)
+        Move loaded registrations and visits to memory-mapped files
+        in directory. Queries read in only the parts of the files
+        with requested animals and time windows.
+        """
+        self.memmap_dir = directory
+        self.registrations.to_memmap(directory, "registrations")
+        for threshold, visits in self._visits_cache.items():
+            visits.to_memmap(directory, self._visits_name(threshold))
+
+    def _set_setup_config(self, setup_config):
+        self.cages = setup_config.cages
+        self.directions = setup_config.directions
+        self.setup_config = setup_config
+        self.all_antennas = setup_config.all_antennas
+        self.internal_antennas = setup_config.internal_antennas
+
+    def save(self, path):
+        """
+        Save registrations, visits, setup configuration and parameters
+        of the dataset in directory path. The dataset can be reopened
+        with load(path) without reading in data files and calculating
+        visits.
+        """
+        manifest = {
+            "version": ufl.SAVE_VERSION,
+            "class": type(self).__name__,
+            "setup_config": type(self.setup_config).__name__,
+            "registrations": self.registrations.save(path, "registrations"),
+            "visits": self.visits.save(path, "visits"),
+            "attributes": {name: getattr(self, name)
+                           for name in self.SAVED_ATTRIBUTES},
+            "diagnostics": self._diagnostics,
+        }
+        with open(os.path.join(path, "setup_config.txt"), "w") as f:
+            f.write(self.setup_config.to_text())
+        manifest_path = os.path.join(path, "manifest.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reopen a dataset (Loader or Merger) saved by save(path).
+        Registrations and visits are memory-mapped.
+        """
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != ufl.SAVE_VERSION:
+            raise ValueError("%s was saved by an incompatible version"
+                             " of pyEcoHAB" % path)
+        new_cls = {"Loader": Loader, "Merger": Merger}[manifest["class"]]
+        if not issubclass(new_cls, cls):
+            raise TypeError("%s contains a saved %s" % (path,
+                                                        manifest["class"]))
+        self = new_cls.__new__(new_cls)
+        for name, value in manifest["attributes"].items():
+            setattr(self, name, value)
+        self.registrations = BaseFunctions.Data.load(
+            path, "registrations", manifest["registrations"])
+        self.visits = BaseFunctions.Visits.load(path, "visits",
+                                                manifest["visits"])
+        config_cls = {"SetupConfig": SetupConfig,
+                      "ExperimentSetupConfig": ExperimentSetupConfig}
+        with open(os.path.join(path, "setup_config.txt")) as f:
+            text = f.read()
+        self._set_setup_config(
+            config_cls[manifest["setup_config"]].from_text(text))
+        if manifest["diagnostics"] is not None:
+            self._diagnostics = manifest["diagnostics"]
+            self._diagnostics["counters"] = Counter(
+                self._diagnostics["counters"])
+            if "skipped_by_distance" in self._diagnostics:
+                self._diagnostics["skipped_by_distance"] = OrderedDict(
+                    (key if key == "unconnected" else int(key), value)
+                    for key, value
+                    in self._diagnostics["skipped_by_distance"].items())
+        return self
 
     def mask_data(self, start_time, end_time):
         """
@@ -108,7 +408,8 @@ class EcoHabDataBase(object):
         """
         self.mask = (start_time, end_time)
         self.registrations.mask_data(self.mask)
-        self.visits.mask_data(self.mask)
+        for visits in self._visits_cache.values():
+            visits.mask_data(self.mask)
 
     def unmask_data(self):
         """
@@ -117,7 +418,37 @@ class EcoHabDataBase(object):
         """
         self.mask = None
         self.registrations.unmask_data()
-        self.visits.unmask_data()
+        for visits in self._visits_cache.values():
+            visits.unmask_data()
+
+    def window(self, t_start=None, t_end=None):
+        """
+        Return a view of the dataset with registrations and visits
+        clipped to the range (t_start, t_end). Unlike mask_data, the
+        dataset itself is not masked, so views of different ranges
+        can be used at the same time. The view shares the data with
+        the dataset and provides the same get_* methods.
+
+        Args:
+           t_start: float
+           t_end: float
+             If both are None, the view is not clipped.
+
+        Returns:
+           view of the dataset
+        """
+        view = copy.copy(self)
+        view.mask = None
+        if t_start is not None or t_end is not None:
+            view.mask = (t_start, t_end)
+        view.registrations = self.registrations.window(t_start, t_end)
+        view._visits_cache = {threshold: visits.window(t_start, t_end)
+                              for threshold, visits
+                              in self._visits_cache.items()}
+        if self._visits_source is None:
+            view._visits_source = self
+        view._visits_window = (t_start, t_end)
+        return view
 
     def get_antennas(self, mice):
         return self.registrations.getproperty(mice,
@@ -160,7 +491,11 @@ class EcoHabDataBase(object):
         return len(all_antennas)
 
     def get_mice(self):
-        mouse_list = list(set(self.registrations.data["Tag"]))
+        return self._sort_mice(self.registrations.values("Tag").tolist())
+
+    @staticmethod
+    def _sort_mice(mouse_list):
+        mouse_list = list(mouse_list)
         # new Eco-HAB has a different mouse tag naming convention
         # last five digits are the same whereas in previous version
         # there was a prefix and first digits where the same
@@ -170,11 +505,35 @@ class EcoHabDataBase(object):
             return [mouse_dict[mouse] for mouse in mouse_keys]
         return sorted(mouse_list)
 
-    def get_visits(self, mice=None, cage=None, t_start=None, t_end=None):
+    def get_visits(self, mice=None, cage=None, t_start=None, t_end=None,
+                   output="dict"):
         """
-        Return a list of visits to Eco-HAB compartments. Each visit is
-        a named dictionary with following fields: t_start, t_end, cage,
-        mouse tag."""
+        Return visits to Eco-HAB compartments ordered by start time.
+        Each visit has following fields: mouse (tag), address (cage),
+        t_start, t_end and duration.
+
+        Args:
+           mice: string or list of strings
+             by default all animals
+           cage: string or list of strings
+             by default all cages
+           t_start, t_end: float
+             visits starting between t_start and t_end are returned,
+             by default visits of the whole experiment
+           output: "dict", "array" or "records"
+             "dict" (default) returns a list of named dictionaries,
+             "array" returns a numpy structured array
+             (see for_loading.VISIT_RECORD_DTYPE) and "records" a list
+             of lightweight Visit records (see for_loading.Visit)
+        """
+        if output not in self.VISITS_OUTPUT:
+            raise ValueError("output has to be one of %s, not %r"
+                             % (", ".join(self.VISITS_OUTPUT), output))
+        if output != "dict":
+            out = self._get_visits_array(mice, cage, t_start, t_end)
+            if output == "records":
+                return [ufl.Visit(*visit) for visit in out.tolist()]
+            return out
         if isinstance(mice, str):
             if mice in self.mice:
                 mice = [mice]
@@ -194,13 +553,13 @@ class EcoHabDataBase(object):
                 return []
             cage = [cage]
 
-        self.visits.mask_data([t_start, t_end])
+        visits = self.visits.window(t_start, t_end)
         out = []
         for mouse in mice:
-            addresses = self.get_visit_addresses(mouse)
-            start_times = self.get_starttimes(mouse)
-            end_times = self.get_endtimes(mouse)
-            durations = self.get_visit_durations(mouse)
+            addresses = visits.get_visit_addresses(mouse).tolist()
+            start_times = visits.get_starttimes(mouse).tolist()
+            end_times = visits.get_endtimes(mouse).tolist()
+            durations = visits.get_durations(mouse).tolist()
             for i, a in enumerate(addresses):
                 if a in cage:
                     visit = ufl.NamedDict("Visit_%s_%d" % (mouse, i),
@@ -211,6 +570,39 @@ class EcoHabDataBase(object):
                     out.append(visit)
         return sorted(out, key=lambda o: o["t_start"])
 
+    def _get_visits_array(self, mice, cage, t_start, t_end):
+        """Select visits of get_visits with boolean masks on visit
+        columns and return them as a structured array."""
+        if mice is None:
+            mice = self.get_mice()
+        elif isinstance(mice, str):
+            if mice not in self.mice:
+                print("Could not find animal %s" % mice)
+            mice = [mice]
+        if cage is None:
+            cage = self.cages
+        if t_start is None:
+            t_start = self.session_start
+        if t_end is None:
+            t_end = self.session_end
+        visits = self.visits
+        rows = visits.time_rows(t_start, t_end)
+        codes = visits.codes[rows]
+        starts = codes["AbsStartTimecode"]
+        selected = ((starts >= t_start) & (starts < t_end)
+                    & (visits.positions("Tag", mice)[codes["Tag"]] >= 0)
+                    & (visits.positions("Address", cage)[codes["Address"]]
+                       >= 0))
+        codes = codes[selected]
+        codes = codes[np.argsort(codes["AbsStartTimecode"], kind="stable")]
+        out = np.empty(len(codes), dtype=ufl.VISIT_RECORD_DTYPE)
+        out["mouse"] = visits.categories["Tag"][codes["Tag"]]
+        out["address"] = visits.categories["Address"][codes["Address"]]
+        out["t_start"] = codes["AbsStartTimecode"]
+        out["t_end"] = codes["AbsEndTimecode"]
+        out["duration"] = codes["VisitDuration"]
+        return out
+
     def get_registration_stats(self, mouse, t_start,
                                t_end, antenna, binsize):
         """Count number and combined durations of registrations of a mouse tag
@@ -235,23 +627,58 @@ class EcoHabDataBase(object):
               durations (ms) of tag registrations by the antenna in consecutive
               bins
         """
-        count_in_bins = []
-        durations_in_bins = []
-        t_s = t_start
-        while t_s < t_end:
-            t_e = t_s + binsize
-            self.mask_data(t_s, t_e)
-            antennas = self.get_antennas(mouse)
-            indices = np.where(np.array(antennas) == antenna)[0]
-            count_in_bins.append(len(indices))
-            durations = self.get_durations(mouse)
-            sum_time = 0
-            for ind in indices:
-                sum_time += durations[ind]
-            durations_in_bins.append(sum_time/1000)
-            self.unmask_data()
-            t_s = t_e
-        return count_in_bins, durations_in_bins
+        count, durations = self.get_registration_stats_array(mouse,
+                                                             antenna,
+                                                             t_start, t_end,
+                                                             binsize)
+        return count[0, 0].tolist(), durations[0, 0].tolist()
+
+    def get_registration_stats_array(self, mice, antennas, t_start,
+                                     t_end, binsize):
+        """Count number and combined durations of registrations of mouse tags
+        by antennas in bins of size binsize for tags registered in a time
+        interval (t_start, t_end). The last bin can end after t_end.
+
+        Args:
+        mice: string or list of strings
+        antennas: string or list of strings
+           antenna ids
+        t_start: float
+           begining of the time interval (calculated from epoch)
+        t_end: float
+           end of the time interval (calculated from epoch)
+        binsize: float
+           bin length
+
+        Returns:
+           count: int array of shape (mice, antennas, bins)
+              count of tag registrations by antennas in consecutive bins
+           durations: float array of shape (mice, antennas, bins)
+              durations (s) of tag registrations by antennas in consecutive
+              bins
+        """
+        if isinstance(mice, basestring):
+            mice = [mice]
+        if not isinstance(antennas, (list, tuple, np.ndarray)):
+            antennas = [antennas]
+        n_bins = max(utils.get_length(t_start, t_end, binsize), 0)
+        shape = (len(mice), len(antennas), n_bins)
+        edges = t_start + binsize*np.arange(n_bins + 1)
+        rows = self.registrations.time_rows(edges[0], edges[-1])
+        codes = self.registrations.codes[rows]
+        mouse_idx = self.registrations.positions("Tag", mice)[codes["Tag"]]
+        antenna_idx = self.registrations.positions("Antenna",
+                                                   antennas)[codes["Antenna"]]
+        bins = np.searchsorted(edges, codes["Time"], side="right") - 1
+        keep = ((mouse_idx >= 0) & (antenna_idx >= 0)
+                & (bins >= 0) & (bins < n_bins))
+        flat = np.ravel_multi_index((mouse_idx[keep], antenna_idx[keep],
+                                     bins[keep]), shape)
+        size = int(np.prod(shape))
+        count = np.bincount(flat, minlength=size).reshape(shape)
+        durations = np.bincount(flat, weights=codes["Duration"][keep],
+                                minlength=size).reshape(shape)/1000
+        return count, durations
 
 
 class Loader(EcoHabDataBase):
@@ -289,7 +716,11 @@ class Loader(EcoHabDataBase):
            Loader will read in data registed between mask[0] and mask[1].
            mask[0] and mask[1] need to be expressed seconds from the epoch,
            since Loader converts animal tag registration times to seconds
-           since the epoch. By default the whole data is saved by Loader.
+           since the epoch. Data files recorded outside the mask (according
+           to their names) are not read in, unless check_for_ghost_tags
+           is True (ghost tags are found using registrations of the whole
+           experiment), and diagnostics cover only the masked
+           registrations. By default the whole data is saved by Loader.
         visit_threshold: float
            visits shorter than visit_threshold will be rejected
            Default value is 2 s (parameter based on mouse behavior)
@@ -311,11 +742,58 @@ class Loader(EcoHabDataBase):
            Animal tag registrations to be kept in loaded data (all other tag
            registrations will be removed). By default no registrations are
            removed.
+        check_for_ghost_tags: True or False
+           Remove registrations of tags, which were registered less than
+           ghost_tag_appearances times (ghost tags). legal_tags are then
+           ignored. By default ghost tags are not removed.
+        ghost_tag_appearances: int
+           Minimum number of registrations of a tag, which is not a ghost
+           tag. Default 50.
+        ghost_tag_days: float or None
+           If provided, registrations of tags are counted in consecutive
+           periods of ghost_tag_days days and tags registered less than
+           ghost_tag_appearances times in every period are removed.
+           By default registrations are counted in the whole experiment.
         add_date: True or False
            Add analysis date to results directory filename.
            As a default current date will be added.
+        workers: int or None
+           Number of processes reading in data files and calculating
+           visits. With workers larger than 1 data files are parsed
+           and visits of different animals are calculated in parallel,
+           None uses all available cores. By default data files are read
+           in one after another.
+        cache: True, False or string
+           Keep parsed registrations in a binary cache (by default
+           in path/.pyEcoHAB_cache, a string value specifies a different
+           cache directory). Next time the same data set is loaded
+           registrations are read in from the cache and only new
+           or modified data files are parsed. The cache is rebuilt,
+           if legal_tags, remove_antennas or ghost tag parameters change.
+           By default no cache is used.
+        rebuild_cache: True or False
+           Parse all data files and overwrite the cache.
+        memmap_after_load: True, False or string
+           Once the data is loaded, move registrations and visits
+           to memory-mapped files (by default in path/.pyEcoHAB_memmap,
+           a string value specifies a different directory). Queries
+           then read in only the parts of the files with requested
+           animals and time windows. Data files are still parsed
+           in memory, so this lowers the memory used after loading,
+           not the peak memory used while loading.
+           By default the data is kept in memory.
+        diagnostics: "eager", "lazy" or "off"
+           With "eager" diagnostics of antenna registrations are
+           calculated and saved in res_dir while loading data. With "lazy"
+           diagnostics are calculated, when get_diagnostics
+           or save_diagnostics is called for the first time. "off" turns
+           diagnostics off. Default "eager".
     """
     MAX_BREAK = 3*3600
+    GHOST_TAG_APPEARANCES = 50
+    SAVED_ATTRIBUTES = EcoHabDataBase.SAVED_ATTRIBUTES + (
+        "path", "chip_name", "ghost_tag_appearances", "ghost_tag_days",
+        "_fnames", "_legal_tags", "_ghost_tags", "_remove_antennas")
     internal_antennas = []
 
     def __init__(self, path, **kwargs):
@@ -335,6 +813,9 @@ class Loader(EcoHabDataBase):
         res_dir = kwargs.pop("res_dir", "Results")
         self.prefix = kwargs.pop("prefix", ufl.make_prefix(self.path))
         self.max_break = kwargs.pop("max_break", self.MAX_BREAK)
+        self.workers = kwargs.pop("workers", 1)
+        self.diagnostics = self._check_diagnostics(kwargs.pop("diagnostics",
+                                                              "eager"))
 
         remove_antennas = kwargs.pop('remove_antennas', [])
         tags = kwargs.pop('legal_tags', "ALL")
@@ -344,55 +825,351 @@ class Loader(EcoHabDataBase):
         self.res_dir = ufl.results_path(self.path, res_dir)
         # Read in data
         ghost_tags = kwargs.pop("check_for_ghost_tags", False)
-        rawdata = self._read_in_raw_data(tags, ghost_tags)
-        data = ufl.from_raw_data(rawdata)
-        data = ufl.remove_antennas(data, remove_antennas)
+        self.ghost_tag_appearances = kwargs.pop("ghost_tag_appearances",
+                                                self.GHOST_TAG_APPEARANCES)
+        self.ghost_tag_days = kwargs.pop("ghost_tag_days", None)
+        cache = kwargs.pop("cache", False)
+        rebuild_cache = kwargs.pop("rebuild_cache", False)
+        memmap = kwargs.pop("memmap_after_load", False)
+        if cache:
+            if not isinstance(cache, str):
+                cache = os.path.join(self.path, ufl.CACHE_DIR)
+            data = self._read_in_cached_data(tags, ghost_tags,
+                                             remove_antennas, cache,
+                                             rebuild_cache)
+        else:
+            data = self._read_in_raw_data(tags, ghost_tags, remove_antennas)
+        if self.mask:
+            # diagnostics cover the loaded time window
+            data = ufl.mask_registrations(data, self.mask)
+        self._legal_tags = tags
+        self._ghost_tags = ghost_tags
+        self._remove_antennas = remove_antennas
         # As in antenna registrations
-        ufl.run_diagnostics(data, self.max_break, self.res_dir,
-                            antennas)
+        if self.diagnostics == "eager":
+            self._diagnostics = ufl.diagnostics_counts(data, antennas,
+                                                       self.max_break)
+            ufl.save_diagnostics(self._diagnostics, self.res_dir)
         super(Loader, self).__init__(data, self.mask,
-                                     self.visit_threshold, antennas)
-        self.cages = antennas.cages
-        self.directions = antennas.directions
-        self.backing = antennas.backing
-        self.setup_config = antennas
-        self.all_antennas = antennas.all_antennas
-        self.internal_antennas = antennas.internal_antennas
-        self.setup_name = antennas.name
-        self.home_antenna = antennas.homecage_antenna
-        self.home_internal_antennas = antennas.homecage_internal_antennas
-        self.stimulus_internal_antennas = antennas.stimCage_internal_antennas
-
-    def _read_in_raw_data(self, tags, ghost_tags):
-        """Reads in data from files in self.path.
-        Removes ghost tags from data"""
-        raw_data = []
-        days = set()
+                                     self.visit_threshold, antennas,
+                                     self.workers)
+        if memmap:
+            if not isinstance(memmap, str):
+                memmap = os.path.join(self.path, ufl.MEMMAP_DIR)
+            self.memory_map(memmap)
+
+    def _set_setup_config(self, setup_config):
+        super(Loader, self)._set_setup_config(setup_config)
+        self.backing = setup_config.backing
+        self.setup_name = setup_config.name
+        self.home_antenna = setup_config.homecage_antenna
+        self.home_internal_antennas = setup_config.homecage_internal_antennas
+        self.stimulus_internal_antennas = \
+            setup_config.stimCage_internal_antennas
+
+    def _read_in_files(self, fnames, chip_name=None, tags="ALL",
+                       remove_antennas=None):
+        """Reads in data files. Files recorded by a different setup
+        than chip_name (by default the setup of the first file) are
+        discarded. Only registrations of tags (unless tags is "ALL")
+        by antennas not in remove_antennas are read in. Returns a list
+        of registrations (None for discarded files) and chip_name."""
+        out = []
+        legal_tags = None
+        if isinstance(tags, str) and tags != "ALL":
+            legal_tags = [tags]
+        elif not isinstance(tags, str):
+            legal_tags = list(tags)
+        if remove_antennas is not None and not isinstance(remove_antennas,
+                                                          list):
+            remove_antennas = [remove_antennas]
+        all_files = ufl.read_files(self.path, fnames, self.workers,
+                                   legal_tags, remove_antennas)
+        for f_name, (raw_inside, setup) in zip(fnames, all_files):
+            if chip_name is None:
+                chip_name = setup
+            if setup != chip_name:
+                print("%s is from another dataset. Discarding" % f_name)
+                out.append(None)
+                continue
+            out.append(raw_inside)
+        return out, chip_name
+
+    def _read_in_raw_data(self, tags, ghost_tags, remove_antennas):
+        """Reads in data from files in self.path, skipping files recorded
+        outside self.mask. Removes ghost tags and registrations
+        by remove_antennas from data and returns registrations sorted
+        by registration time."""
+        self._fnames = ufl.get_filenames(self.path)
+        if not len(self._fnames):
+            raise Exception("empty directory %s" % self.path)
+        fnames = self._fnames
+        # ghost tags are found using all the registrations, so with
+        # ghost_tags all the files are read in and masked afterwards
+        if self.mask and not ghost_tags:
+            fnames = ufl.filter_fnames(fnames, self.mask)
+            if not len(fnames):
+                raise Exception("no data files in %s recorded within %s" %
+                                (self.path, self.mask))
+        if ghost_tags:
+            raw_data, chip_name = self._read_in_files(fnames)
+        else:
+            raw_data, chip_name = self._read_in_files(fnames, None, tags,
+                                                      remove_antennas)
+        raw_data = [raw for raw in raw_data if raw is not None]
+        data = np.concatenate(raw_data)
+        if ghost_tags:
+            data = ufl.remove_ghost_tags(data, tags, ghost_tags,
+                                         self.ghost_tag_appearances,
+                                         self.ghost_tag_days)
+            data = ufl.remove_antennas(data, remove_antennas)
+        data = data[np.argsort(data["Time"], kind="stable")]
+        print("Read in %d files from setup %s" % (len(raw_data), chip_name))
+        self.chip_name = chip_name
+        return data
+
+    def _filter_files(self, raw_data, tags, ghost_tags, remove_antennas):
+        """Removes ghost tags and registrations by remove_antennas
+        from registrations read in from every data file. Returns
+        registrations and indices of data files, they were read in from,
+        sorted by registration time."""
+        if ghost_tags:
+            all_data = np.concatenate([raw for raw in raw_data
+                                       if raw is not None])
+            tags = ufl.find_legal_tags(all_data["Tag"], all_data["Time"],
+                                       self.ghost_tag_appearances,
+                                       self.ghost_tag_days)
+        data = []
+        file_index = []
+        for i, raw in enumerate(raw_data):
+            if raw is None:
+                continue
+            raw = ufl.remove_ghost_tags(raw, legal_tags=tags)
+            raw = ufl.remove_antennas(raw, remove_antennas)
+            data.append(raw)
+            file_index.append(np.full(len(raw), i, dtype=np.int32))
+        return data, file_index
+
+    def _read_in_cached_data(self, tags, ghost_tags, remove_antennas,
+                             cache_dir, rebuild=False):
+        """Reads in registrations from the cache in cache_dir. Only data
+        files that are new or were modified after the cache was saved
+        are parsed. Returns registrations sorted by registration time."""
         self._fnames = ufl.get_filenames(self.path)
         if not len(self._fnames):
             raise Exception("empty directory %s" % self.path)
-        setup_set = set()
-        counter = 0
-        for f_name in self._fnames:
-            raw_inside, setup = ufl.read_single_file(self.path, f_name)
-            if setup not in setup_set:
-                if len(setup_set) == 0:
-                    setup_set.add(setup)
-                    counter = 1
-                else:
-                    print("%s is from another dataset. Discarding" %f_name)
-                    continue
-
-            raw_data += raw_inside
-            counter += 1
-            days.add(f_name.split('_')[0])
-        data = ufl.remove_ghost_tags(raw_data,
-                                     legal_tags=tags, ghost_tags=ghost_tags)
-        data.sort(key=lambda x: ufl.time_to_sec(x[1]))
-        print("Read in %d files from setup %s" % (counter, list(setup_set)[0]))
-        self.chip_name = list(setup_set)[0]
+        settings = ufl.cache_settings(tags, ghost_tags, remove_antennas,
+                                      self.ghost_tag_appearances,
+                                      self.ghost_tag_days)
+        fingerprints = ufl.file_fingerprints(self.path, self._fnames)
+        positions = {f_name: i for i, f_name in enumerate(self._fnames)}
+        cached = None
+        if not rebuild:
+            cached = ufl.load_registration_cache(cache_dir)
+        if cached is not None and cached[2]["settings"] != settings:
+            cached = None
+        chip_name = None
+        data = []
+        file_index = []
+        to_read = self._fnames
+        if cached is not None:
+            old_data, old_index, manifest = cached
+            chip_name = manifest["chip_name"]
+            kept = {}
+            for i, f_info in enumerate(manifest["files"]):
+                name = f_info["name"]
+                if fingerprints.get(name) == f_info["fingerprint"]:
+                    kept[i] = positions[name]
+            kept_files = set(kept.values())
+            to_read = [f_name for f_name in self._fnames
+                       if positions[f_name] not in kept_files]
+            if not to_read and len(kept) == len(manifest["files"]):
+                print("Read in %d files from cache %s" %
+                      (len(self._fnames), cache_dir))
+                self.chip_name = chip_name
+                return np.array(old_data)
+            if ghost_tags:
+                # ghost tags are found using all the registrations
+                chip_name = None
+                to_read = self._fnames
+            else:
+                keep = np.isin(old_index, list(kept.keys()))
+                data.append(old_data[keep])
+                remap = np.zeros(len(manifest["files"]), dtype=np.int32)
+                for old, new in kept.items():
+                    remap[old] = new
+                file_index.append(remap[old_index[keep]])
+        if ghost_tags:
+            raw_data, chip_name = self._read_in_files(to_read, chip_name)
+        else:
+            raw_data, chip_name = self._read_in_files(to_read, chip_name,
+                                                      tags, remove_antennas)
+        new_data, new_index = self._filter_files(raw_data, tags, ghost_tags,
+                                                 remove_antennas)
+        ranks = np.array([positions[f_name] for f_name in to_read],
+                         dtype=np.int32)
+        data += new_data
+        file_index += [ranks[idx] for idx in new_index]
+        data = np.concatenate(data)
+        file_index = np.concatenate(file_index)
+        order = np.lexsort((file_index, data["Time"]))
+        data = data[order]
+        file_index = file_index[order]
+        manifest = {"settings": settings,
+                    "chip_name": chip_name,
+                    "files": [{"name": f_name,
+                               "fingerprint": fingerprints[f_name]}
+                              for f_name in self._fnames]}
+        try:
+            ufl.save_registration_cache(cache_dir, data, file_index,
+                                        manifest)
+        except (IOError, OSError) as e:
+            print("Could not save cache in %s: %s" % (cache_dir, e))
+        print("Read in %d files from setup %s" % (len(to_read), chip_name))
+        self.chip_name = chip_name
         return data
 
+    def _read_in_new_files(self):
+        """Reads in data files, which appeared in self.path after
+        loading the data, and removes registrations the same way as
+        Loader does. Returns new registrations sorted
+        by registration time."""
+        new_fnames = [f_name for f_name in ufl.get_filenames(self.path)
+                      if f_name not in self._fnames]
+        skipped = []
+        if self.mask:
+            to_read = ufl.filter_fnames(new_fnames, self.mask)
+            skipped = [f_name for f_name in new_fnames
+                       if f_name not in to_read]
+            new_fnames = to_read
+        if self._ghost_tags:
+            # ghost tags are found in the whole experiment, new tags
+            # registered for a couple of hours would be removed anyway
+            tags = self.mice
+        else:
+            tags = self._legal_tags
+        raw_data, chip_name = self._read_in_files(new_fnames, self.chip_name,
+                                                  tags,
+                                                  self._remove_antennas)
+        fnames = [f_name for f_name, raw in zip(new_fnames, raw_data)
+                  if raw is not None]
+        raw_data = [raw for raw in raw_data if raw is not None]
+        self._fnames = self._fnames + skipped + fnames
+        if not len(raw_data):
+            return np.array([], dtype=ufl.REGISTRATION_DTYPE)
+        data = np.concatenate(raw_data)
+        if self._ghost_tags:
+            data = ufl.remove_ghost_tags(data, legal_tags=self._legal_tags)
+        print("Read in %d new files from setup %s" % (len(raw_data),
+                                                      chip_name))
+        data = data[np.argsort(data["Time"], kind="stable")]
+        if self.mask:
+            data = ufl.mask_registrations(data, self.mask)
+        return data
+
+    def refresh(self):
+        """Read in data files added to path since the data was loaded.
+
+        Registrations from new data files are appended to
+        registrations, visits (of every visit threshold already
+        calculated) are recalculated starting from the last
+        visit of every animal registered in the new files, diagnostics
+        are updated (if they were already calculated). Use refresh
+        to analyze experiments, which are still recording, without
+        reading in all the data again.
+
+        Returns:
+           number of new registrations
+        """
+        new_data = self._read_in_new_files()
+        if not len(new_data):
+            return 0
+        times = self.registrations.column("Time")
+        if new_data["Time"][0] < times[-1]:
+            # new files are not a continuation of the experiment
+            data = np.concatenate([self.registrations.data, new_data])
+            data = data[np.argsort(data["Time"], kind="stable")]
+            if self._diagnostics is not None:
+                self._diagnostics = ufl.diagnostics_counts(data,
+                                                           self.setup_config,
+                                                           self.max_break)
+            self.registrations.data = data
+            self.mice = self.get_mice()
+            # visits are calculated again on the next query
+            self._visits_cache = {}
+        else:
+            new_mice = sorted(set(new_data["Tag"]))
+            if self._diagnostics is not None:
+                last_registrations = self.registrations.last_rows(new_mice)
+                last_registrations.sort(order="Time")
+                ufl.update_diagnostics(self._diagnostics, last_registrations,
+                                       new_data, self.setup_config,
+                                       self.max_break)
+            old_mice = self.mice
+            self.registrations.append(new_data)
+            self.mice = self._sort_mice(set(self.mice) | set(new_mice))
+            for threshold, visits in self._visits_cache.items():
+                self._update_visits(visits, threshold, new_data, new_mice,
+                                    old_mice)
+        if self.diagnostics == "eager":
+            ufl.save_diagnostics(self._diagnostics, self.res_dir)
+        if self.memmap_dir is not None:
+            self.memory_map(self.memmap_dir)
+        self.session_end = float(self.registrations.column("Time")[-1])
+        if self.registrations.mask is not None:
+            self.registrations.mask_data(self.registrations.mask)
+        for visits in self._visits_cache.values():
+            if visits.mask is not None:
+                visits.mask_data(visits.mask)
+        return len(new_data)
+
+    def _update_visits(self, visits, threshold, new_data, new_mice,
+                       old_mice):
+        """Recalculate visits of new_mice with registrations of new_data
+        appended to the registrations. Visits are updated in place."""
+        times = self.registrations.column("Time")
+        codes = visits.codes
+        # visits of an animal can change starting from its last visit
+        tags, idx = np.unique(codes["Tag"][::-1], return_index=True)
+        last_visit = dict(zip(visits.categories["Tag"][tags],
+                              codes["AbsStartTimecode"][::-1][idx]))
+        restart = {}
+        for mouse in new_mice:
+            if mouse in last_visit:
+                restart[mouse] = last_visit[mouse]
+            elif mouse in old_mice:
+                restart[mouse] = times[0]
+            else:
+                restart[mouse] = new_data["Time"][0]
+        first = np.searchsorted(times, min(restart.values()))
+        tail = self.registrations.decode(slice(first, None))
+        keep = np.ones(len(codes), dtype=bool)
+        mouse_data = []
+        for mouse in new_mice:
+            keep &= ~(np.isin(codes["Tag"], visits.code("Tag", mouse))
+                      & (codes["AbsStartTimecode"] >= restart[mouse]))
+            mouse_data.append(tail[(tail["Tag"] == mouse)
+                                   & (tail["Time"] >= restart[mouse])])
+        mouse_ids = np.repeat(np.arange(len(new_mice)),
+                              [len(data) for data in mouse_data])
+        mouse_data = np.concatenate(mouse_data)
+        antenna_names, antennas = np.unique(mouse_data["Antenna"],
+                                            return_inverse=True)
+        visits.codes = codes[keep]
+        visits.append(self._animal_positions(mouse_data["Time"], antennas,
+                                             antenna_names, mouse_ids,
+                                             new_mice, self.setup_config,
+                                             [threshold])[0])
+        # visits are sorted as in _calculate_animal_positions
+        codes = visits.codes
+        mouse_order = np.array([self.mice.index(tag) if tag in self.mice
+                                else -1
+                                for tag in visits.categories["Tag"]],
+                               dtype=int)
+        ranks = mouse_order[codes["Tag"]]
+        order = np.lexsort((ranks, codes["AbsStartTimecode"]))
+        visits.codes = codes[order]
+
     def __repr__(self):
         """Nice string representation for printing this class."""
         mystring = 'Eco-HAB data loaded from:\n%s\nin the folder%s\n' % (
@@ -445,19 +1222,34 @@ class Merger(EcoHabDataBase):
 
     loaders:
         Eco-HAB datasets
+
+    workers: int or None
+        number of processes calculating visits of animals, None uses
+        all available cores. Default 1.
+
+    diagnostics: "eager", "lazy" or "off"
+        calculate and save diagnostics of merged antenna registrations
+        while merging ("eager"), on the first call of get_diagnostics
+        or save_diagnostics ("lazy") or never ("off"). Default "eager".
     """
-    def __init__(self, experiment_config, res_dir, *loaders, prefix=None):
-        datasets = []
+    def __init__(self, experiment_config, res_dir, *loaders, prefix=None,
+                 workers=1, diagnostics="eager"):
+        self.diagnostics = self._check_diagnostics(diagnostics)
+        registrations = []
+        setup_names = []
         configs = {}
         max_breaks = []
         for loader in loaders:
             setup_name = loader.setup_name
             configs[setup_name] = loader.setup_config
-            datasets.append(ufl.rename_antennas(setup_name,
-                                                loader.registrations.data))
+            registrations.append(loader.registrations)
+            setup_names.append(setup_name)
             max_breaks.append(loader.max_break)
 
-        data = ufl.append_data_sources(datasets)
+        codes, categories = ufl.merge_registrations(registrations,
+                                                    setup_names)
+        data = BaseFunctions.Data.from_codes(codes, categories,
+                                             registrations[0].dtype)
         mask = None
         self.visit_threshold = max([d.visit_threshold for d in loaders])
         if isinstance(prefix, str):
@@ -468,12 +1260,8 @@ class Merger(EcoHabDataBase):
         self.res_dir = "%s_%s" % (res_dir, today)
         antennas = ExperimentSetupConfig(experiment_config, **configs)
         super(Merger, self).__init__(data, mask,
-                                     self.visit_threshold, antennas)
-        self.cages = antennas.cages
-        self.directions = antennas.directions
-        self.setup_config = antennas
-        self.all_antennas = antennas.all_antennas
-        self.internal_antennas = antennas.internal_antennas
+                                     self.visit_threshold, antennas,
+                                     workers)
         self.max_break = max(max_breaks)
-        ufl.run_diagnostics(data, self.max_break, self.res_dir,
-                            antennas)
+        if self.diagnostics == "eager":
+            self.save_diagnostics()
@@ -2,10 +2,17 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
 import os
+import io
 import glob
 import sys
+from collections import deque
+import numpy as np
 
 from pyEcoHAB import data_path
+from .utils import general as utils
+from .utils.general import PAIR_ALLOWED, PAIR_SKIPPED_ONE
+from .utils.general import PAIR_SKIPPED_TWO, PAIR_SKIPPED_MORE
+from .utils.general import HOP_UNREACHABLE
 
 if sys.version_info < (3, 0):
     from ConfigParser import RawConfigParser, DuplicateSectionError
@@ -24,6 +31,25 @@ class SetupConfigMethods(RawConfigParser):
     def __init__(self):
         RawConfigParser.__init__(self)
 
+    def to_text(self):
+        """
+        Return the setup configuration in the config file format.
+        """
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    @classmethod
+    def from_text(cls, text):
+        """
+        Create the setup configuration from text returned by to_text.
+        """
+        config = cls.__new__(cls)
+        SetupConfigMethods.__init__(config)
+        config.read_string(text)
+        config.make_definitions()
+        return config
+
     def make_definitions(self):
         """
         Find all necessary parameters.
@@ -33,12 +59,149 @@ class SetupConfigMethods(RawConfigParser):
         self.tunnels_dict = self.get_tunnels_dict()
         self.same_tunnel = self.get_same_tunnel()
         self.same_address = self.get_same_address()
+        self.build_graph()
         self.opposite_tunnel = self.get_opposite_tunnel_dict()
         self.address = self.get_cage_address_dict()
         self.address_non_adjacent = self.get_address_non_adjacent_dict()
         self.address_surrounding = self.get_surrounding_dict()
         self.directions = self.get_directions_list()
         self.backing = self.get_backing_list()
+        self.compile_tables()
+
+    def build_graph(self):
+        """
+        Build a graph of antennas and compartments (cages and tunnels)
+        and find shortest hop distances between all antennas.
+
+        compartment_graph: a dictionary listing for every antenna
+           the compartments it is an entrance to or is inside of, and for
+           every compartment its antennas
+        hop_distance: antenna x antenna integer array (rows and columns
+           follow all_antennas, antenna_codes gives the index of an antenna)
+           of the number of compartments an animal has to cross to get
+           from one antenna to the other: 0 for the same antenna, 1 for
+           antennas at the same compartment, 2 if one antenna was skipped
+           and so on. HOP_UNREACHABLE for antennas, which are not
+           connected.
+        """
+        self.antenna_codes = {antenna: i for i, antenna
+                              in enumerate(self.all_antennas)}
+        graph = {antenna: [] for antenna in self.all_antennas}
+        compartments = sorted(self.cages_dict.items())
+        compartments += sorted(self.tunnels_dict.items())
+        for compartment, antennas in compartments:
+            graph[compartment] = []
+            for antenna in antennas:
+                if compartment not in graph[antenna]:
+                    graph[antenna].append(compartment)
+                    graph[compartment].append(antenna)
+        self.compartment_graph = graph
+        size = len(self.all_antennas)
+        self.hop_distance = np.full((size, size), HOP_UNREACHABLE,
+                                    dtype=int)
+        for i, antenna in enumerate(self.all_antennas):
+            self.hop_distance[i] = self._breadth_first(antenna)
+
+    def _breadth_first(self, antenna):
+        out = np.full(len(self.all_antennas), HOP_UNREACHABLE, dtype=int)
+        out[self.antenna_codes[antenna]] = 0
+        visited = set([antenna])
+        queue = deque([antenna])
+        while queue:
+            current = queue.popleft()
+            hops = out[self.antenna_codes[current]] + 1
+            for compartment in self.compartment_graph[current]:
+                if compartment in visited:
+                    continue
+                visited.add(compartment)
+                for neighbour in self.compartment_graph[compartment]:
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        out[self.antenna_codes[neighbour]] = hops
+                        queue.append(neighbour)
+        return out
+
+    def hops(self, antennas_1, antennas_2):
+        """
+        Return the smallest hop distance between any antenna from
+        antennas_1 and any antenna from antennas_2, HOP_UNREACHABLE
+        if they are not connected.
+        """
+        idx_1 = [self.antenna_codes[antenna] for antenna in antennas_1]
+        idx_2 = [self.antenna_codes[antenna] for antenna in antennas_2]
+        hops = self.hop_distance[np.ix_(idx_1, idx_2)]
+        hops = hops[hops != HOP_UNREACHABLE]
+        if not len(hops):
+            return HOP_UNREACHABLE
+        return int(hops.min())
+
+    def _pairs_at(self, condition):
+        rows, cols = np.nonzero(condition(self.hop_distance))
+        return sorted("%s %s" % (self.all_antennas[i], self.all_antennas[j])
+                      for i, j in zip(rows, cols))
+
+    def compile_tables(self):
+        """
+        Find antenna pairs of every kind once and tabulate them
+        as antenna x antenna integer arrays. Rows and columns follow
+        all_antennas (antenna_codes gives the index of an antenna):
+
+        pair_category: PAIR_ALLOWED, PAIR_SKIPPED_ONE, PAIR_SKIPPED_TWO
+           or PAIR_SKIPPED_MORE, derived from hop_distance
+        destination, destination_valid: index (in addresses) and validity
+           of the visit following registrations by the pair of antennas
+           (see utils.get_antenna_transitions)
+        """
+        self._pairs = {}
+        self._pairs["all_pairs"] = self._find_all_pairs()
+        self._pairs["all_unique_pairs"] = self._find_all_unique_pairs()
+        self._pairs["allowed"] = self._find_allowed_pairs()
+        self._pairs["skipped_one"] = self._find_skipped_one()
+        self._pairs["skipped_two"] = self._find_skipped_two()
+        self._pairs["skipped_more"] = self._find_skipped_more()
+        self._pairs["mismatched"] = self._find_mismatched_pairs()
+        self._pairs["tunnel_pairs"] = self._find_tunnel_pairs()
+        self._pairs["cage_pairs"] = self._find_cage_pairs()
+        self.pair_category = np.full(self.hop_distance.shape,
+                                     PAIR_SKIPPED_MORE, dtype=np.int8)
+        for hops, category in [(0, PAIR_ALLOWED), (1, PAIR_ALLOWED),
+                               (2, PAIR_SKIPPED_ONE), (3, PAIR_SKIPPED_TWO)]:
+            self.pair_category[self.hop_distance == hops] = category
+        addresses, table, valid, internal = utils.get_antenna_transitions(
+            self.all_antennas, self.same_tunnel, self.same_address,
+            self.opposite_tunnel, self.address, self.address_surrounding,
+            self.address_non_adjacent, self.internal_antennas)
+        self.addresses = addresses
+        self.destination = table
+        self.destination_valid = valid
+        self.is_internal = internal
+
+    def antenna_transitions(self, antennas):
+        """
+        Return output of utils.get_antenna_transitions for antennas,
+        taken from the compiled destination table, if all antennas are
+        part of the setup.
+        """
+        antennas = list(antennas)
+        if not all(antenna in self.antenna_codes for antenna in antennas):
+            return utils.get_antenna_transitions(
+                antennas, self.same_tunnel, self.same_address,
+                self.opposite_tunnel, self.address,
+                self.address_surrounding, self.address_non_adjacent,
+                self.internal_antennas)
+        idx = np.array([self.antenna_codes[antenna] for antenna in antennas],
+                       dtype=int)
+        return (list(self.addresses), self.destination[np.ix_(idx, idx)],
+                self.destination_valid[np.ix_(idx, idx)],
+                self.is_internal[idx])
+
+    def pair_codes(self, antennas):
+        """
+        Return indices of antennas in compiled tables, -1 for antennas
+        that are not part of the setup.
+        """
+        return np.array([self.antenna_codes.get(antenna, -1)
+                         for antenna in antennas], dtype=int)
 
     def get_all_antennas(self):
         """
@@ -204,46 +367,19 @@ class SetupConfigMethods(RawConfigParser):
                     out.extend(other_pipe)
         return sorted(out)
 
-    def _go_two_steps(self, antenna):
-        """
-        Return antennas in tunnels that are two cages away to the right.
-        """
-        out = []
-        for ant_2 in self.other_cage_antenna(antenna):
-            if ant_2 in self.internal_antennas:
-                continue
-            pipes_next = self.other_tunnel_antenna(ant_2)
-            for ant_3 in pipes_next:
-                if ant_3 in self.internal_antennas:
-                    continue
-                cage_plus_2 = self.other_cage_antenna(ant_3)
-                for ant_4 in cage_plus_2:
-                    if ant_4 in self.internal_antennas:
-                        continue
-                    tunnel_antennas = self.same_tunnel[ant_4]
-                    next_tunnel_antennas = self.next_tunnel_antennas(ant_4)
-                    if antenna not in tunnel_antennas\
-                       and antenna not in next_tunnel_antennas:
-                        out += tunnel_antennas
-        return list(set(out))
-
     def get_opposite_tunnel_dict(self):
         """
         Find antennas in tunnels that are two cages away
         from current entrance antenna.
         """
-        # distance equal two
-        all_antennas = self.entrance_antennas
+        # two tunnels away: 3 hops between the closest antennas of tunnels
         out = {}
-        for ant_1 in all_antennas:
-            out_this_antenna = self._go_two_steps(ant_1)
-            other_tunnel_ants = self.other_tunnel_antenna(ant_1)
-            out_other_tunnel_ants = []
-            for ant_2 in other_tunnel_ants:
-                out_other_tunnel_ants += self._go_two_steps(ant_2)
-            if len(out_this_antenna + out_other_tunnel_ants):
-                out[ant_1] = sorted(list(set(out_this_antenna +
-                                             out_other_tunnel_ants)))
+        for ant_1 in self.entrance_antennas:
+            tunnel_1 = self.same_tunnel.get(ant_1, [ant_1])
+            opposite = [ant_2 for ant_2, tunnel_2 in self.same_tunnel.items()
+                        if self.hops(tunnel_1, tunnel_2) == 3]
+            if len(opposite):
+                out[ant_1] = sorted(opposite)
         return out
 
     def get_cage_address_dict(self):
@@ -343,6 +479,9 @@ class SetupConfigMethods(RawConfigParser):
         that could register a tag. Pairs are coded as a string with both
         antenna codes separated by white space.
         """
+        return list(self._pairs["mismatched"])
+
+    def _find_mismatched_pairs(self):
         pairs = []
         for i, a1 in enumerate(self.all_antennas):
             for a2 in self.all_antennas[i+1:]:
@@ -420,34 +559,22 @@ class SetupConfigMethods(RawConfigParser):
         return sorted(out)
 
     def allowed_pairs(self):
-        allowed = []
-        for antenna in self.all_antennas:
-            allowed.append("%s %s" % (antenna, antenna))
-            for antenna2 in self.other_cage_antenna(antenna):
-                allowed.append("%s %s" % (antenna, antenna2))
-            if antenna in self.internal_antennas:
-                continue
-            for antenna2 in self.other_tunnel_antenna(antenna):
-                allowed.append("%s %s" % (antenna, antenna2))
-        return sorted(allowed)
+        return list(self._pairs["allowed"])
+
+    def _find_allowed_pairs(self):
+        return self._pairs_at(lambda hops: (hops == 0) | (hops == 1))
 
     def skipped_one(self):
-        skipped_one = []
-        for antenna in self.all_antennas:
-            for antenna2 in self.other_cage_antenna(antenna):
-                if antenna2 in self.internal_antennas:
-                    continue
-                for antenna3 in self.other_tunnel_antenna(antenna2):
-                    skipped_one.append("%s %s" % (antenna, antenna3))
-                    skipped_one.append("%s %s" % (antenna3, antenna))
-            for antenna2 in self.other_tunnel_antenna(antenna):
-                for antenna3 in self.other_cage_antenna(antenna2):
-                    skipped_one.append("%s %s" % (antenna, antenna3))
-                    skipped_one.append("%s %s" % (antenna3, antenna))
-        return sorted(set(skipped_one))
+        return list(self._pairs["skipped_one"])
+
+    def _find_skipped_one(self):
+        return self._pairs_at(lambda hops: hops == 2)
 
     @property
     def all_unique_pairs(self):
+        return list(self._pairs["all_unique_pairs"])
+
+    def _find_all_unique_pairs(self):
         pairs = []
         for i, antenna1 in enumerate(self.all_antennas):
             for antenna2 in self.all_antennas[i:]:
@@ -457,6 +584,9 @@ class SetupConfigMethods(RawConfigParser):
 
     @property
     def all_pairs(self):
+        return list(self._pairs["all_pairs"])
+
+    def _find_all_pairs(self):
         pairs = []
         for antenna1 in self.all_antennas:
             for antenna2 in self.all_antennas:
@@ -464,34 +594,22 @@ class SetupConfigMethods(RawConfigParser):
         return pairs
 
     def skipped_two(self):
-        skipped_two = []
-        for antenna in self.all_antennas:
-            for antenna2 in self.other_cage_antenna(antenna):
-                if antenna2 in self.internal_antennas:
-                    continue
-                for antenna3 in self.other_tunnel_antenna(antenna2):
-                    for antenna4 in self.other_cage_antenna(antenna3):
-                        skipped_two.append("%s %s" % (antenna, antenna4))
-                        skipped_two.append("%s %s" % (antenna4, antenna))
-            for antenna2 in self.other_tunnel_antenna(antenna):
-                for antenna3 in self.other_cage_antenna(antenna2):
-                    if antenna3 in self.internal_antennas:
-                        continue
-                    for antenna4 in self.other_tunnel_antenna(antenna3):
-                        skipped_two.append("%s %s" % (antenna, antenna4))
-                        skipped_two.append("%s %s" % (antenna4, antenna))
-        return sorted(set(skipped_two))
+        return list(self._pairs["skipped_two"])
+
+    def _find_skipped_two(self):
+        return self._pairs_at(lambda hops: hops == 3)
 
     def skipped_more(self):
-        pairs = self.all_pairs
-        allowed = self.allowed_pairs()
-        skipped_one = self.skipped_one()
-        skipped_two = self.skipped_two()
-        for pair in allowed+skipped_one+skipped_two:
-            pairs.remove(pair)
-        return sorted(pairs)
+        return list(self._pairs["skipped_more"])
+
+    def _find_skipped_more(self):
+        return self._pairs_at(lambda hops: (hops > 3) |
+                              (hops == HOP_UNREACHABLE))
 
     def tunnel_pairs(self):
+        return list(self._pairs["tunnel_pairs"])
+
+    def _find_tunnel_pairs(self):
         out = []
         for key in self.tunnels_dict.keys():
             if len(self.tunnels_dict[key]) < 2:
@@ -503,6 +621,9 @@ class SetupConfigMethods(RawConfigParser):
         return sorted(out)
 
     def cage_pairs(self):
+        return list(self._pairs["cage_pairs"])
+
+    def _find_cage_pairs(self):
         out = []
         for key in self.cages_dict.keys():
             antennas = self.cages_dict[key]
@@ -599,6 +720,13 @@ class SetupConfig(SetupConfigMethods):
         self.read(full_path)
         self.make_definitions()
 
+    @classmethod
+    def from_text(cls, text):
+        config = super(SetupConfig, cls).from_text(text)
+        config.path = None
+        config.fname = None
+        return config
+
     @property
     def name(self):
         return self.items("setup")[0][1]
@@ -752,6 +880,23 @@ class ExperimentSetupConfig(SetupConfigMethods):
         self.ALL_ECOHAB_SETUP_ANTENNAS = self.all_antennas
         self.make_definitions()
 
+    @classmethod
+    def from_text(cls, text):
+        """
+        Create the setup configuration from text returned by to_text.
+        Sections of the text are already merged, so identity_compartments
+        and renames are empty.
+        """
+        config = cls.__new__(cls)
+        SetupConfigMethods.__init__(config)
+        config.read_string(text)
+        config.identity_compartments = {}
+        config.renames = {}
+        config.all_antennas = config.get_all_antennas()
+        config.ALL_ECOHAB_SETUP_ANTENNAS = config.all_antennas
+        config.make_definitions()
+        return config
+
     def make_sections(self, single_configs):
         setup_names = list(single_configs.keys())
         # add individual sections from each of the setup configs
@@ -84,6 +84,42 @@ def calculate_visits_and_durations(data, mice, address, t_start, t_end,
     return visits, durations, all_visits
 
 
+def calc_visit_per_mouse_index(starts, ends, t_start, t_end, binsize):
+    """Return the same as calc_visit_per_mouse for visits with sorted
+    start times and end times."""
+    length = utils.get_length(t_start, t_end, binsize)
+    edges = np.minimum(t_start + binsize*np.arange(length + 1), t_end)
+    first_visits = np.searchsorted(starts, edges, side="left")
+    visits = np.diff(first_visits).tolist()
+    visits_in_bins = []
+    for i in range(length):
+        first, last = first_visits[i], first_visits[i + 1]
+        # visit started before the bin and lasting into the bin
+        if first and ends[first - 1] > edges[i]:
+            first -= 1
+        visits_in_bins.append((np.minimum(ends[first:last], edges[i + 1])
+                               - np.maximum(starts[first:last],
+                                            edges[i])).tolist())
+    durations = [sum(o) for o in visits_in_bins]
+    return visits, durations, visits_in_bins
+
+
+def calculate_visits_and_durations_index(interval_index, mice, address,
+                                         t_start, t_end, binsize, times):
+    """Return the same as calculate_visits_and_durations for data
+    prepared for times (see utils.prepare_data), using interval index
+    of the dataset (see EcoHabDataBase.interval_index)."""
+    visits = OrderedDict()
+    durations = OrderedDict()
+    all_visits = OrderedDict()
+    for m in mice:
+        starts, ends = interval_index.get_starting_or_ending(m, address,
+                                                             *times)
+        visits[m], durations[m], all_visits[m] = calc_visit_per_mouse_index(
+            starts, ends, t_start, t_end, binsize)
+    return visits, durations, all_visits
+
+
 def get_activity(ecohab_data, timeline, binsize, res_dir="", prefix="",
                  remove_mouse="", save_histogram=False, delimiter=";",
                  headers=['Number of visits to',
@@ -190,7 +226,9 @@ def get_activity(ecohab_data, timeline, binsize, res_dir="", prefix="",
 
     phase_len = max([t2-t1 for (t1, t2) in times])
     data = {c: {0: {}, 1: {}} for c in ecohab_data.cages}
-    ecohab_data_data = utils.prepare_data(ecohab_data, mice)
+    view = ecohab_data.window()
+    data_times = (view.get_starttimes(mice)[0], view.get_endtimes(mice)[-1])
+    interval_index = ecohab_data.interval_index
     bin_labels = {}
     for idx_phase, phase in enumerate(phases):
         t_start, t_end = times[idx_phase]
@@ -201,12 +239,13 @@ def get_activity(ecohab_data, timeline, binsize, res_dir="", prefix="",
         else:
             bin_labels[phase] = utils.get_times(binlen, time_end=phase_len)
         for address in ecohab_data.cages:
-            visit_data = calculate_visits_and_durations(ecohab_data_data,
-                                                        mice,
-                                                        address,
-                                                        t_start,
-                                                        t_end,
-                                                        binlen)
+            visit_data = calculate_visits_and_durations_index(interval_index,
+                                                              mice,
+                                                              address,
+                                                              t_start,
+                                                              t_end,
+                                                              binlen,
+                                                              data_times)
             data[address][0][phase] = visit_data[0]
             data[address][1][phase] = visit_data[1]
             visits_in_cages[address] = visit_data[2]
@@ -14,88 +14,6 @@ from .write_to_file import write_two_values
 from .write_to_file import write_csv_alone
 
 
-def prepare_mice_intervals(data_mice, address):
-    ints = {}
-    for mouse in data_mice.keys():
-        ints[mouse] = utils.intervals2lists(data_mice[mouse], address)
-    return ints
-
-
-def check_interval(intervals_mouse1, intervals_mouse2, idx, new_idx):
-    original_s, original_e = intervals_mouse1[0][idx], intervals_mouse1[1][idx]
-    other_s = intervals_mouse2[0][new_idx]
-    other_e = intervals_mouse2[1][new_idx]
-    if other_s > original_e:
-        return False
-    if original_s > other_s and original_e > other_e:
-        intervals_mouse1[0][idx] = other_e
-        return False
-    if original_s < other_s and original_e < other_e:
-        intervals_mouse1[1][idx] = other_s
-        return False
-    if original_s >= other_s and original_e <= other_e:
-        # delete mouse1 interval
-        intervals_mouse1[0].remove(original_s)
-        intervals_mouse1[1].remove(original_e)
-        return True
-    #  cut the original interval in half
-    intervals_mouse1[1][idx] = other_s
-    if other_e < original_e:
-        intervals_mouse1[0].insert(idx + 1, other_e)
-        intervals_mouse1[1].insert(idx + 1, original_e)
-    if other_s == original_s:
-        intervals_mouse1[0].remove(original_s)
-        intervals_mouse1[1].remove(other_s)
-        return True
-    return False
-
-
-def remove_overlapping_intervals(intervals_mouse1, intervals_mouse2):
-    """"
-    Eliminate all the intervals, when mouse 1 is with mouse 2
-    """
-    if len(intervals_mouse1[0]) == 0:
-        return
-    if len(intervals_mouse2[0]) == 0:
-        return
-    i = 0
-    while i < len(intervals_mouse1[0]):
-        new_idx = utils.get_idx_pre(intervals_mouse1[0][i],
-                                    intervals_mouse2[0])
-        if new_idx is None:
-            new_idx = utils.get_idx_pre(intervals_mouse1[1][i],
-                                        intervals_mouse2[0])
-            if new_idx is None:
-                i = i + 1
-                continue
-        if intervals_mouse2[1][new_idx] < intervals_mouse1[0][i]:
-            new_idx += 1
-        if new_idx >= len(intervals_mouse2[0]):
-            break
-        removed = check_interval(intervals_mouse1, intervals_mouse2, i,
-                                 new_idx)
-        if not removed:
-            i = i + 1
-
-
-def mouse_alone(data_mice, address):
-    ints = prepare_mice_intervals(data_mice, address)
-    new_intervals = {}
-    result = {}
-    for mouse in ints.keys():
-        mouse_ints = []
-        mouse_ints.append(ints[mouse][0][:])
-        mouse_ints.append(ints[mouse][1][:])
-        for other_mouse in ints.keys():
-            if mouse != other_mouse:
-                remove_overlapping_intervals(mouse_ints, ints[other_mouse])
-        new_intervals[mouse] = mouse_ints
-    for mouse in new_intervals:
-        result[mouse] = utils.get_duration(new_intervals[mouse][0],
-                                           new_intervals[mouse][1])
-    return result
-
-
 def make_solitude_output(addresses, mice):
     output = OrderedDict()
     for address in addresses:
@@ -112,13 +30,13 @@ def get_solitude(ecohab_data, timeline, res_dir="", prefix="", delimiter=";"):
         res_dir = ecohab_data.res_dir
     phases = utils.filter_dark_light(timeline.sections())
     output = make_solitude_output(ecohab_data.cages, ecohab_data.mice)
+    cage_occupancy = ecohab_data.cage_occupancy
     for phase in phases:
-        times = timeline.get_time_from_epoch(phase)
-        data = utils.prepare_data(ecohab_data, ecohab_data.mice, times)
+        t_start, t_end = timeline.get_time_from_epoch(phase)
         for address in ecohab_data.cages:
-            alone = mouse_alone(data, address)
             for mouse in ecohab_data.mice:
-                output[address][mouse][phase] = alone[mouse]
+                output[address][mouse][phase] = cage_occupancy.time_alone(
+                    mouse, address, t_start, t_end)
     write_csv_alone(output, phases, res_dir, prefix, delimiter=delimiter)
     return output
 
@@ -238,9 +156,8 @@ def get_incohort_sociability(ecohab_data, timeline, binsize, res_dir="",
                                                                add_info_mice)
     excess_prefix = "incohort_sociability_excess_time_%s_%s" % (prefix,
                                                                 add_info_mice)
-    phases, time, data, keys = utils.prepare_binned_data(ecohab_data,
-                                                         timeline, binsize,
-                                                         mice)
+    phases, time, windows, keys = utils.prepare_binned_windows(timeline,
+                                                               binsize)
     if isinstance(binsize, int) or isinstance(binsize, float):
         binsize_name = "%3.2f_h" % (binsize/3600)
         if int(binsize) == 43200 or int(binsize) == 24*3600:
@@ -290,6 +207,7 @@ def get_incohort_sociability(ecohab_data, timeline, binsize, res_dir="",
         out_dir_rasters_add = "incohort_sociability"
     all_phases, bin_labels = keys
     cages = ecohab_data.cages
+    interval_index = ecohab_data.interval_index
     excess_time_per_mouse = OrderedDict()
     mean_excess_time_per_mouse = OrderedDict()
     standard_error_per_mouse = OrderedDict()
@@ -297,8 +215,11 @@ def get_incohort_sociability(ecohab_data, timeline, binsize, res_dir="",
         new_phase = phases[idx_phase]
         for lab in bin_labels[ph]:
             try:
+                data = utils.prepare_windows_data_index(interval_index,
+                                                        mice, cages,
+                                                        windows[ph][lab])
                 full_results[ph][lab],\
-                    full_results_exp[ph][lab] = single_phase_results(data[ph][lab],
+                    full_results_exp[ph][lab] = single_phase_results(data,
                                                                      mice,
                                                                      cages,
                                                                      time[ph][lab])
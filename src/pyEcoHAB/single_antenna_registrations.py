@@ -80,16 +80,15 @@ def get_single_antenna_stats(ecohab_data, timeline, binsize, antennas="ALL",
         t_start, t_end = times[i]
         count = OrderedDict()
         durations = OrderedDict()
-        for antenna in antennas:
+        results = ecohab_data.get_registration_stats_array(mice, antennas,
+                                                           t_start, t_end,
+                                                           binsize)
+        for j, antenna in enumerate(antennas):
             count[antenna] = OrderedDict()
             durations[antenna] = OrderedDict()
-            for mouse in mice:
-                results = ecohab_data.get_registration_stats(mouse,
-                                                             t_start,
-                                                             t_end,
-                                                             antenna,
-                                                             binsize)
-                count[antenna][mouse], durations[antenna][mouse] = results
+            for i, mouse in enumerate(mice):
+                count[antenna][mouse] = results[0][i, j].tolist()
+                durations[antenna][mouse] = results[1][i, j].tolist()
 
             single_timeline_heat_map(durations[antenna],
                                      res_dir,
@@ -99,8 +99,8 @@ def get_light_dark_transitions(transitions):
 
 def get_cage_tunnel_transitions(t_dict, setup_config):
     out = {}
-    tunnel_pairs = setup_config.tunnel_pairs()
-    cage_pairs = setup_config.cage_pairs()
+    tunnel_pairs = set(setup_config.tunnel_pairs())
+    cage_pairs = set(setup_config.cage_pairs())
     for phase in t_dict.keys():
         out[phase] = {}
         for label in t_dict[phase]:
@@ -177,8 +177,8 @@ def get_registration_trains(ecohab_data):
         registration_trains["ALL"][0][antenna] = []
         counts_in_trains["ALL"][0][antenna] = []
     for mouse in ecohab_data.mice:
-        times = ecohab_data.get_times(mouse)
-        antennas = ecohab_data.get_antennas(mouse)
+        times = ecohab_data.get_times(mouse).tolist()
+        antennas = ecohab_data.get_antennas(mouse).tolist()
         prev_antenna = antennas[0]
         previous_t_start = times[0]
         count = 1
@@ -1,11 +1,45 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
+import os
 import sys
+import copy
 import numpy as np
 
 
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+def encode(values, categories=None):
+    """Return integer codes of values and the lookup table of categories,
+    categories[codes] gives back values. Values missing from categories
+    are appended at the end of the lookup table."""
+    values = np.asarray(values)
+    if categories is None:
+        categories, codes = np.unique(values, return_inverse=True)
+        return codes.astype(np.int32), categories
+    new = np.setdiff1d(values, categories)
+    if len(new):
+        categories = np.concatenate([categories, new])
+    order = np.argsort(categories, kind="stable")
+    idx = np.searchsorted(categories, values, sorter=order)
+    return order[idx].astype(np.int32), categories
+
+
 class DataBase(object):
+    """Table of registrations or visits. Columns listed in categorical
+    (tags, antennas, addresses) are kept as integer codes, lookup tables
+    of their values are kept in categories. The data attribute gives
+    back the table with original values.
+
+    Rows of every animal tag are indexed (positions of rows grouped by
+    tag and ordered as in the table), so that properties of a single
+    animal are read without scanning the table."""
+    categorical = ("Tag",)
+    time_column = None
 
     def __init__(self, data, mask):
         self.mask = None
@@ -14,17 +48,247 @@ class DataBase(object):
         if mask:
             self._cut_out_data(mask)
 
+    @classmethod
+    def from_codes(cls, codes, categories, dtype, mask=None):
+        """Create the table from integer codes of categorical columns
+        and their lookup tables, without decoding the values. dtype
+        is the dtype of the table with original values."""
+        table = cls.__new__(cls)
+        table.mask = None
+        table._mask_slice = None
+        table.dtype = np.dtype(dtype)
+        table.categories = dict(categories)
+        table.codes = codes
+        if mask:
+            table._cut_out_data(mask)
+        return table
+
+    @property
+    def data(self):
+        return self.decode()
+
+    @data.setter
+    def data(self, data):
+        self.dtype = data.dtype
+        codes_dtype = []
+        for name in data.dtype.names:
+            if name in self.categorical:
+                codes_dtype.append((name, np.int32))
+            else:
+                codes_dtype.append((name, data.dtype[name]))
+        codes = np.empty(len(data), dtype=codes_dtype)
+        self.categories = {}
+        for name in data.dtype.names:
+            if name in self.categorical:
+                out = encode(data[name])
+                codes[name], self.categories[name] = out
+            else:
+                codes[name] = data[name]
+        self.codes = codes
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @codes.setter
+    def codes(self, codes):
+        self._codes = codes
+        self._index_tags()
+        self._times = None
+        self._times_sorted = False
+        if self.time_column is not None:
+            self._times = codes[self.time_column]
+            self._times_sorted = bool(np.all(self._times[1:] >=
+                                             self._times[:-1]))
+
+    def _index_tags(self):
+        """Group rows by tag. Positions in the table of rows of tag code c
+        are self._grouped_rows[self._offsets[c]:self._offsets[c+1]]."""
+        tags = self._codes["Tag"]
+        count = np.bincount(tags, minlength=len(self.categories["Tag"]))
+        self._offsets = np.concatenate([[0], np.cumsum(count)])
+        self._grouped_rows = np.argsort(tags, kind="stable")
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self, rows=slice(None)):
+        """Return rows of the table with original values of
+        categorical columns."""
+        codes = self.codes[rows]
+        out = np.empty(codes.shape, dtype=self.dtype)
+        for name in self.dtype.names:
+            out[name] = self.column(name, rows)
+        return out
+
+    def column(self, name, rows=slice(None)):
+        """Return original values of the column in rows."""
+        if name in self.categorical:
+            return self.categories[name][self.codes[name][rows]]
+        return self.codes[name][rows]
+
+    def code(self, name, values):
+        """Return codes of values of the categorical column. Values
+        that do not appear in the column are skipped."""
+        if isinstance(values, basestring):
+            values = [values]
+        values = list(values)
+        if not len(values):
+            return np.array([], dtype=np.int32)
+        found = np.isin(self.categories[name], np.asarray(values))
+        return np.flatnonzero(found).astype(np.int32)
+
+    def positions(self, name, values):
+        """Return an array mapping codes of the categorical column
+        to positions in values, -1 for codes of other values."""
+        if isinstance(values, basestring):
+            values = [values]
+        out = -np.ones(len(self.categories[name]), dtype=int)
+        for i, value in enumerate(values):
+            out[self.categories[name] == value] = i
+        return out
+
+    def time_rows(self, t_start, t_end):
+        """Return a slice of the table containing all rows with times
+        between t_start and t_end (the whole table, if it is not
+        ordered in time)."""
+        if not self._times_sorted:
+            return slice(None)
+        return slice(np.searchsorted(self._times, t_start, side="left"),
+                     np.searchsorted(self._times, t_end, side="left"))
+
+    def values(self, name):
+        """Return values of the categorical column present in the
+        table."""
+        count = np.bincount(self.codes[name],
+                            minlength=len(self.categories[name]))
+        return self.categories[name][count > 0]
+
+    @staticmethod
+    def _save_arrays(directory, name, arrays):
+        """Save arrays in files directory/name_key.npy. All the arrays
+        are written to temporary files first and then renamed, so that
+        an interrupted save does not leave new and old files together."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fnames = []
+        for key, array in arrays:
+            fname = os.path.join(directory, "%s_%s.npy" % (name, key))
+            with open(fname + ".tmp", "wb") as f:
+                np.save(f, array)
+            fnames.append(fname)
+        for fname in fnames:
+            # a new file, views of the previous one stay valid
+            os.replace(fname + ".tmp", fname)
+
+    def _save_tables(self, directory, name, keys):
+        self._save_arrays(directory, name,
+                          [(key, getattr(self, "_%s" % key))
+                           for key in keys])
+
+    def _load_tables(self, directory, name, keys):
+        for key in keys:
+            fname = os.path.join(directory, "%s_%s.npy" % (name, key))
+            setattr(self, "_%s" % key, np.load(fname, mmap_mode="r"))
+        if self.time_column is not None:
+            self._times = self._codes[self.time_column]
+
+    def to_memmap(self, directory, name):
+        """Keep the table in files directory/name_*.npy memory-mapped
+        for reading instead of memory. Queries read only the pages
+        of the files with requested rows, lookup tables of categorical
+        columns are kept in memory."""
+        keys = ("codes", "grouped_rows")
+        self._save_tables(directory, name, keys)
+        self._load_tables(directory, name, keys)
+
+    def save(self, directory, name):
+        """Save the table, its index and lookup tables in files
+        directory/name_*.npy. Returns a dictionary describing the table,
+        which has to be passed to load."""
+        arrays = [(key, getattr(self, "_%s" % key))
+                  for key in ("codes", "grouped_rows", "offsets")]
+        arrays += sorted(self.categories.items())
+        self._save_arrays(directory, name, arrays)
+        mask = self.mask
+        if mask is not None:
+            mask = [float(bound) for bound in mask]
+        return {"dtype": np.lib.format.dtype_to_descr(self.dtype),
+                "times_sorted": self._times_sorted,
+                "mask": mask}
+
+    @classmethod
+    def load(cls, directory, name, description):
+        """Load a table saved by save. The table and its index are
+        memory-mapped, lookup tables are read into memory."""
+        table = cls.__new__(cls)
+        table.mask = None
+        table._mask_slice = None
+        table.dtype = np.dtype([tuple(field)
+                                for field in description["dtype"]])
+        table._times = None
+        table.categories = {}
+        for column in table.categorical:
+            fname = os.path.join(directory, "%s_%s.npy" % (name, column))
+            table.categories[column] = np.load(fname)
+        table._load_tables(directory, name, ("codes", "grouped_rows",
+                                             "offsets"))
+        table._times_sorted = description["times_sorted"]
+        if description["mask"] is not None:
+            table.mask_data(description["mask"])
+        return table
+
+    def append(self, data):
+        """Append rows to the table."""
+        codes = np.empty(len(data), dtype=self.codes.dtype)
+        for name in data.dtype.names:
+            if name in self.categorical:
+                out = encode(data[name], self.categories[name])
+                codes[name], self.categories[name] = out
+            else:
+                codes[name] = data[name]
+        self.codes = np.concatenate([self.codes, codes])
+
+    def last_rows(self, mice, before=None):
+        """Return the last row of every animal from mice present
+        in the table (ignoring the mask), ordered as in the table.
+        If before is given, only rows preceding row before are
+        searched."""
+        codes = self.code("Tag", mice)
+        ends = self._offsets[codes + 1]
+        if before is not None:
+            ends = np.array([self._offsets[code] + np.searchsorted(
+                self._grouped_rows[self._offsets[code]:ends[i]], before)
+                for i, code in enumerate(codes)], dtype=int)
+        present = ends > self._offsets[codes]
+        rows = np.sort(self._grouped_rows[ends[present] - 1])
+        return self.decode(rows)
+
+    def _column_view(self, column_name):
+        if column_name == self.time_column:
+            return self._times, self._times_sorted
+        return self._codes[column_name], False
+
+    def _column_range(self, column_name):
+        arr, is_sorted = self._column_view(column_name)
+        if is_sorted:
+            return arr[0], arr[-1]
+        return arr.min(), arr.max()
+
     def _find_mask_indices(self, mask, column_name):
-        arr = np.array(self.data[column_name])
+        arr, is_sorted = self._column_view(column_name)
 
         if len(mask) >= 2:
             starttime = mask[0]
             endtime = mask[-1]
-        elif len(args) == 1:
-            starttime = min(self.data[column_name])
+        elif len(mask) == 1:
+            starttime = self._column_range(column_name)[0]
             endtime = mask[0]
         else:
             return (0, len(arr) - 1)
+        if is_sorted:
+            return (np.searchsorted(arr, starttime, side="left"),
+                    np.searchsorted(arr, endtime, side="left"))
         idcs = np.where((arr >= starttime) & (arr < endtime))[0]
         if len(idcs) >= 2:
             return (idcs[0], idcs[-1] + 1)
@@ -36,63 +300,92 @@ class DataBase(object):
         """mask_data(endtime) or mask_data(starttime, endtime)
         All future queries will be clipped to the visits starting between
         starttime and endtime."""
-        arr = np.array(self.data[column_name])
         if isinstance(args, int) or isinstance(args, float):
-            start = min(arr)
-            end = args[0]
+            start = self._column_range(column_name)[0]
+            end = args
         elif len(args) >= 2:
             start = args[0]
             end = args[-1]
         elif len(args) == 1:
-            start = min(arr)
+            start = self._column_range(column_name)[0]
             end = args[0]
         else:
-            start = min(arr)
-            end = max(arr)
+            start, end = self._column_range(column_name)
 
         self.mask = (start, end)
-        self._mask_slice = self. _find_mask_indices(self.mask,
-                                                    column_name)
+        self._mask_slice = self._find_mask_indices(self.mask,
+                                                   column_name)
 
     def unmask_data(self):
         """Remove the mask - future queries will not be clipped"""
         self.mask = None
         self._mask_slice = None
 
+    def window(self, t_start=None, t_end=None):
+        """Return a view of the table clipped to rows between t_start
+        and t_end, without the table itself being masked. The view
+        shares the table arrays, window() with no arguments gives
+        the unmasked view."""
+        view = copy.copy(self)
+        if t_start is None and t_end is None:
+            view.unmask_data()
+            return view
+        if t_start is None:
+            t_start = -np.inf
+        if t_end is None:
+            t_end = np.inf
+        view.mask_data((t_start, t_end))
+        return view
+
     def _cut_out_data(self, new_mask):
-        mask = self._find_mask_indices(new_mask)
-        for key in self.data.keys():
-            self.data[key] = self.data[key][mask[0]: mask[1]]
+        mask = self._find_mask_indices(new_mask, self.time_column)
+        self.codes = self.codes[mask[0]: mask[1]]
 
-    def getproperty(self, mice, propname, astype=None):
+    def _tag_slices(self, mice):
+        """Return slices of self._grouped_rows with positions of (masked)
+        rows of mice."""
+        out = []
+        for code in self.code('Tag', mice):
+            start, end = self._offsets[code], self._offsets[code + 1]
+            if self.mask is not None:
+                rows = self._grouped_rows[start:end]
+                first = np.searchsorted(rows, self._mask_slice[0])
+                last = np.searchsorted(rows, self._mask_slice[1])
+                start, end = start + first, start + last
+            out.append(slice(start, end))
+        return out
+
+    def getproperty(self, mice, propname, astype=None, codes=False):
+        """Return values of propname for registrations (visits) of mice
+        ordered as in the table. Only rows of mice are read from
+        the table. With codes, integer codes of a categorical column
+        are returned instead of its values."""
         if sys.version_info < (3, 0):
             if isinstance(mice, (str, unicode)):
                 mice = [mice]
         else:
             if isinstance(mice, str):
                 mice = [mice]
-
-        if self.mask is None:
-            if astype is None:
-                return [x[0] for x in zip(self.data[propname],
-                        self.data['Tag']) if x[1] in mice]
-            elif astype == 'float':
-                return [float(x[0]) for x in zip(self.data[propname],
-                        self.data['Tag']) if x[1] in mice]
+        slices = self._tag_slices(mice)
+        if len(slices) == 1:
+            rows = self._grouped_rows[slices[0]]
+        elif not len(slices):
+            rows = self._grouped_rows[:0]
         else:
-            mask_0, mask_1 = self._mask_slice[0], self._mask_slice[1]
-            if astype is None:
-                return [x[0] for x in zip(self.data[propname][mask_0:mask_1],
-                                          self.data['Tag'][mask_0:mask_1])
-                        if x[1] in mice]
-            elif astype == 'float':
-                return [float(x[0]) for x in zip(
-                    self.data[propname][mask_0:mask_1],
-                    self.data['Tag'][mask_0:mask_1])
-                        if x[1] in mice]
+            rows = np.sort(np.concatenate([self._grouped_rows[sl]
+                                           for sl in slices]))
+        values = self._codes[propname][rows]
+        if propname in self.categorical and not codes:
+            values = self.categories[propname][values]
+        if astype == 'float':
+            values = values.astype(float, copy=False)
+        return values
 
 
 class Data(DataBase):
+    categorical = ("Antenna", "Tag")
+    time_column = "Time"
+
     def __init__(self, data, mask):
         super(Data, self).__init__(data, mask)
 
@@ -110,6 +403,9 @@ class Data(DataBase):
 
 
 class Visits(DataBase):
+    categorical = ("Address", "Tag")
+    time_column = "AbsStartTimecode"
+
     def __init__(self, data, mask):
         super(Visits, self).__init__(data, mask)
 
@@ -127,3 +423,229 @@ class Visits(DataBase):
 
     def mask_data(self, mask):
         super(Visits, self).mask_data(mask, column_name="AbsStartTimecode")
+
+    def _derived(self, name, factory):
+        """Return factory(self) built on the first call and kept
+        until the table changes."""
+        cached = getattr(self, name, None)
+        if cached is None or cached[0] is not self._codes:
+            cached = (self._codes, factory(self))
+            setattr(self, name, cached)
+        return cached[1]
+
+    def interval_index(self):
+        """Return IntervalIndex of all visits in the table (ignoring
+        the mask). The index is built on the first call and kept
+        until the table changes."""
+        return self._derived("_interval_index", IntervalIndex)
+
+    def cage_occupancy(self):
+        """Return CageOccupancy of all visits in the table (ignoring
+        the mask). Occupancy is calculated on the first call and kept
+        until the table changes."""
+        return self._derived("_cage_occupancy", CageOccupancy)
+
+
+class IntervalIndex(object):
+    """Visits of every animal to every Eco-HAB compartment kept as
+    sorted arrays of start and end times together with cumulative
+    visit durations. Visits of an animal do not overlap, so time spent
+    by an animal in a compartment and visits overlapping a time interval
+    are found with binary search.
+
+    Args:
+       visits: Visits
+    """
+    def __init__(self, visits):
+        codes = visits.codes
+        order = np.lexsort((codes["AbsStartTimecode"], codes["Address"],
+                            codes["Tag"]))
+        tags = codes["Tag"][order]
+        addresses = codes["Address"][order]
+        starts = codes["AbsStartTimecode"][order].astype(float)
+        ends = codes["AbsEndTimecode"][order].astype(float)
+        bounds = np.flatnonzero((tags[1:] != tags[:-1])
+                                | (addresses[1:] != addresses[:-1])) + 1
+        bounds = np.concatenate([[0], bounds, [len(order)]])
+        self.intervals = {}
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first == last:
+                continue
+            key = (visits.categories["Tag"][tags[first]],
+                   visits.categories["Address"][addresses[first]])
+            cumulative = np.concatenate([[0.],
+                                         np.cumsum(ends[first:last]
+                                                   - starts[first:last])])
+            self.intervals[key] = (starts[first:last], ends[first:last],
+                                   cumulative)
+
+    def _get(self, mouse, cage):
+        empty = np.array([])
+        return self.intervals.get((mouse, cage), (empty, empty,
+                                                  np.zeros(1)))
+
+    def get_intervals(self, mouse, cage, t_start=-np.inf, t_end=np.inf):
+        """Return start and end times of visits of mouse to cage
+        overlapping [t_start, t_end), clipped to [t_start, t_end)."""
+        starts, ends, cumulative = self._get(mouse, cage)
+        first = np.searchsorted(ends, t_start, side="right")
+        last = np.searchsorted(starts, t_end, side="left")
+        return (np.maximum(starts[first:last], t_start),
+                np.minimum(ends[first:last], t_end))
+
+    def get_starting_or_ending(self, mouse, cage, t_start, t_end,
+                               margin=np.inf):
+        """Return start and end times of visits of mouse to cage
+        starting or ending in [t_start, t_end), clipped to [t_start,
+        t_end), as selected by utils.prepare_data. Visits ending in
+        [t_start, t_end), which started more than margin before t_start,
+        and visits lasting longer than the whole interval are left out."""
+        starts, ends, cumulative = self._get(mouse, cage)
+        first = np.searchsorted(starts, t_start, side="left")
+        last = np.searchsorted(starts, t_end, side="left")
+        earliest = np.searchsorted(starts, t_start - margin, side="left")
+        before = max(np.searchsorted(ends[:first], t_start, side="left"),
+                     earliest)
+        before_last = max(np.searchsorted(ends[:first], t_end,
+                                          side="left"), before)
+        idx = np.r_[before:before_last, first:last]
+        return (np.maximum(starts[idx], t_start),
+                np.minimum(ends[idx], t_end))
+
+    def count_starts(self, mouse, cage, times):
+        """Return the number of visits of mouse to cage starting
+        before times (float or array)."""
+        return np.searchsorted(self._get(mouse, cage)[0], times,
+                               side="left")
+
+    def cumulative_time(self, mouse, cage, times):
+        """Return time spent by mouse in cage before times (float
+        or array)."""
+        starts, ends, cumulative = self._get(mouse, cage)
+        times = np.asarray(times, dtype=float)
+        idx = np.searchsorted(starts, times, side="right")
+        previous = np.maximum(idx - 1, 0)
+        if len(starts):
+            current = np.clip(times - starts[previous], 0,
+                              ends[previous] - starts[previous])
+        else:
+            current = np.zeros(times.shape)
+        return cumulative[previous] + np.where(idx > 0, current, 0.)
+
+    def time_in_cage(self, mouse, cage, t_start, t_end):
+        """Return time spent by mouse in cage between t_start and t_end
+        (floats or arrays)."""
+        return (self.cumulative_time(mouse, cage, t_end)
+                - self.cumulative_time(mouse, cage, t_start))
+
+    def overlap(self, mouse1, mouse2, cage, t_start=-np.inf,
+                t_end=np.inf):
+        """Return time spent together by mouse1 and mouse2 in cage
+        between t_start and t_end."""
+        starts, ends = self.get_intervals(mouse1, cage, t_start, t_end)
+        return float(np.sum(self.time_in_cage(mouse2, cage, starts, ends)))
+
+
+class CageOccupancy(object):
+    """Number of animals present in every Eco-HAB compartment as
+    a piecewise-constant time series. Starts and ends of visits to
+    a compartment are sorted once, between consecutive events the number
+    of animals present does not change. Animals present are found in
+    the interval index of the visits.
+
+    Args:
+       visits: Visits
+    """
+    def __init__(self, visits):
+        codes = visits.codes
+        self.mice = list(visits.categories["Tag"])
+        self.cages = list(visits.categories["Address"])
+        self.index = visits.interval_index()
+        self.events = {}
+        self.count = {}
+        self.alone = {}
+        for code, cage in enumerate(self.cages):
+            rows = codes["Address"] == code
+            if not np.any(rows):
+                continue
+            times = np.concatenate([codes["AbsStartTimecode"][rows],
+                                    codes["AbsEndTimecode"][rows]])
+            times = times.astype(float)
+            events, idx = np.unique(times, return_inverse=True)
+            change = np.bincount(idx, weights=np.repeat([1, -1],
+                                                        np.sum(rows)),
+                                 minlength=len(events))
+            # count[i] -- number of animals in the cage between events[i]
+            # and events[i + 1]
+            count = np.cumsum(change).astype(int)
+            self.events[cage] = events
+            self.count[cage] = count
+            # alone[i] -- time with one animal in the cage before events[i]
+            self.alone[cage] = np.concatenate([[0.], np.cumsum(
+                np.diff(events)*(count[:-1] == 1))])
+
+    def _segments(self, cage, t_start, t_end):
+        """Return indices of intervals between events of cage overlapping
+        [t_start, t_end) and their durations clipped to [t_start, t_end).
+        Time before the first and after the last event is not included
+        (no animals are present)."""
+        events = self.events.get(cage, np.array([]))
+        if len(events) < 2:
+            return np.array([], dtype=int), np.array([])
+        first = max(np.searchsorted(events, t_start, side="right") - 1, 0)
+        last = min(np.searchsorted(events, t_end, side="left"),
+                   len(events) - 1)
+        idx = np.arange(first, last)
+        durations = (np.minimum(events[idx + 1], t_end)
+                     - np.maximum(events[idx], t_start))
+        return idx, np.maximum(durations, 0)
+
+    def occupancy(self, cage, times):
+        """Return the number of animals in cage at times (float
+        or array)."""
+        events = self.events.get(cage, np.array([]))
+        times = np.asarray(times, dtype=float)
+        if not len(events):
+            return np.zeros(times.shape, dtype=int)
+        idx = np.searchsorted(events, times, side="right") - 1
+        inside = (idx >= 0) & (idx < len(events) - 1)
+        return np.where(inside, self.count[cage][np.clip(idx, 0, None)], 0)
+
+    def mice_present(self, cage, time):
+        """Return animals present in cage at time."""
+        mice = []
+        for mouse in self.mice:
+            starts, ends, cumulative = self.index._get(mouse, cage)
+            idx = np.searchsorted(starts, time, side="right") - 1
+            if idx >= 0 and ends[idx] > time:
+                mice.append(mouse)
+        return mice
+
+    def _time_alone_before(self, cage, times):
+        """Return time before times (array), when one animal was
+        in cage."""
+        events = self.events[cage]
+        idx = np.clip(np.searchsorted(events, times, side="right") - 1,
+                      0, len(events) - 1)
+        current = np.clip(times - events[idx], 0, None)
+        return self.alone[cage][idx] + current*(self.count[cage][idx] == 1)
+
+    def time_with_count(self, cage, t_start, t_end):
+        """Return an array, element k is the time between t_start
+        and t_end, when exactly k animals were in cage."""
+        idx, durations = self._segments(cage, t_start, t_end)
+        out = np.zeros(len(self.mice) + 1)
+        if len(idx):
+            out += np.bincount(self.count[cage][idx], weights=durations,
+                               minlength=len(self.mice) + 1)
+        out[0] = (t_end - t_start) - out[1:].sum()
+        return out
+
+    def time_alone(self, mouse, cage, t_start, t_end):
+        """Return time between t_start and t_end, when mouse was
+        the only animal in cage."""
+        starts, ends = self.index.get_intervals(mouse, cage, t_start, t_end)
+        if not len(starts):
+            return 0.
+        return float(np.sum(self._time_alone_before(cage, ends)
+                            - self._time_alone_before(cage, starts)))
@@ -2,12 +2,22 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
 import os
+import io
+import bz2
+import gzip
+import lzma
 import time
+import tarfile
 import calendar
+import json
 import sys
 from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from .general import check_directory
+from .general import PAIR_SKIPPED_ONE, PAIR_SKIPPED_TWO
+from .general import PAIR_SKIPPED_MORE, HOP_UNREACHABLE
 
 h = u"antenna, incorrect transitions count, percentage of antenna recordings\n"
 
@@ -19,6 +29,36 @@ except NameError:
 PAIRS = ["1 3", "1 4", "1 5", "1 6", "1 7", "2 4", "2 5", "2 6", "2 7", "2 8",
          "3 5", "3 6", "3 7", "3 8", "4 6", "4 7", "4 8", "5 7", "5 8", "6 8"]
 
+REGISTRATION_DTYPE = [("Id", int),
+                      ("Time", float),
+                      ("Antenna", "U15"),
+                      ("Duration", int),
+                      ("Tag", "U15")]
+
+VISITS_DTYPE = [("Address", "U30"),
+                ("Tag", "U15"),
+                ("AbsStartTimecode", float),
+                ("AbsEndTimecode", float),
+                ("VisitDuration", float),
+                ("ValidVisitSolution", bool)]
+
+VISIT_RECORD_DTYPE = [("mouse", "U15"),
+                      ("address", "U30"),
+                      ("t_start", float),
+                      ("t_end", float),
+                      ("duration", float)]
+
+CACHE_DIR = ".pyEcoHAB_cache"
+CACHE_VERSION = 1
+MEMMAP_DIR = ".pyEcoHAB_memmap"
+SAVE_VERSION = 1
+
+COMPRESSED_FILES = OrderedDict([(".gz", gzip.open),
+                                (".xz", lzma.open),
+                                (".bz2", bz2.open)])
+TAR_ARCHIVES = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".txz", ".tar.bz2",
+                ".tbz2")
+
 
 def results_path(path, res_dir):
     return os.path.join(path, res_dir)
@@ -77,7 +117,7 @@ def make_prefix(path):
 
 def parse_fname(fname):
     """"Extracts time and date from data filename"""
-    parts = fname.split("_")
+    parts = os.path.basename(fname).split("_")
     if len(parts) == 2:
         date, hour = parts
         setup = ""
@@ -123,73 +163,508 @@ def time_to_sec(tt):
     return seconds + float(less_than_sec)/1000
 
 
-def reformat_date_time(date, time):
-    return "%s %s" % (date.replace('.', ''), time)
+def strip_compression(fname):
+    """Remove the compression extension (.gz, .xz, .bz2) of fname"""
+    for extension in COMPRESSED_FILES:
+        if fname.endswith(extension):
+            return fname[:-len(extension)]
+    return fname
+
 
+def is_data_fname(fname):
+    """Check, if fname is a name of an (compressed) Eco-HAB data file"""
+    f_name = strip_compression(os.path.basename(fname))
+    if f_name.endswith("0000.txt"):
+        return True
+    split = f_name.split("_")
+    if len(split) < 3:
+        return False
+    return split[-1].endswith(".txt") and split[1].endswith("0000")
 
-def process_line_more_elements(elements):
-    """remove dot from 2nd column of new data files"""
-    date_time = reformat_date_time(elements[1], elements[2])
-    return [elements[0], date_time] + elements[3:]
 
+def split_archive_member(fname):
+    """
+    Return the tar archive and the name of a data file stored
+    in the archive (data files in archives are named archive/member)
+    or None and fname for other data files.
+    """
+    if "/" in fname:
+        archive, member = fname.split("/", 1)
+        if archive.endswith(TAR_ARCHIVES):
+            return archive, member
+    return None, fname
 
-def process_line_5_elements(elements, date):
-    """Add date to data (old data files)"""
-    elements[1] = ' '.join([date, elements[1]])
-    return elements
+
+# names of data files in tar archives keyed by archive path, size and mtime
+_archive_members = {}
+
+
+def archive_members(dir_path, archive):
+    """
+    Return names of data files stored in a tar archive. Listing
+    a compressed archive decompresses all of it, so member names
+    are remembered until the archive is modified.
+    """
+    path = os.path.abspath(os.path.join(dir_path, archive))
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _archive_members:
+        with tarfile.open(path) as tar:
+            _archive_members[key] = [member.name for member in tar
+                                     if member.isfile()
+                                     and is_data_fname(member.name)]
+    return list(_archive_members[key])
 
 
 def get_filenames(path):
+    """
+    Return names of data files in path. Data files can be compressed
+    (.gz, .xz or .bz2) or stored in tar archives (named then
+    archive/member).
+    """
     try:
         f_list = os.listdir(path)
     except FileNotFoundError:
         return []
     out = []
     for f_name in f_list:
-        if f_name.endswith("0000.txt"):
+        if is_data_fname(f_name):
             out.append(f_name)
+        elif f_name.endswith(TAR_ARCHIVES):
+            out.extend(["%s/%s" % (f_name, member)
+                        for member in archive_members(path, f_name)])
+    return out
+
+
+def text_stream(binary, fname):
+    """Return a text stream decompressing binary, if fname is compressed"""
+    for extension, opener in COMPRESSED_FILES.items():
+        if fname.endswith(extension):
+            return opener(binary, "rt")
+    return io.TextIOWrapper(binary)
+
+
+@contextmanager
+def open_data_file(dir_path, fname):
+    """
+    Open a data file for reading text. Compressed data files
+    and data files stored in tar archives are decompressed while
+    they are read.
+    """
+    archive, member = split_archive_member(fname)
+    if archive is None:
+        with open(os.path.join(dir_path, fname), "rb") as binary:
+            with text_stream(binary, fname) as f:
+                yield f
+        return
+    with tarfile.open(os.path.join(dir_path, archive)) as tar:
+        with tar.extractfile(member) as binary:
+            with text_stream(binary, member) as f:
+                yield f
+
+
+def dates_to_sec(dates):
+    """
+    Convert an array of dates (YYYYMMDD) to seconds since epoch (GMT).
+
+    Every distinct date is parsed only once.
+    """
+    unique_dates, inverse = np.unique(dates, return_inverse=True)
+    day_base = [calendar.timegm(time.strptime(date, '%Y%m%d'))
+                for date in unique_dates]
+    return np.array(day_base, dtype=np.int64)[inverse.reshape(-1)]
+
+
+def clock_to_sec(clock):
+    """
+    Convert an array of HH:MM:SS.mmm strings to seconds since midnight.
+
+    Returns whole seconds and milliseconds (as in time_to_sec everything
+    after the dot is read in as a number of milliseconds) and a boolean
+    array marking strings that do not follow the format and have to
+    be parsed by time_to_sec.
+    """
+    n = len(clock)
+    seconds = np.zeros(n, dtype=np.int64)
+    msec = np.zeros(n, dtype=np.int64)
+    try:
+        as_bytes = np.asarray(clock).astype("S")
+    except UnicodeEncodeError:
+        return seconds, msec, np.ones(n, dtype=bool)
+    width = as_bytes.dtype.itemsize
+    if width < 8:
+        return seconds, msec, np.ones(n, dtype=bool)
+    chars = as_bytes.view(np.uint8).reshape(n, width).astype(np.int64)
+    digits = chars - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    hms = [0, 1, 3, 4, 6, 7]
+    valid = is_digit[:, hms].all(axis=1)
+    valid &= (chars[:, 2] == ord(":")) & (chars[:, 5] == ord(":"))
+    hours = 10*digits[:, 0] + digits[:, 1]
+    minutes = 10*digits[:, 3] + digits[:, 4]
+    secs = 10*digits[:, 6] + digits[:, 7]
+    valid &= (hours < 24) & (minutes < 60) & (secs < 62)
+    if width > 8:
+        dot = chars[:, 8] == ord(".")
+        valid &= dot | (chars[:, 8] == 0)
+        # strings are padded with zero bytes
+        fraction = chars[:, 9:]
+        filled = fraction != 0
+        length = filled.sum(axis=1)
+        valid &= ~dot | (length > 0)
+        valid &= (is_digit[:, 9:] | ~filled).all(axis=1)
+        valid &= ~(filled[:, 1:] & ~filled[:, :-1]).any(axis=1)
+        for column in range(fraction.shape[1]):
+            msec = np.where(filled[:, column],
+                            10*msec + digits[:, 9 + column], msec)
+    seconds = 3600*hours + 60*minutes + secs
+    return seconds, msec, ~valid
+
+
+def registration_times(dates, clock):
+    """
+    Vectorized time_to_sec for arrays of dates (YYYYMMDD) and times of day
+    (HH:MM:SS.mmm).
+    """
+    seconds, msec, irregular = clock_to_sec(clock)
+    out = (dates_to_sec(dates) + seconds) + msec/1000
+    for i in np.where(irregular)[0]:
+        out[i] = time_to_sec("%s %s" % (dates[i], clock[i]))
+    return out
+
+
+def registrations_from_rows(rows, hour, date, datenext, fname="",
+                            legal_tags=None, remove_antennas=None):
+    """
+    Transform split lines of a data file to a structured array
+    of registrations.
+
+    Lines of old data files (5 columns) are dated using the data file
+    name, lines of new data files (6 or more columns) carry their own date.
+
+    Only registrations of legal_tags (all tags, if None) by antennas
+    not listed in remove_antennas are converted.
+    """
+    if not len(rows):
+        return np.zeros(0, dtype=REGISTRATION_DTYPE)
+    lengths = np.array([len(row) for row in rows])
+    if np.any(lengths < 5):
+        raise(IOError('Unknown data format in file %s' % fname))
+    old_format = lengths == 5
+    keep = np.ones(len(rows), dtype=bool)
+    groups = []
+    for old in [True, False]:
+        idx = np.where(old_format == old)[0]
+        if not len(idx):
+            continue
+        if len(idx) == len(rows) and np.all(lengths == lengths[0]):
+            columns = np.array(rows).T
+        elif old:
+            columns = np.array([rows[i] for i in idx]).T
         else:
-            split = f_name.split("_")
-            if len(split) < 3:
-                continue
-            if split[-1].endswith(".txt") and split[1].endswith("0000"):
-                out.append(f_name)
+            columns = np.array([rows[i][:6] for i in idx]).T
+        if old:
+            tags, antennas = columns[4], columns[2]
+        else:
+            tags, antennas = columns[5], columns[3]
+        kept = np.ones(len(idx), dtype=bool)
+        if legal_tags is not None:
+            kept &= np.isin(tags, np.asarray(legal_tags))
+        if remove_antennas:
+            kept &= ~np.isin(antennas, np.asarray(remove_antennas))
+        keep[idx] = kept
+        if kept.any():
+            groups.append((old, idx[kept], columns[:, kept]))
+    position = np.cumsum(keep) - 1
+    out = np.zeros(int(keep.sum()), dtype=REGISTRATION_DTYPE)
+    for old, idx, columns in groups:
+        idx = position[idx]
+        if old:
+            ids, clock, antennas, durations, tags = columns[:5]
+            dates = np.full(len(idx), date, dtype="U8")
+            if hour[:2] == "23":
+                dates[np.char.startswith(clock, "00")] = datenext
+        else:
+            ids, dates, clock, antennas, durations, tags = columns[:6]
+            dates = np.char.replace(dates, ".", "")
+        out["Id"][idx] = ids.astype(int)
+        out["Time"][idx] = registration_times(dates, clock)
+        out["Antenna"][idx] = antennas
+        out["Duration"][idx] = durations.astype(int)
+        out["Tag"][idx] = tags
     return out
 
 
-def read_single_file(dir_path, fname):
-    """Reads in a single data file"""
-    
+def read_single_file_array(dir_path, fname, legal_tags=None,
+                           remove_antennas=None):
+    """
+    Read in a single data file into a structured array of registrations.
+
+    Lines of the (decompressed) file are split as they are read and dates
+    and times of registrations are converted to seconds since epoch
+    in a vectorized manner.
+    Registrations of tags not in legal_tags (if provided) and
+    by remove_antennas are skipped.
+    """
+    with open_data_file(dir_path, fname) as f:
+        return parse_data_file(f, fname, legal_tags, remove_antennas)
+
+
+def parse_data_file(f, fname, legal_tags=None, remove_antennas=None):
+    """
+    Parse lines of data file fname read from text stream f into
+    a structured array of registrations (see read_single_file_array).
+    """
     hour, date, datenext, setup = parse_fname(fname)
-    raw_data = []
-    f = open(os.path.join(dir_path, fname), 'r')
-    for line in f:
-        elements = line.split()
-        if len(elements) == 5:
-            if hour == '23' and elements[1][:2] == '00':
-                line = process_line_5_elements(elements, datenext)
-            else:
-                line = process_line_5_elements(elements, date)
-        elif len(elements) > 5:
-            line = process_line_more_elements(elements)
+    rows = [line.split() for line in f]
+    return registrations_from_rows(rows, hour, date, datenext,
+                                   fname, legal_tags,
+                                   remove_antennas), setup
+
+
+def read_archive_files(dir_path, fnames, legal_tags=None,
+                       remove_antennas=None):
+    """
+    Read in data files stored in one tar archive (named archive/member)
+    into structured arrays of registrations. The archive is read
+    through once.
+    """
+    archive = split_archive_member(fnames[0])[0]
+    wanted = {split_archive_member(fname)[1]: i
+              for i, fname in enumerate(fnames)}
+    out = [None]*len(fnames)
+    with tarfile.open(os.path.join(dir_path, archive)) as tar:
+        for member in tar:
+            if member.name not in wanted:
+                continue
+            with tar.extractfile(member) as binary:
+                with text_stream(binary, member.name) as f:
+                    out[wanted[member.name]] = parse_data_file(
+                        f, member.name, legal_tags, remove_antennas)
+    for fname, registrations in zip(fnames, out):
+        if registrations is None:
+            raise IOError("Could not find %s" % fname)
+    return out
+
+
+def read_file_group(dir_path, fnames, legal_tags=None, remove_antennas=None):
+    """
+    Read in a data file or data files stored in one tar archive
+    (see group_fnames).
+    """
+    if split_archive_member(fnames[0])[0] is None:
+        return [read_single_file_array(dir_path, fname, legal_tags,
+                                       remove_antennas)
+                for fname in fnames]
+    return read_archive_files(dir_path, fnames, legal_tags, remove_antennas)
+
+
+def group_fnames(fnames):
+    """
+    Split fnames into groups read in together: consecutive data files
+    from the same tar archive or single data files.
+    """
+    groups = []
+    last = None
+    for fname in fnames:
+        archive = split_archive_member(fname)[0]
+        if archive is not None and archive == last:
+            groups[-1].append(fname)
         else:
-            raise(IOError('Unknown data format in file %s' % f))
-        raw_data += [line]
-    f.close()
-    return raw_data, setup
+            groups.append([fname])
+        last = archive
+    return groups
+
+
+def read_files(dir_path, fnames, workers=1, legal_tags=None,
+               remove_antennas=None):
+    """
+    Read in data files into structured arrays of registrations.
+
+    Args:
+    dir_path: str
+       data directory
+    fnames: list
+       data filenames
+    workers: int or None
+       number of processes parsing files. If workers is larger than 1
+       files are read in by a process pool, None uses all available
+       cores. Default 1 (files are read in one after another).
+    legal_tags: list or None
+       read in only registrations of legal_tags. Default None (all tags).
+    remove_antennas: list or None
+       skip registrations by remove_antennas.
+
+    Returns:
+       a list of (registrations, setup name) tuples in the order of fnames
+
+    Compressed files and tar archives are decompressed by the processes
+    parsing them, every tar archive is read in by a single process.
+    """
+    groups = group_fnames(fnames)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(groups))
+    if workers < 2:
+        return [out for group in groups
+                for out in read_file_group(dir_path, group, legal_tags,
+                                           remove_antennas)]
+    chunksize = max(1, len(groups)//(4*workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [out for outs in executor.map(read_file_group,
+                                             [dir_path]*len(groups), groups,
+                                             [legal_tags]*len(groups),
+                                             [remove_antennas]*len(groups),
+                                             chunksize=chunksize)
+                for out in outs]
+
+
+def file_start_time(fname):
+    """
+    Return the beginning of the hour recorded in data file fname
+    (seconds since epoch, as registration times).
+    """
+    hour, date, datenext, setup = parse_fname(fname)
+    return time_to_sec("%s %s:%s:%s" % (date, hour[:2], hour[2:4],
+                                        hour[4:6]))
+
+
+def filter_fnames(fnames, mask, margin=3600):
+    """
+    Return data files, which can contain registrations between mask[0]
+    and mask[-1] (a single value mask gives only the end time). Data
+    files record an hour starting at the time in the file name,
+    registrations up to margin seconds outside this hour are taken
+    into account. Files with names that cannot be parsed are kept.
+    """
+    if isinstance(mask, (int, float)):
+        mask = [mask]
+    if not len(mask):
+        return fnames
+    start = mask[0] if len(mask) >= 2 else -np.inf
+    end = mask[-1]
+    out = []
+    for fname in fnames:
+        try:
+            t_file = file_start_time(fname)
+        except Exception:
+            out.append(fname)
+            continue
+        if t_file + 3600 + margin < start or t_file - margin >= end:
+            continue
+        out.append(fname)
+    return out
+
+
+def mask_registrations(data, mask):
+    """
+    Return registrations (sorted by time) between mask[0] and mask[-1]
+    (a single value mask gives only the end time).
+    """
+    if isinstance(mask, (int, float)):
+        mask = [mask]
+    if not len(mask):
+        return data
+    times = data["Time"]
+    first = 0
+    if len(mask) >= 2:
+        first = np.searchsorted(times, mask[0], side="left")
+    last = np.searchsorted(times, mask[-1], side="left")
+    return data[first:last]
+
+
+def file_fingerprints(dir_path, fnames):
+    """
+    Return sizes and modification times (in ns) of data files
+    (of tar archives for data files stored in archives).
+    """
+    out = {}
+    for fname in fnames:
+        archive = split_archive_member(fname)[0]
+        stat = os.stat(os.path.join(dir_path, archive or fname))
+        out[fname] = [stat.st_size, stat.st_mtime_ns]
+    return out
+
+
+def cache_settings(legal_tags, ghost_tags, remove_antennas,
+                   how_many_appearances=50, how_many_days=None):
+    """
+    Describe filtering of registrations stored in the cache, so that
+    the cache can be invalidated if Loader parameters change.
+    """
+    if isinstance(legal_tags, basestring) and legal_tags != "ALL":
+        legal_tags = [legal_tags]
+    if not isinstance(legal_tags, basestring):
+        legal_tags = sorted([str(tag) for tag in legal_tags])
+    if not isinstance(remove_antennas, list):
+        remove_antennas = [remove_antennas]
+    return {"legal_tags": legal_tags,
+            "check_for_ghost_tags": bool(ghost_tags),
+            "ghost_tag_appearances": how_many_appearances,
+            "ghost_tag_days": how_many_days,
+            "remove_antennas": sorted([str(antenna)
+                                       for antenna in remove_antennas])}
+
+
+def load_registration_cache(cache_dir):
+    """
+    Load registrations cached in cache_dir.
+
+    Registrations and indices of data files each registration was read
+    in from are memory-mapped.
+
+    Returns:
+       registrations, file indices and the manifest describing
+       cached data files and filtering of registrations or None, if
+       there is no cache.
+    """
+    try:
+        with open(os.path.join(cache_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != CACHE_VERSION:
+            return None
+        data = np.load(os.path.join(cache_dir, "registrations.npy"),
+                       mmap_mode="r")
+        file_index = np.load(os.path.join(cache_dir, "file_index.npy"),
+                             mmap_mode="r")
+    except (IOError, ValueError):
+        return None
+    if data.dtype != np.dtype(REGISTRATION_DTYPE):
+        return None
+    if len(data) != len(file_index):
+        return None
+    return data, file_index, manifest
+
+
+def save_registration_cache(cache_dir, data, file_index, manifest):
+    """
+    Save registrations, indices of data files each registration was read
+    in from and the manifest in cache_dir.
+    """
+    check_directory(cache_dir)
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for name, array in [("registrations", data),
+                        ("file_index", file_index)]:
+        fname = os.path.join(cache_dir, "%s.npy" % name)
+        with open(fname + ".tmp", "wb") as f:
+            np.save(f, np.asarray(array))
+        os.replace(fname + ".tmp", fname)
+    manifest = dict(manifest, version=CACHE_VERSION)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
 
 
 def remove_one_antenna(data, antenna):
     """
     Remove animal tags registered by a specified antenna from 2D data array
     """
-    where = []
-    for i, a in enumerate(data["Antenna"]):
-        if a == antenna:
-            where.append(i)
-    if len(where) == 0:
+    keep = data["Antenna"] != antenna
+    if keep.all():
         return data
-    return np.delete(data, where, axis=0)
+    return data[keep]
 
 
 def remove_antennas(data, antennas):
@@ -198,7 +673,7 @@ def remove_antennas(data, antennas):
 
     Args:
     data: a list of lista or an 2D array
-        data dictionary (raw_data transformed by from_raw_data)
+        data dictionary (registrations read by read_single_file_array)
     antennas: int or list
         either a single antenna or a list of antennas to remove
 
@@ -215,7 +690,44 @@ def remove_antennas(data, antennas):
     return new_data
 
 
-def remove_ghost_tags(raw_data, legal_tags="ALL", ghost_tags=False):
+def find_legal_tags(tags, times, how_many_appearances=50,
+                    how_many_days=None):
+    """
+    Return animal tags registered at least how_many_appearances times.
+
+    Args:
+    tags: array of animal tags of registrations
+    times: array of registration times
+    how_many_appearances: int
+        minimum number of registrations of a tag. Default 50.
+    how_many_days: float or None
+        If provided, registrations are counted in consecutive periods
+        of how_many_days days (starting with the first registration)
+        and a tag has to be registered how_many_appearances times in at
+        least one of the periods. By default registrations are counted
+        in the whole dataset.
+
+    Returns:
+       an array of legal tags
+    """
+    keys, inverse = np.unique(np.asarray(tags), return_inverse=True)
+    if not len(keys):
+        return keys
+    if not how_many_days:
+        counts = np.bincount(inverse, minlength=len(keys))
+    else:
+        times = np.asarray(times, dtype=float)
+        period = ((times - times.min())//(how_many_days*24*3600)).astype(int)
+        periods = period.max() + 1
+        pairs, pair_counts = np.unique(inverse*periods + period,
+                                       return_counts=True)
+        counts = np.zeros(len(keys), dtype=int)
+        np.maximum.at(counts, pairs//periods, pair_counts)
+    return keys[counts >= how_many_appearances]
+
+
+def remove_ghost_tags(raw_data, legal_tags="ALL", ghost_tags=False,
+                      how_many_appearances=50, how_many_days=None):
     """
     Leave animal tag registrations that are trustworthy.
 
@@ -228,92 +740,134 @@ def remove_ghost_tags(raw_data, legal_tags="ALL", ghost_tags=False):
     legal_tags: list
         animal tags to be kept in raw_data
         Default "ALL". Keep all tags.
+    ghost_tags: bool
+        Remove tags registered less than how_many_appearances times
+        (legal_tags are then found with find_legal_tags).
+    how_many_appearances, how_many_days:
+        see find_legal_tags
 
     Returns:
        a list of lists or an 2D array (the same type as raw_data)
     """
+    is_array = isinstance(raw_data, np.ndarray)
+    if is_array:
+        tags = raw_data["Tag"]
+    else:
+        tags = np.array([d[4] for d in raw_data])
     if ghost_tags:
-        how_many_days = 1
-        how_many_appearances = 50
-        ghost_mice = []
-        counters = {}
-        all_mice = []
-        for d in raw_data:
-            mouse = d[4]
-            if mouse not in counters:
-                counters[mouse] = 0
-            if mouse not in all_mice:
-                all_mice.append(mouse)
-            counters[mouse] += 1
-        legal_tags = []
-        for mouse in counters:
-            if counters[mouse] < how_many_appearances:
-                if mouse not in ghost_mice:
-                    ghost_mice.append(mouse)
-        for mouse in all_mice:
-            if mouse not in ghost_mice:
-                legal_tags.append(mouse)
-    if legal_tags == "ALL":
-        return raw_data
-
-    new_data = []
+        times = None
+        if is_array:
+            times = raw_data["Time"]
+        elif how_many_days:
+            times = [time_to_sec(d[1]) if isinstance(d[1], basestring)
+                     else d[1] for d in raw_data]
+        legal_tags = find_legal_tags(tags, times, how_many_appearances,
+                                     how_many_days)
     if isinstance(legal_tags, basestring):
+        if legal_tags == "ALL":
+            return raw_data
         legal_tags = [legal_tags]
-    for d in raw_data:
-        mouse = d[4]
-        if mouse in legal_tags:
-            new_data.append(d)
-    return new_data[:]
+    keep = np.isin(tags, np.asarray(legal_tags))
+    if is_array:
+        return raw_data[keep]
+    return [d for d, kept in zip(raw_data, keep) if kept]
+
 
+def registrations_by_antenna(raw_data):
+    """
+    Return a dictionary of registration times (ordered as in raw_data)
+    for every antenna in raw_data.
+    """
+    antennas, codes = np.unique(raw_data["Antenna"], return_inverse=True)
+    codes = codes.ravel()
+    order = np.argsort(codes, kind="stable")
+    times = raw_data["Time"][order]
+    bounds = np.searchsorted(codes[order], np.arange(len(antennas) + 1))
+    return {antenna: times[bounds[i]:bounds[i+1]]
+            for i, antenna in enumerate(antennas.tolist())}
 
-def check_antenna_presence(raw_data, setup_config, max_break):
+
+def antenna_transitions(raw_data):
+    """
+    Count consecutive registrations of animal tags by pairs of antennas.
+
+    Returns:
+       antennas: array of antennas in raw_data
+       count: int array, count[i, j] is the number of registrations
+          by antennas[j] directly following a registration of the same
+          tag by antennas[i]
+       fast: int array, the same as count for registrations starting
+          before the end of the preceding registration
+    """
+    antennas, codes = np.unique(raw_data["Antenna"], return_inverse=True)
+    tags = np.unique(raw_data["Tag"], return_inverse=True)[1].ravel()
+    order = np.argsort(tags, kind="stable")
+    codes = codes.ravel()[order]
+    tags = tags[order]
+    times = raw_data["Time"][order]
+    durations = raw_data["Duration"][order]
+    same = tags[1:] == tags[:-1]
+    size = len(antennas)
+    pairs = codes[:-1][same]*size + codes[1:][same]
+    count = np.bincount(pairs, minlength=size*size).reshape(size, size)
+    fast = (times[1:] <= times[:-1] + durations[:-1]/1000)[same]
+    fast = np.bincount(pairs, weights=fast, minlength=size*size)
+    return antennas, count, fast.astype(int).reshape(size, size)
+
+
+def pair_count(antennas, count, pair):
+    """
+    Return count of transitions between antennas in pair ("a1 a2",
+    with a1 not greater than a2) in both directions.
+    """
+    a1, a2 = pair.split(" ")
+    if a1 > a2:
+        return 0
+    index = np.searchsorted(antennas, [a1, a2])
+    if (index >= len(antennas)).any() or antennas[index[0]] != a1\
+       or antennas[index[1]] != a2:
+        return 0
+    i, j = index
+    if i == j:
+        return int(count[i, i])
+    return int(count[i, j] + count[j, i])
+
+
+def check_antenna_presence(raw_data, setup_config, max_break,
+                           antenna_times=None):
     if not len(raw_data):
         raise Exception("Empty dataset")
-    all_times = raw_data['Time']
     t_start = raw_data['Time'][0]
     breaks = {}
     t_end = raw_data['Time'][-1]
+    if antenna_times is None:
+        antenna_times = registrations_by_antenna(raw_data)
     for antenna in setup_config.all_antennas:
-        antenna_idx = []
-        for i, a in enumerate(raw_data['Antenna']):
-            if antenna == a:
-                antenna_idx.append(i)
-        times = all_times[antenna_idx]
+        times = antenna_times.get(antenna, [])
         breaks[antenna] = []
         if len(times):
             if times[0] - t_start > max_break:
                 breaks[antenna].append([t_start, np.round(times[0])])
-            intervals = times[1:] - times[0:-1]
-            where_breaks = np.where(intervals > max_break)[0]
-            if len(where_breaks):
-                for i in where_breaks:
-                    breaks[antenna].append([np.round(times[i]),
-                                            np.round(times[i+1])])
+            intervals = np.diff(times)
+            for i in np.where(intervals > max_break)[0]:
+                breaks[antenna].append([np.round(times[i]),
+                                        np.round(times[i+1])])
             if t_end - times[-1] > max_break:
                 breaks[antenna].append([np.round(times[-1]), t_end])
         else:
-            breaks[antenna].append([np.round(t_start),
-                                    raw_data['Time'][-1]])
+            breaks[antenna].append([np.round(t_start), t_end])
     return breaks
 
 
-def antenna_mismatch(raw_data, setup_config):
+def antenna_mismatch(raw_data, setup_config, transitions=None):
     if not len(raw_data):
         raise Exception("Empty dataset")
-    pairs = setup_config.mismatched_pairs
-    all_times = raw_data['Time']
-    mice = set(raw_data['Tag'])
+    if transitions is None:
+        transitions = antenna_transitions(raw_data)
+    antennas, count, fast = transitions
     mismatches = OrderedDict()
-    for pair in pairs:
-        mismatches[pair] = 0
-    for mouse in mice:
-        mouse_idx = np.where(np.array(raw_data['Tag']) == mouse)[0]
-        times = all_times[mouse_idx]
-        ant = raw_data['Antenna'][mouse_idx]
-        for i, a in enumerate(ant[:-1]):
-            key = "%s %s" % (min(a, ant[i+1]), max(a, ant[i+1]))
-            if key in pairs:
-                mismatches[key] += 1
+    for pair in setup_config.mismatched_pairs:
+        mismatches[pair] = pair_count(antennas, count, pair)
     return mismatches
 
 
@@ -333,30 +887,64 @@ def total_mismatches(mismatches):
     return out
 
 
-def skipped_registrations(raw_data, setup_config):
+def skipped_registrations(raw_data, setup_config, transitions=None):
     if not len(raw_data):
         raise Exception("Empty dataset")
-    one_skipped = setup_config.skipped_one()
-    skipped_two = setup_config.skipped_two()
-    skipped_more = setup_config.skipped_more()
-
-    mice = set(raw_data['Tag'])
-    mismatches = OrderedDict([("skipped one", 0), ("skipped two", 0),
-                              ("skipped more", 0)])
-    for mouse in mice:
-        mouse_idx = np.where(np.array(raw_data['Tag']) == mouse)[0]
-        ant = raw_data['Antenna'][mouse_idx]
-        for i, a in enumerate(ant[:-1]):
-            key = "%s %s" % (a, ant[i+1])
-            if key in one_skipped:
-                mismatches["skipped one"] += 1
-            elif key in skipped_more:
-                mismatches["skipped more"] += 1
-            elif key in skipped_two:
-                mismatches["skipped two"] += 1
+    if transitions is None:
+        transitions = antenna_transitions(raw_data)
+    antennas, count, fast = transitions
+    codes = setup_config.pair_codes(antennas)
+    known = codes >= 0
+    category = setup_config.pair_category[np.ix_(codes[known],
+                                                 codes[known])]
+    count = np.asarray(count)[np.ix_(known, known)]
+    mismatches = OrderedDict()
+    for key, value in [("skipped one", PAIR_SKIPPED_ONE),
+                       ("skipped two", PAIR_SKIPPED_TWO),
+                       ("skipped more", PAIR_SKIPPED_MORE)]:
+        mismatches[key] = int(count[category == value].sum())
     return mismatches
 
 
+def skipped_by_distance(raw_data, setup_config, transitions=None):
+    """
+    Count consecutive registrations of an animal by antennas, which
+    are not in the same compartment, by the number of antennas skipped
+    (hop distance between the antennas minus one, see
+    SetupConfig.hop_distance). Registrations by antennas that
+    are not connected are counted as "unconnected".
+    """
+    if not len(raw_data):
+        raise Exception("Empty dataset")
+    if transitions is None:
+        transitions = antenna_transitions(raw_data)
+    antennas, count, fast = transitions
+    codes = setup_config.pair_codes(antennas)
+    known = codes >= 0
+    hops = setup_config.hop_distance[np.ix_(codes[known], codes[known])]
+    count = np.asarray(count)[np.ix_(known, known)]
+    out = OrderedDict()
+    for distance in np.unique(hops[hops > 1]):
+        out[int(distance) - 1] = int(count[hops == distance].sum())
+    if (hops == HOP_UNREACHABLE).any():
+        out["unconnected"] = int(count[hops == HOP_UNREACHABLE].sum())
+    return out
+
+
+def update_skipped_by_distance(skipped, new_skipped):
+    """
+    Add counts of new_skipped to skipped (see skipped_by_distance).
+    """
+    for key, value in new_skipped.items():
+        skipped[key] = skipped.get(key, 0) + value
+    keys = sorted(key for key in skipped if key != "unconnected")
+    if "unconnected" in skipped:
+        keys.append("unconnected")
+    for key in keys:
+        skipped.move_to_end(key)
+    return skipped
+
+
 def save_skipped_registrations(skipped, tot_registrations, res_dir,
                                fname="skipped_registrations.csv",
                                header=u"type, count, percentage\n"):
@@ -434,6 +1022,160 @@ def save_antenna_breaks(antenna_breaks, res_dir):
     return out_f2
 
 
+def diagnostics_counts(raw_data, setup_config, max_break):
+    """
+    Count mismatched, skipped and incorrect tunnel registrations and
+    find breaks in antenna registrations.
+
+    Args:
+    raw_data:  structured array
+       registrations sorted by registration time
+    setup_config: SetupConfig or ExperimentalSetupConfig
+      object describing geometry of the (modular) experimental setup
+    max_break: float
+       maximum break in single antenna registrations (in sec)
+
+    Returns:
+      dictionary of counts, which can be saved with save_diagnostics
+      and updated with new registrations with update_diagnostics
+    """
+    counts = {}
+    transitions = antenna_transitions(raw_data)
+    antenna_times = registrations_by_antenna(raw_data)
+    counts["mismatches"] = antenna_mismatch(raw_data, setup_config,
+                                            transitions)
+    counts["breaks"] = check_antenna_presence(raw_data, setup_config,
+                                              max_break, antenna_times)
+    counts["counters"] = Counter({antenna: len(times) for antenna, times
+                                  in antenna_times.items()})
+    counts["skipped"] = skipped_registrations(raw_data, setup_config,
+                                              transitions)
+    counts["skipped_by_distance"] = skipped_by_distance(raw_data,
+                                                        setup_config,
+                                                        transitions)
+    out = incorrect_tunnel_registrations(raw_data, setup_config,
+                                         transitions)
+    counts["tunnel_count"], counts["tunnel_total_count"] = out
+    counts["registrations"] = len(raw_data["Tag"])
+    counts["t_start"] = raw_data["Time"][0]
+    counts["t_end"] = raw_data["Time"][-1]
+    counts["last_registrations"] = {}
+    for antenna in setup_config.all_antennas:
+        if antenna in antenna_times:
+            counts["last_registrations"][antenna] = \
+                antenna_times[antenna][-1]
+    return counts
+
+
+def extend_antenna_breaks(counts, new_data, setup_config, max_break):
+    """
+    Update breaks in antenna registrations in counts with registrations
+    in new_data, which follow all the registrations counts were
+    calculated for.
+    """
+    t_start = counts["t_start"]
+    t_end_old = counts["t_end"]
+    t_end = new_data["Time"][-1]
+    last_registrations = counts["last_registrations"]
+    antenna_times = registrations_by_antenna(new_data)
+    for antenna in setup_config.all_antennas:
+        times = antenna_times.get(antenna, np.array([]))
+        breaks = counts["breaks"].get(antenna, [])
+        if antenna in last_registrations:
+            last = last_registrations[antenna]
+            if t_end_old - last > max_break:
+                breaks = breaks[:-1]
+            times = np.concatenate([[last], times])
+        elif len(times):
+            breaks = []
+            if times[0] - t_start > max_break:
+                breaks.append([t_start, np.round(times[0])])
+        else:
+            counts["breaks"][antenna] = [[np.round(t_start), t_end]]
+            continue
+        intervals = times[1:] - times[0:-1]
+        for i in np.where(intervals > max_break)[0]:
+            breaks.append([np.round(times[i]), np.round(times[i+1])])
+        if t_end - times[-1] > max_break:
+            breaks.append([np.round(times[-1]), t_end])
+        counts["breaks"][antenna] = breaks
+        last_registrations[antenna] = times[-1]
+    counts["t_end"] = t_end
+
+
+def update_diagnostics(counts, last_registrations, new_data, setup_config,
+                       max_break):
+    """
+    Update diagnostics counts with registrations in new_data.
+
+    Args:
+    counts: dictionary
+       diagnostics counts calculated by diagnostics_counts
+    last_registrations: structured array
+       the last registration of every animal tag preceding new_data,
+       consecutive registrations of a tag are counted only once
+    new_data: structured array
+       registrations following all the registrations counts were
+       calculated for sorted by registration time
+    setup_config: SetupConfig or ExperimentalSetupConfig
+      object describing geometry of the (modular) experimental setup
+    max_break: float
+       maximum break in single antenna registrations (in sec)
+    """
+    if not len(new_data):
+        return counts
+    data = np.concatenate([last_registrations, new_data])
+    transitions = antenna_transitions(data)
+    mismatches = antenna_mismatch(data, setup_config, transitions)
+    for key in mismatches:
+        counts["mismatches"][key] += mismatches[key]
+    extend_antenna_breaks(counts, new_data, setup_config, max_break)
+    antennas, antenna_count = np.unique(new_data["Antenna"],
+                                        return_counts=True)
+    counts["counters"].update(dict(zip(antennas.tolist(),
+                                       antenna_count.tolist())))
+    skipped = skipped_registrations(data, setup_config, transitions)
+    for key in skipped:
+        counts["skipped"][key] += skipped[key]
+    update_skipped_by_distance(counts.setdefault("skipped_by_distance",
+                                                 OrderedDict()),
+                               skipped_by_distance(data, setup_config,
+                                                   transitions))
+    count, total_count = incorrect_tunnel_registrations(data, setup_config,
+                                                        transitions)
+    for key in count:
+        counts["tunnel_count"][key] += count[key]
+        counts["tunnel_total_count"][key] += total_count[key]
+    counts["registrations"] += len(new_data["Tag"])
+    return counts
+
+
+def save_diagnostics(counts, res_dir):
+    """
+    Save diagnostics counts in "diagnostics" directory. Returns texts
+    saved in consecutive files (see run_diagnostics).
+    """
+    string_1 = save_mismatches(counts["mismatches"], counts["registrations"],
+                               res_dir)
+    string_2 = save_antenna_breaks(counts["breaks"], res_dir)
+    tot_mismatches = total_mismatches(counts["mismatches"])
+    string_3 = save_total_mismatches(tot_mismatches, counts["counters"],
+                                     res_dir)
+    string_4 = save_skipped_registrations(counts["skipped"],
+                                          counts["registrations"], res_dir)
+    if "skipped_by_distance" in counts:
+        save_skipped_registrations(
+            counts["skipped_by_distance"], counts["registrations"], res_dir,
+            fname="skipped_registrations_by_distance.csv",
+            header=u"antennas skipped, count, percentage\n")
+    header = u"tunnel, count, percentage of all passings through the tunnel\n"
+    string_5 = save_mismatches(counts["tunnel_count"],
+                               counts["tunnel_total_count"], res_dir,
+                               fname="incorrect_tunnel_registrations.csv",
+                               header=header)
+    return string_1, string_2, string_3, string_4, string_5
+
+
 def run_diagnostics(raw_data, max_break, res_dir, setup_config):
     """
     Calculate parameters showing fidelity of obtained antenna
@@ -468,110 +1210,106 @@ def run_diagnostics(raw_data, max_break, res_dir, setup_config):
         text showing count and percentage of cases, when two entrance antennas
         to the same tunnel registered an animal simultaneously
     """
-    mismatches = antenna_mismatch(raw_data, setup_config)
-    string_1 = save_mismatches(mismatches, len(raw_data["Antenna"]),
-                               res_dir)
-    antenna_breaks = check_antenna_presence(raw_data, setup_config, max_break)
-    string_2 = save_antenna_breaks(antenna_breaks, res_dir)
-    tot_mismatches = total_mismatches(mismatches)
-    counters = Counter(raw_data["Antenna"])
-    string_3 = save_total_mismatches(tot_mismatches, counters, res_dir)
-    skip = skipped_registrations(raw_data, setup_config)
-    string_4 = save_skipped_registrations(skip, len(raw_data["Tag"]), res_dir)
-    count, total_count = incorrect_tunnel_registrations(raw_data, setup_config)
-    header = u"tunnel, count, percentage of all passings through the tunnel\n"
-    string_5 = save_mismatches(count, total_count, res_dir,
-                               fname="incorrect_tunnel_registrations.csv",
-                               header=header)
-    return string_1, string_2, string_3, string_4, string_5
-
-
-def incorrect_tunnel_single_mouse(keys, antennas, times, durations):
-    count = {}
-    total_count = {}
-    for key in keys:
-        count[key] = 0
-        total_count[key] = 0
-    for i, a1 in enumerate(antennas[:-1]):
-        a2 = antennas[i+1]
-        key = "%s %s" % (min(a1, a2), max(a1, a2))
-        if key in keys:
-            t1, t2 = times[i], times[i+1]
-            d1 = durations[i]/1000
-            total_count[key] += 1
-            if t2 <= t1 + d1:
-                count[key] += 1
-    return count, total_count
+    counts = diagnostics_counts(raw_data, setup_config, max_break)
+    return save_diagnostics(counts, res_dir)
 
 
-def incorrect_tunnel_registrations(raw_data, setup_config):
+def incorrect_tunnel_registrations(raw_data, setup_config,
+                                   transitions=None):
     count = OrderedDict()
     directions = setup_config.directions
     total_count = {}
+    if transitions is None:
+        transitions = antenna_transitions(raw_data)
+    antennas, pairs, fast = transitions
     for direction in sorted(directions):
         a1, a2 = direction.split(" ")
         key = "%s %s" % (min(a1, a2), max(a1, a2))
-        count[key] = 0
-        total_count[key] = 0
-    mice = set(raw_data['Tag'])
-
-    for mouse in mice:
-        mouse_idx = np.where(np.array(raw_data['Tag']) == mouse)[0]
-        times1 = raw_data["Time"][mouse_idx]
-        antennas1 = raw_data['Antenna'][mouse_idx]
-        durations1 = raw_data["Duration"][mouse_idx]
-        out_count, out_tot_count = incorrect_tunnel_single_mouse(count.keys(),
-                                                                 antennas1,
-                                                                 times1,
-                                                                 durations1)
-        for key in count:
-            count[key] += out_count[key]
-            total_count[key] += out_tot_count[key]
+        count[key] = pair_count(antennas, fast, key)
+        total_count[key] = pair_count(antennas, pairs, key)
     return count, total_count
 
 
-def transform_raw(row):
-    return (int(row[0]), time_to_sec(row[1]),
-            row[2], int(row[3]), row[4])
+def transform_visits(data):
+    return np.array(data, dtype=VISITS_DTYPE)
 
 
-def from_raw_data(raw_data):
+def merge_sorted(data_sets, column="Time"):
     """
-    Transform raw data, which is in the form of a double list
-    to a 2D structured array with registrations of animal tags.
+    Merge structured arrays sorted by column into one array sorted by
+    column. Rows with equal values of column keep the order of
+    data_sets.
     """
-    new_data = []
-    for row in raw_data:
-        new_data.append(transform_raw(row))
-    data_type = [("Id", int),
-                 ("Time", float),
-                 ("Antenna", "U15"),
-                 ("Duration", int),
-                 ("Tag", "U15")]
-    return np.array(new_data, dtype=data_type)
+    out = np.empty(sum(len(data) for data in data_sets),
+                   dtype=data_sets[0].dtype)
+    for i, data in enumerate(data_sets):
+        positions = np.arange(len(data))
+        for j, other in enumerate(data_sets):
+            if j == i:
+                continue
+            side = "right" if j < i else "left"
+            positions += np.searchsorted(other[column], data[column],
+                                         side=side)
+        out[positions] = data
+    return out
 
 
-def transform_visits(data):
-    data_type = [("Address", "U30"),
-                 ("Tag", "U15"),
-                 ("AbsStartTimecode", float),
-                 ("AbsEndTimecode", float),
-                 ("VisitDuration", float),
-                 ("ValidVisitSolution", bool)]
-    return np.array(data, dtype=data_type)
-
-
-def rename_antennas(name, dataset):
-    new_data = dataset.copy()
-    for row in new_data:
-        row["Antenna"] = "%s_%s" % (row["Antenna"], name)
-    return new_data
+def sort_ties(data, column="Time"):
+    """
+    Sort rows with equal values of column by the remaining fields
+    (in place), so that data merged by merge_sorted is ordered
+    as by data.sort(order=column).
+    """
+    equal = data[column][1:] == data[column][:-1]
+    if not equal.any():
+        return data
+    tied = np.zeros(len(data), dtype=bool)
+    tied[1:] |= equal
+    tied[:-1] |= equal
+    rows = np.flatnonzero(tied)
+    data[rows] = np.sort(data[rows], order=column)
+    return data
 
 
-def append_data_sources(data_sets):
-    new_data = np.concatenate(data_sets)
-    new_data.sort(order="Time")
-    return new_data
+def merge_registrations(registrations, setup_names):
+    """
+    Merge registrations recorded by parts of a modular Eco-HAB setup.
+
+    Antennas of every part are renamed to antenna_setupname by renaming
+    their lookup tables, integer codes of antennas and tags are mapped
+    to the lookup tables of the merged data and time-sorted registrations
+    are merged without sorting them again.
+
+    Args:
+    registrations: list of Data
+       time-sorted registrations of parts of the setup
+    setup_names: list of strings
+       names of the parts of the setup
+
+    Returns:
+       codes: structured array of merged registrations with integer
+          codes of antennas and tags
+       categories: dictionary of lookup tables of antennas and tags
+    """
+    antenna_dtype = registrations[0].dtype["Antenna"]
+    renamed = [np.char.add(data.categories["Antenna"],
+                           "_%s" % name).astype(antenna_dtype)
+               for data, name in zip(registrations, setup_names)]
+    categories = {
+        "Antenna": np.unique(np.concatenate(renamed)),
+        "Tag": np.unique(np.concatenate([data.categories["Tag"]
+                                         for data in registrations])),
+    }
+    tables = []
+    for data, antennas in zip(registrations, renamed):
+        codes = data.codes.copy()
+        lookup = np.searchsorted(categories["Antenna"], antennas)
+        codes["Antenna"] = lookup[codes["Antenna"]]
+        lookup = np.searchsorted(categories["Tag"], data.categories["Tag"])
+        codes["Tag"] = lookup[codes["Tag"]]
+        tables.append(codes)
+    # lookup tables are sorted, so ties are ordered as by their values
+    return sort_ties(merge_sorted(tables)), categories
 
 
 class NamedDict(dict):
@@ -628,3 +1366,45 @@ class NamedDict(dict):
     def __dir__(self):
         dirlist = super(NamedDict, self).__dir__()
         return dirlist
+
+
+class Visit(object):
+    """Lightweight record of a visit to an Eco-HAB compartment.
+
+    Fields (mouse, address, t_start, t_end, duration) can be accessed
+    as attributes or as keys, like fields of visits returned as
+    NamedDicts, e.g. visit.t_start or visit["t_start"].
+    """
+    __slots__ = ("mouse", "address", "t_start", "t_end", "duration")
+
+    def __init__(self, mouse, address, t_start, t_end, duration):
+        self.mouse = mouse
+        self.address = address
+        self.t_start = t_start
+        self.t_end = t_end
+        self.duration = duration
+
+    def __getitem__(self, k):
+        if k not in self.__slots__:
+            raise KeyError(k)
+        return getattr(self, k)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Visit):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k)
+                   for k in self.__slots__)
+
+    def __ne__(self, other):
+        out = self.__eq__(other)
+        if out is NotImplemented:
+            return out
+        return not out
+
+    def __repr__(self):
+        items = ", ".join("%s=%r" % (k, getattr(self, k))
+                          for k in self.__slots__)
+        return "Visit(%s)" % items
@@ -5,8 +5,17 @@ import os
 import time
 import sys
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+# categories of consecutive registrations of an animal by a pair of antennas
+PAIR_ALLOWED = 0
+PAIR_SKIPPED_ONE = 1
+PAIR_SKIPPED_TWO = 2
+PAIR_SKIPPED_MORE = 3
+# hop distance between antennas that are not connected by any compartments
+HOP_UNREACHABLE = -1
+
 
 # NamedDict class was originally written by Zbyszek Jędrzejewski-Szmek
 # and Avrama Blackwell for moose_nerp https://github.com/neurord/moose_nerp
@@ -181,12 +190,11 @@ def change_state(antennas):
 
 def get_times_antennas(e_data, mouse, t_1, t_2):
     if t_1 == 0 and t_2 == -1:
-        e_data.unmask_data()
-        return e_data.get_times(mouse), e_data.get_antennas(mouse)
-    e_data.mask_data(t_1, t_2)
-    antennas, times = e_data.get_antennas(mouse), e_data.get_times(mouse)
-    e_data.unmask_data()
-    return times, antennas
+        view = e_data.window()
+    else:
+        view = e_data.window(t_1, t_2)
+    return (view.get_times(mouse).tolist(),
+            view.get_antennas(mouse).tolist())
 
 
 def get_times_antennas_list_of_mice(ecohab_data, mice, t_1, t_2):
@@ -261,15 +269,12 @@ def get_indices(t_start, t_end, starts, ends):
 def get_ecohab_data_with_margin(ecohab_data, mouse, t_start, t_end,
                                 margin=12*3600):
     if t_start == 0 and t_end == -1:
-        return ecohab_data.get_visit_addresses(mouse),\
-            ecohab_data.get_starttimes(mouse),\
-            ecohab_data.get_endtimes(mouse)
-    ecohab_data.mask_data(t_start - margin, t_end + margin)
-    adresses = ecohab_data.get_visit_addresses(mouse)
-    starts = ecohab_data.get_starttimes(mouse)
-    ends = ecohab_data.get_endtimes(mouse)
-    ecohab_data.unmask_data()
-    return adresses, starts, ends
+        view = ecohab_data
+    else:
+        view = ecohab_data.window(t_start - margin, t_end + margin)
+    return view.get_visit_addresses(mouse).tolist(),\
+        view.get_starttimes(mouse).tolist(),\
+        view.get_endtimes(mouse).tolist()
 
 
 def prepare_data(ecohab_data, mice, times=None):
@@ -278,9 +283,9 @@ def prepare_data(ecohab_data, mice, times=None):
     if not isinstance(mice, list):
         mice = [mice]
     if times is None:
-        ecohab_data.unmask_data()
-        times = (ecohab_data.get_starttimes(mice)[0],
-                 ecohab_data.get_endtimes(mice)[-1])
+        view = ecohab_data.window()
+        times = (view.get_starttimes(mice)[0],
+                 view.get_endtimes(mice)[-1])
     t_start, t_end = times
     for mouse in mice:
         data[mouse] = []
@@ -294,71 +299,223 @@ def prepare_data(ecohab_data, mice, times=None):
     return data
 
 
-def get_animal_position(times, antennas, mouse, threshold, same_pipe,
-                        same_address, opposite_pipe, address, surrounding,
-                        address_not_adjacent, internal_antennas):
-    out = []
-    i = 0
-    if len(times) < 2:
-        return []
-    t_start, an_start = times[0], antennas[0]
-    t_end, an_end = times[1], antennas[1]
-    while i < len(times) - 1:
-        delta_t = t_end - t_start
-        if an_start in internal_antennas:
-            while an_end == an_start:
-                i = i + 1
-                try:
-                    t_end, an_end = times[i+1], antennas[i+1]
-                except IndexError:
-                    out.append((address[an_start], mouse,
-                                t_start, t_end, t_end-t_start, True))
-                    return out
-            out.append((address[an_start], mouse,
-                        t_start, t_end, t_end-t_start, True))
-        elif an_end in internal_antennas:
-            an_old_end = an_end
-            while an_end == an_old_end:
-                i = i + 1
-                try:
-                    an_end = antennas[i+1]
-                    t_end = times[i+1]
-                except IndexError:
-                    out.append((address[an_old_end], mouse,
-                                t_start, t_end, t_end-t_start, True))
-                    return out
-            out.append((address[an_old_end], mouse,
-                        t_start, t_end, t_end-t_start, True))
-
-        elif delta_t < threshold:
-            pass
-        elif an_end == an_start:
-            out.append((address[an_start], mouse,
-                        t_start, t_end, delta_t, True))
-        elif an_start in same_pipe and an_end in same_pipe[an_start]:
-            pass
-        elif an_end in same_address[an_start]:
-            out.append((address[an_start], mouse,
-                        t_start, t_end, delta_t, True))
-        elif (min(an_start, an_end), max(an_start, an_end)) in surrounding:
-            out.append((surrounding[(min(an_start, an_end),
-                                     max(an_start, an_end))],
-                        mouse, t_start, t_end, delta_t, False))
-        elif an_start in opposite_pipe and an_end in opposite_pipe[an_start]:
-            pass
-        else:
-            out.append((address_not_adjacent[an_start],
-                        mouse, t_start, t_end, delta_t, False))
+def get_antenna_transitions(antennas, same_pipe, same_address,
+                            opposite_pipe, address, surrounding,
+                            address_not_adjacent, internal_antennas):
+    """Tabulate visits inferred from two consecutive registrations
+    by a pair of antennas.
+
+    Args:
+       antennas: list of antennas
+       same_pipe, same_address, opposite_pipe, address, surrounding,
+       address_not_adjacent, internal_antennas: antenna tables
+          of SetupConfig
+
+    Returns:
+       addresses: list of compartments
+       table: int array, table[i, j] is the index (in addresses) of
+          the compartment visited by an animal registered by antennas[i]
+          and then by antennas[j] (diagonal entries of internal antennas
+          give their compartment), -1 if no visit follows, -2 if
+          antennas are missing from the setup
+       valid: bool array, ValidVisitSolution of visits in table
+       internal: bool array, True for internal antennas
+    """
+    size = len(antennas)
+    addresses = []
+    table = -np.ones((size, size), dtype=int)
+    valid = np.zeros((size, size), dtype=bool)
+    internal = np.array([an in internal_antennas for an in antennas],
+                        dtype=bool)
+    for i, an_start in enumerate(antennas):
+        for j, an_end in enumerate(antennas):
+            if (internal[i] or internal[j]) and i != j:
+                continue
+            try:
+                if an_end == an_start:
+                    out = address[an_start], True
+                elif an_start in same_pipe and an_end in same_pipe[an_start]:
+                    continue
+                elif an_end in same_address[an_start]:
+                    out = address[an_start], True
+                elif (min(an_start, an_end),
+                      max(an_start, an_end)) in surrounding:
+                    out = surrounding[(min(an_start, an_end),
+                                       max(an_start, an_end))], False
+                elif (an_start in opposite_pipe
+                      and an_end in opposite_pipe[an_start]):
+                    continue
+                else:
+                    out = address_not_adjacent[an_start], False
+            except KeyError:
+                table[i, j] = -2
+                continue
+            if out[0] not in addresses:
+                addresses.append(out[0])
+            table[i, j] = addresses.index(out[0])
+            valid[i, j] = out[1]
+    return addresses, table, valid, internal
+
+
+def get_animal_positions(times, antennas, mouse_ids, threshold, table,
+                         valid, internal):
+    """Infer visits of many animals from their registrations.
+    Runs of registrations by an internal antenna are collapsed to
+    a single visit, remaining pairs of consecutive registrations are
+    classified with the table of get_antenna_transitions.
+
+    Args:
+       times: array of floats
+       antennas: array of ints, antenna indices in the transition table
+       mouse_ids: array of ints, registrations of every animal have to
+          be kept together and ordered in time
+       threshold: float
+       table, valid, internal: output of get_antenna_transitions
+
+    Returns:
+       addresses (indices), mouse ids, start times, end times
+       and validity of visits, ordered by animal and start time.
+    """
+    return get_animal_positions_sweep(times, antennas, mouse_ids,
+                                      [threshold], table, valid,
+                                      internal)[0]
 
-        i = i + 1
-        try:
-            an_start, an_end = antennas[i], antennas[i+1]
-            t_start, t_end = times[i], times[i+1]
-        except IndexError:
-            return out
+
+def get_animal_positions_sweep(times, antennas, mouse_ids, thresholds,
+                               table, valid, internal):
+    """Run get_animal_positions for many visit thresholds. Registrations
+    are classified once, the threshold only selects pairs of consecutive
+    registrations separated by at least threshold.
+
+    Args:
+       times, antennas, mouse_ids, table, valid, internal:
+          as in get_animal_positions
+       thresholds: list of floats
+
+    Returns:
+       list of get_animal_positions outputs, one for every threshold
+    """
+    times = np.asarray(times, dtype=float)
+    antennas = np.asarray(antennas, dtype=int)
+    mouse_ids = np.asarray(mouse_ids, dtype=int)
+    length = len(times)
+    if length < 2:
+        empty = np.array([], dtype=int)
+        return [(empty, empty, np.array([]), np.array([]),
+                 np.array([], dtype=bool)) for threshold in thresholds]
+    same_mouse = mouse_ids[1:] == mouse_ids[:-1]
+    mouse_start = np.concatenate([[True], ~same_mouse])
+    first = np.flatnonzero(mouse_start)
+    last = np.repeat(np.append(first[1:], length) - 1,
+                     np.diff(np.append(first, length)))
+    is_internal = internal[antennas]
+
+    # runs of registrations by one internal antenna, a run following
+    # an entrance antenna starts at the entrance antenna registration
+    run_start = mouse_start.copy()
+    run_start[1:] |= antennas[1:] != antennas[:-1]
+    starts = np.flatnonzero(run_start)
+    ends = np.append(starts[1:], length)
+    runs = is_internal[starts]
+    starts, ends = starts[runs], ends[runs]
+    after_entrance = ~mouse_start[starts] & ~is_internal[starts - 1]
+    run_pos = np.where(after_entrance, starts - 1, starts)
+    keep = run_pos < last[starts]
+    starts, ends, run_pos = starts[keep], ends[keep], run_pos[keep]
+    run_end = np.minimum(ends, last[starts])
+    run_address = table[antennas[starts], antennas[starts]]
+    if np.any(run_address == -2):
+        raise KeyError("Antennas missing from the setup configuration")
+
+    # consecutive registrations by other antennas
+    all_pairs = np.flatnonzero(same_mouse & ~is_internal[:-1]
+                               & ~is_internal[1:])
+    all_delta = times[all_pairs + 1] - times[all_pairs]
+    all_address = table[antennas[all_pairs], antennas[all_pairs + 1]]
+    all_valid = valid[antennas[all_pairs], antennas[all_pairs + 1]]
+
+    out = []
+    for threshold in thresholds:
+        long_enough = all_delta >= threshold
+        if np.any(all_address[long_enough] == -2):
+            raise KeyError("Antennas missing from the setup configuration")
+        visit = long_enough & (all_address >= 0)
+        pair_pos, pair_address = all_pairs[visit], all_address[visit]
+        position = np.concatenate([run_pos, pair_pos])
+        order = np.argsort(position, kind="stable")
+        position = position[order]
+        t_end = np.concatenate([times[run_end], times[pair_pos + 1]])[order]
+        address_idx = np.concatenate([run_address, pair_address])[order]
+        validity = np.concatenate([np.ones(len(run_pos), dtype=bool),
+                                   all_valid[visit]])[order]
+        out.append((address_idx, mouse_ids[position], times[position],
+                    t_end, validity))
     return out
 
 
+def calculate_animal_positions(times, antennas, mouse_ids, threshold,
+                               table, valid, internal, workers=1):
+    """Run get_animal_positions for registrations of many animals.
+
+    Args:
+       times, antennas, mouse_ids, threshold, table, valid, internal:
+          as in get_animal_positions
+       workers: int or None
+          number of processes. If workers is larger than 1, animals
+          are divided between processes of a pool, None uses all
+          available cores. Default 1.
+
+    Returns:
+       output of get_animal_positions
+    """
+    return calculate_animal_positions_sweep(times, antennas, mouse_ids,
+                                            [threshold], table, valid,
+                                            internal, workers)[0]
+
+
+def calculate_animal_positions_sweep(times, antennas, mouse_ids, thresholds,
+                                     table, valid, internal, workers=1):
+    """Run get_animal_positions_sweep for registrations of many animals.
+
+    Args:
+       times, antennas, mouse_ids, thresholds, table, valid, internal:
+          as in get_animal_positions_sweep
+       workers: int or None
+          as in calculate_animal_positions
+
+    Returns:
+       output of get_animal_positions_sweep
+    """
+    thresholds = list(thresholds)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    mouse_ids = np.asarray(mouse_ids, dtype=int)
+    first = np.flatnonzero(np.concatenate([[True],
+                                           mouse_ids[1:] != mouse_ids[:-1]]))
+    workers = min(workers, len(first))
+    if workers < 2:
+        return get_animal_positions_sweep(times, antennas, mouse_ids,
+                                          thresholds, table, valid, internal)
+    times = np.asarray(times, dtype=float)
+    antennas = np.asarray(antennas, dtype=int)
+    # divide animals so that processes get similar numbers of registrations
+    idx = np.searchsorted(first, np.arange(1, workers)*len(times)/workers)
+    bounds = np.unique(np.concatenate([first[idx[idx < len(first)]],
+                                       [0, len(times)]]))
+    chunks = [slice(start, end) for start, end in zip(bounds[:-1],
+                                                      bounds[1:])]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        out = list(executor.map(get_animal_positions_sweep,
+                                [times[chunk] for chunk in chunks],
+                                [antennas[chunk] for chunk in chunks],
+                                [mouse_ids[chunk] for chunk in chunks],
+                                [thresholds]*len(chunks),
+                                [table]*len(chunks), [valid]*len(chunks),
+                                [internal]*len(chunks)))
+    return [tuple(np.concatenate(arrays) for arrays in zip(*chunk_out))
+            for chunk_out in zip(*out)]
+
+
 def get_length(time_start, time_end, binsize):
     return int(np.ceil((time_end - time_start)/binsize))
 
@@ -407,88 +564,136 @@ def calc_excess(res, exp_res):
     return excess
 
 
-def get_dark_light_data(phase, timeline, ecohab_data, mice):
+def get_dark_light_windows(phase, timeline):
     if phase == "dark" or phase == "DARK" or phase == "Dark":
         phases = filter_dark(timeline.sections())
     elif phase == "light" or phase == "LIGHT" or phase == "Light":
         phases = filter_light(timeline.sections())
     out_phases = [phase]
-    data = {mouse: [] for mouse in mice}
+    windows = []
     total_time = 0
     for i, ph in enumerate(phases):
         time = timeline.get_time_from_epoch(ph)
-        out = prepare_data(ecohab_data, mice, time)
-        for mouse in mice:
-            data[mouse].extend(out[mouse])
+        windows.append(time)
         total_time += (time[1] - time[0])
-    out_data = {phase: {0: data}}
-    return out_phases, {phase: {0: total_time}}, out_data
+    return out_phases, {phase: {0: total_time}}, {phase: {0: windows}}
 
-def get_custom_range_data(phase_def, timeline, ecohab_data, mice):
+
+def get_custom_range_windows(phase_def, timeline):
     out_phases = []
-    out_data = {}   
+    out_windows = {}
     times = {}
     for i, phases in enumerate(phase_def):
         total_time = 0
         phase_name = ""
-        data = {mouse: [] for mouse in mice}
+        windows = []
         if isinstance(phases, str):
             phases = [phases]
         assert isinstance(phases, list)
         for ph in phases:
             phase_name += ph.replace(" ", "_") + "_"
             time = timeline.get_time_from_epoch(ph)
-            out = prepare_data(ecohab_data, mice, time)
-            for mouse in mice:
-                data[mouse].extend(out[mouse])
+            windows.append(time)
             total_time += (time[1] - time[0])
         out_phases.append(phase_name)
-        out_data[phase_name] = {0: data}
+        out_windows[phase_name] = {0: windows}
         times[phase_name] = {0: total_time}
-    return out_phases, times, out_data
+    return out_phases, times, out_windows
 
-            
-def prepare_binned_data(ecohab_data, timeline, bins, mice):
-    total_time = OrderedDict()
+
+def prepare_windows_data(ecohab_data, mice, windows):
+    """Prepare masked data of all time windows, one list of visits
+    per mouse."""
+    if len(windows) == 1:
+        return prepare_data(ecohab_data, mice, windows[0])
+    data = {mouse: [] for mouse in mice}
+    for time in windows:
+        out = prepare_data(ecohab_data, mice, time)
+        for mouse in mice:
+            data[mouse].extend(out[mouse])
+    return data
+
+
+def prepare_windows_data_index(interval_index, mice, addresses, windows,
+                               margin=12*3600):
+    """Prepare data of all time windows as prepare_windows_data, using
+    interval index of the dataset (see EcoHabDataBase.interval_index).
+    Visits of every mouse are grouped by address."""
+    data = {}
+    for mouse in mice:
+        data[mouse] = []
+        for address in addresses:
+            for t_start, t_end in windows:
+                starts, ends = interval_index.get_starting_or_ending(mouse,
+                                                                     address,
+                                                                     t_start,
+                                                                     t_end,
+                                                                     margin)
+                data[mouse].extend((address, s, e) for s, e
+                                   in zip(starts.tolist(), ends.tolist()))
+    return data
+
+
+def windows_to_data(ecohab_data, mice, windows):
     data = OrderedDict()
+    for phase in windows:
+        data[phase] = OrderedDict()
+        for label in windows[phase]:
+            data[phase][label] = prepare_windows_data(ecohab_data, mice,
+                                                      windows[phase][label])
+    return data
+
+
+def get_dark_light_data(phase, timeline, ecohab_data, mice):
+    out_phases, total_time, windows = get_dark_light_windows(phase,
+                                                             timeline)
+    return out_phases, total_time, windows_to_data(ecohab_data, mice,
+                                                   windows)
+
+
+def get_custom_range_data(phase_def, timeline, ecohab_data, mice):
+    out_phases, times, windows = get_custom_range_windows(phase_def,
+                                                          timeline)
+    return out_phases, times, windows_to_data(ecohab_data, mice, windows)
+
+
+def prepare_binned_windows(timeline, bins):
+    """Return time windows of every bin, a bin of dark, light or custom
+    phases covers several windows (see prepare_binned_data)."""
+    total_time = OrderedDict()
+    windows = OrderedDict()
     if bins in ["ALL", "all", "All"]:
         phases = ["ALL"]
         time = timeline.get_time_from_epoch("ALL")
         total_time["ALL"] = {0: (time[1] - time[0])}
-        data["ALL"] = {0: prepare_data(ecohab_data, mice, time)}
+        windows["ALL"] = {0: [time]}
         keys = [["ALL"], {"ALL": [0]}]
     elif bins in ['dark', "DARK", "Dark", "light", "LIGHT", "Light"]:
-        phases, total_time, data = get_dark_light_data(bins, timeline,
-                                                       ecohab_data, mice)
+        phases, total_time, windows = get_dark_light_windows(bins, timeline)
         labels = {}
-        for key in data.keys():
+        for key in windows.keys():
             labels[key] = [0]
-        keys = [list(data.keys()), labels]
+        keys = [list(windows.keys()), labels]
     elif isinstance(bins, list):
-        phases, total_time, data = get_custom_range_data(bins, timeline,
-                                                         ecohab_data, mice)
+        phases, total_time, windows = get_custom_range_windows(bins,
+                                                               timeline)
         labels = {}
-        for key in data.keys():
+        for key in windows.keys():
             labels[key] = [0]
-        keys = [list(data.keys()), labels]
+        keys = [list(windows.keys()), labels]
     elif (isinstance(bins, str) and
           bins.lower() in ["whole_phase", "whole phase"]):
         phases = []
         all_phases = filter_dark_light(timeline.sections())
         phases = [phase.replace(" ", "_") for phase in all_phases]
-        times = [timeline.get_time_from_epoch(phase)
-                 for phase in all_phases]
-        data = OrderedDict()
-        total_time = OrderedDict()
         bin_labels = {}
         for phase in all_phases:
             bin_labels[phase] = [0]
             time = timeline.get_time_from_epoch(phase)
             total_time[phase] = {}
             total_time[phase][0] = time[-1] - time[0]
-            data[phase] = {}
-            data[phase][0] = prepare_data(ecohab_data, mice,
-                                          time)
+            windows[phase] = {}
+            windows[phase][0] = [time]
         keys = [all_phases, bin_labels]
     elif isinstance(bins, int) or isinstance(bins, float):
         phases = []
@@ -515,7 +720,7 @@ def prepare_binned_data(ecohab_data, timeline, bins, mice):
             t_start, t_end = times[i]
             phases.append("%s_%4.2fh" % (phase.replace(" ", "_"), bins/3600))
             bin_labels[phase] = get_times(bins, time_end=t_end-t_start)
-            data[phase] = OrderedDict()
+            windows[phase] = OrderedDict()
             total_time[phase] = OrderedDict()
             j = 0
             while t_start < t_end:
@@ -523,18 +728,24 @@ def prepare_binned_data(ecohab_data, timeline, bins, mice):
                 if t_e > t_end:
                     t_e = t_end
                 time = [t_start, t_e]
-                data[phase][bin_labels[phase][j]] = prepare_data(ecohab_data,
-                                                                 mice,
-                                                                 time)
+                windows[phase][bin_labels[phase][j]] = [time]
                 total_time[phase][bin_labels[phase][j]] = time[1] - time[0]
                 t_start += bins
                 j += 1
         keys = [all_phases, bin_labels]
+    return phases, total_time, windows, keys
+
+
+def prepare_binned_data(ecohab_data, timeline, bins, mice):
+    phases, total_time, windows, keys = prepare_binned_windows(timeline,
+                                                               bins)
+    data = windows_to_data(ecohab_data, mice, windows)
     return phases, total_time, data, keys
 
 
 def extract_directions(times, antennas, last_antenna, keys):
     direction_dict = {key: [[], []] for key in keys}
+    keys = set(keys)
     change_indices = change_state(antennas)
     for c_idx in change_indices:
         if c_idx + 1 >= len(antennas):
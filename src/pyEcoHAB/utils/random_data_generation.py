@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
+import copy
 import numpy as np
 from . import general as utils
 from . import BaseFunctions
@@ -12,11 +13,11 @@ class PseudoLoader(object):
         self.mice = self.get_mice()
         self.setup_config = setup_config
         self.directions = setup_config.directions
-        self.session_start = sorted(self.get_times(self.mice))[0]
-        self.session_end = sorted(self.get_times(self.mice))[-1]
+        self.session_start = float(np.min(self.get_times(self.mice)))
+        self.session_end = float(np.max(self.get_times(self.mice)))
 
     def get_mice(self):
-        mouse_list = list(set(self.registrations.data["Tag"]))
+        mouse_list = self.registrations.values("Tag").tolist()
         # new Eco-HAB has a different mouse tag naming convention
         # last five digits are the same whereas in previous version
         # there was a prefix and first digits where the same
@@ -44,6 +45,16 @@ class PseudoLoader(object):
         self.mask = None
         self.registrations.unmask_data()
 
+    def window(self, t_start=None, t_end=None):
+        """Return a view of the dataset with registrations clipped
+        to the range (t_start, t_end), leaving the dataset unmasked."""
+        view = copy.copy(self)
+        view.mask = None
+        if t_start is not None or t_end is not None:
+            view.mask = (t_start, t_end)
+        view.registrations = self.registrations.window(t_start, t_end)
+        return view
+
     def get_antennas(self, mice):
         return self.registrations.getproperty(mice,
                                               'Antenna')
@@ -1,3 +1,4 @@
+import os
 from datetime import datetime, timedelta
 from pyEcoHAB.utils import for_loading as fl
 
@@ -90,7 +91,8 @@ def gen_timeline(data_directory, dark_beginning="12:00",
     """
     config = {}
     # find files
-    filenames = sorted(fl.get_filenames(data_directory))
+    filenames = sorted([os.path.basename(fl.strip_compression(fname))
+                        for fname in fl.get_filenames(data_directory)])
     # find beginning of the experiment
     first_day, last_day = find_first_last(filenames)
     light_beginning = find_light_beginning(dark_beginning,
@@ -0,0 +1,368 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from __future__ import print_function, division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import pyEcoHAB.utils.for_loading as uf
+from pyEcoHAB.utils import BaseFunctions
+from pyEcoHAB import data_path
+
+
+class TestEncode(unittest.TestCase):
+    def test_codes(self):
+        codes, categories = BaseFunctions.encode(["3", "1", "3", "2"])
+        self.assertEqual(categories[codes].tolist(), ["3", "1", "3", "2"])
+
+    def test_categories(self):
+        codes, categories = BaseFunctions.encode(["3", "1", "3", "2"])
+        self.assertEqual(categories.tolist(), ["1", "2", "3"])
+
+    def test_dtype(self):
+        codes, categories = BaseFunctions.encode(["3", "1", "3", "2"])
+        self.assertEqual(codes.dtype, np.int32)
+
+    def test_existing_categories(self):
+        codes, categories = BaseFunctions.encode(["2", "5", "1"],
+                                                 np.array(["1", "2", "3"]))
+        self.assertEqual(categories.tolist(), ["1", "2", "3", "5"])
+        self.assertEqual(codes.tolist(), [1, 3, 0])
+
+
+class TestData(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_short_3_mice")
+        cls.raw, setup = uf.read_single_file_array(path,
+                                                   "20101010_110000.txt")
+        cls.data = BaseFunctions.Data(cls.raw, None)
+        cls.mice = sorted(set(cls.raw["Tag"]))
+
+    def test_data(self):
+        self.assertTrue(np.array_equal(self.data.data, self.raw))
+
+    def test_dtype(self):
+        self.assertEqual(self.data.data.dtype, self.raw.dtype)
+
+    def test_codes_antennas(self):
+        self.assertEqual(self.data.codes.dtype["Antenna"], np.int32)
+
+    def test_codes_tags(self):
+        self.assertEqual(self.data.codes.dtype["Tag"], np.int32)
+
+    def test_lookup_tables(self):
+        self.assertEqual(self.data.categories["Tag"].tolist(), self.mice)
+
+    def test_values(self):
+        self.assertEqual(self.data.values("Tag").tolist(), self.mice)
+
+    def test_code_missing(self):
+        self.assertEqual(len(self.data.code("Tag", "mouse_100")), 0)
+
+    def test_get_antennas(self):
+        mouse = self.mice[1]
+        expected = self.raw["Antenna"][self.raw["Tag"] == mouse].tolist()
+        self.assertEqual(self.data.get_antennas(mouse).tolist(), expected)
+
+    def test_get_times_copy(self):
+        out = self.data.get_times(self.mice[0])
+        out[:] = -1
+        self.assertTrue(np.all(self.data.get_times(self.mice[0]) >= 0))
+
+    def test_no_grouped_copy(self):
+        self.assertFalse(hasattr(self.data, "_grouped"))
+
+    def test_get_times_no_mice(self):
+        self.assertEqual(len(self.data.get_times("mouse_100")), 0)
+
+    def test_get_times_more_mice(self):
+        mice = self.mice[:2]
+        expected = self.raw["Time"][np.isin(self.raw["Tag"], mice)].tolist()
+        self.assertEqual(self.data.get_times(mice).tolist(), expected)
+
+    def test_get_times_masked(self):
+        mouse = self.mice[0]
+        t_start, t_end = self.raw["Time"][10], self.raw["Time"][50]
+        self.data.mask_data((t_start, t_end))
+        out = self.data.get_times(mouse)
+        self.data.unmask_data()
+        raw = self.raw[10:50]
+        self.assertEqual(out.tolist(),
+                         raw["Time"][raw["Tag"] == mouse].tolist())
+
+    def test_get_durations_masked_more_mice(self):
+        t_start, t_end = self.raw["Time"][10], self.raw["Time"][50]
+        self.data.mask_data((t_start, t_end))
+        out = self.data.get_durations(self.mice)
+        self.data.unmask_data()
+        self.assertEqual(out.tolist(), self.raw["Duration"][10:50].tolist())
+
+    def test_mask_slice(self):
+        t_start, t_end = self.raw["Time"][10], self.raw["Time"][50]
+        self.data.mask_data((t_start, t_end))
+        out = self.data._mask_slice
+        self.data.unmask_data()
+        self.assertEqual(out, (10, 50))
+
+    def test_mask_end_time(self):
+        self.data.mask_data((self.raw["Time"][50],))
+        out = self.data._mask_slice
+        self.data.unmask_data()
+        self.assertEqual(out, (0, 50))
+
+    def test_mask_float(self):
+        self.data.mask_data(float(self.raw["Time"][50]))
+        out = self.data._mask_slice
+        self.data.unmask_data()
+        self.assertEqual(out, (0, 50))
+
+    def test_mask_empty(self):
+        self.data.mask_data((self.raw["Time"][-1] + 10,
+                             self.raw["Time"][-1] + 20))
+        out = self.data.get_times(self.mice)
+        self.data.unmask_data()
+        self.assertEqual(len(out), 0)
+
+    def test_mask_unsorted(self):
+        raw = self.raw.copy()
+        raw["Time"][20], raw["Time"][30] = raw["Time"][30], raw["Time"][20]
+        data = BaseFunctions.Data(raw, None)
+        data.mask_data((raw["Time"][10], raw["Time"][20]))
+        out = data._mask_slice
+        self.assertEqual(out, (10, 31))
+
+    def test_window(self):
+        mouse = self.mice[0]
+        view = self.data.window(self.raw["Time"][10], self.raw["Time"][50])
+        raw = self.raw[10:50]
+        self.assertEqual(view.get_times(mouse).tolist(),
+                         raw["Time"][raw["Tag"] == mouse].tolist())
+
+    def test_window_table_unmasked(self):
+        self.data.window(self.raw["Time"][10], self.raw["Time"][50])
+        self.assertIsNone(self.data.mask)
+
+    def test_window_end_time(self):
+        view = self.data.window(t_end=self.raw["Time"][50])
+        self.assertEqual(view._mask_slice, (0, 50))
+
+    def test_window_start_time(self):
+        view = self.data.window(t_start=self.raw["Time"][50])
+        self.assertEqual(view._mask_slice, (50, len(self.raw)))
+
+    def test_window_unmasked(self):
+        data = BaseFunctions.Data(self.raw, None)
+        data.mask_data((self.raw["Time"][10], self.raw["Time"][50]))
+        view = data.window()
+        self.assertEqual(len(view.get_times(self.mice)), len(self.raw))
+
+    def test_from_codes(self):
+        data = BaseFunctions.Data.from_codes(self.data.codes,
+                                             self.data.categories,
+                                             self.raw.dtype)
+        self.assertTrue(np.array_equal(data.data, self.raw))
+
+    def test_from_codes_mask(self):
+        t_start, t_end = self.raw["Time"][10], self.raw["Time"][50]
+        data = BaseFunctions.Data.from_codes(self.data.codes,
+                                             self.data.categories,
+                                             self.raw.dtype, (t_start, t_end))
+        self.assertTrue(np.array_equal(data.data, self.raw[10:50]))
+
+    def test_last_rows_before(self):
+        out = self.data.last_rows(self.mice, before=50)
+        for row in out:
+            rows = np.flatnonzero(self.raw["Tag"][:50] == row["Tag"])
+            self.assertEqual(row, self.raw[rows[-1]])
+
+    def test_last_rows_before_missing(self):
+        first = np.flatnonzero(self.raw["Tag"] == self.mice[0])[0]
+        out = self.data.last_rows(self.mice[0], before=first)
+        self.assertEqual(len(out), 0)
+
+    def test_to_memmap(self):
+        tmp_dir = tempfile.mkdtemp()
+        data = BaseFunctions.Data(self.raw, None)
+        data.to_memmap(tmp_dir, "registrations")
+        out = data.get_times(self.mice[0])
+        expected = self.data.get_times(self.mice[0])
+        is_memmap = isinstance(data.codes, np.memmap)
+        equal = np.array_equal(data.data, self.raw)
+        del data
+        shutil.rmtree(tmp_dir)
+        self.assertTrue(is_memmap)
+        self.assertTrue(equal)
+        self.assertEqual(out.tolist(), expected.tolist())
+
+    def test_save_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        data = BaseFunctions.Data(self.raw, None)
+        data.mask_data((self.raw["Time"][10], self.raw["Time"][50]))
+        description = data.save(tmp_dir, "registrations")
+        loaded = BaseFunctions.Data.load(tmp_dir, "registrations",
+                                         description)
+        out = loaded.get_times(self.mice).tolist()
+        expected = data.get_times(self.mice).tolist()
+        equal = np.array_equal(loaded.data, self.raw)
+        del loaded
+        shutil.rmtree(tmp_dir)
+        self.assertEqual(out, expected)
+        self.assertTrue(equal)
+
+    def test_save_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        data = BaseFunctions.Data(self.raw, None)
+        data.save(tmp_dir, "registrations")
+        fnames = sorted(os.listdir(tmp_dir))
+        shutil.rmtree(tmp_dir)
+        self.assertEqual(fnames, ["registrations_Antenna.npy",
+                                  "registrations_Tag.npy",
+                                  "registrations_codes.npy",
+                                  "registrations_grouped_rows.npy",
+                                  "registrations_offsets.npy"])
+
+    def test_append(self):
+        data = BaseFunctions.Data(self.raw[:20], None)
+        new = self.raw[20:].copy()
+        new["Tag"][-1] = "mouse_100"
+        data.append(new)
+        self.assertTrue(np.array_equal(data.data,
+                                       np.concatenate([self.raw[:20], new])))
+
+    def test_cut_out_data(self):
+        t_start, t_end = self.raw["Time"][10], self.raw["Time"][50]
+        data = BaseFunctions.Data(self.raw, (t_start, t_end))
+        self.assertTrue(np.array_equal(data.data, self.raw[10:50]))
+
+
+def make_visits(intervals):
+    """Visits table from a dict of (address, start, end) lists."""
+    visits = [(address, mouse, start, end, end - start, True)
+              for mouse in intervals
+              for address, start, end in intervals[mouse]]
+    visits = np.array(sorted(visits, key=lambda visit: visit[2]),
+                      dtype=uf.VISITS_DTYPE)
+    return BaseFunctions.Visits(visits, None)
+
+
+class TestIntervalIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.visits = make_visits({
+            "mouse_1": [("A", 1, 11), ("B", 11, 12), ("A", 12, 15),
+                        ("A", 18, 20), ("B", 20, 40), ("A", 40, 70)],
+            "mouse_2": [("A", 5, 14), ("B", 14, 50)],
+        })
+        cls.index = cls.visits.interval_index()
+
+    def test_cached(self):
+        self.assertIs(self.visits.interval_index(), self.index)
+
+    def test_intervals(self):
+        starts, ends = self.index.get_intervals("mouse_1", "A", 13, 45)
+        self.assertEqual(starts.tolist(), [13, 18, 40])
+        self.assertEqual(ends.tolist(), [15, 20, 45])
+
+    def test_starting_or_ending(self):
+        starts, ends = self.index.get_starting_or_ending("mouse_2", "B",
+                                                         20, 45)
+        self.assertEqual(len(starts), 0)
+
+    def test_starting_or_ending_clipped(self):
+        starts, ends = self.index.get_starting_or_ending("mouse_1", "A",
+                                                         13, 45)
+        self.assertEqual(starts.tolist(), [13, 18, 40])
+        self.assertEqual(ends.tolist(), [15, 20, 45])
+
+    def test_starting_or_ending_margin(self):
+        starts, ends = self.index.get_starting_or_ending("mouse_1", "A",
+                                                         10, 45, 5)
+        self.assertEqual(starts.tolist(), [12, 18, 40])
+
+    def test_intervals_missing(self):
+        starts, ends = self.index.get_intervals("mouse_2", "C", 0, 100)
+        self.assertEqual(len(starts), 0)
+
+    def test_time_in_cage(self):
+        self.assertEqual(self.index.time_in_cage("mouse_1", "A", 5, 19),
+                         6 + 3 + 1)
+
+    def test_time_in_cage_array(self):
+        out = self.index.time_in_cage("mouse_1", "A", np.array([0, 10]),
+                                      np.array([10, 20]))
+        self.assertEqual(out.tolist(), [9, 1 + 3 + 2])
+
+    def test_time_in_cage_missing(self):
+        self.assertEqual(self.index.time_in_cage("mouse_2", "C", 0, 100), 0)
+
+    def test_count_starts(self):
+        out = self.index.count_starts("mouse_1", "A", [0, 12, 100])
+        self.assertEqual(out.tolist(), [0, 1, 4])
+
+    def test_overlap(self):
+        self.assertEqual(self.index.overlap("mouse_1", "mouse_2", "A"),
+                         6 + 2)
+
+    def test_overlap_symmetric(self):
+        self.assertEqual(self.index.overlap("mouse_2", "mouse_1", "B",
+                                            0, 45),
+                         self.index.overlap("mouse_1", "mouse_2", "B",
+                                            0, 45))
+
+    def test_rebuilt(self):
+        visits = make_visits({"mouse_1": [("A", 1, 11)]})
+        index = visits.interval_index()
+        visits.append(np.array([("A", "mouse_1", 20., 30., 10., True)],
+                               dtype=uf.VISITS_DTYPE))
+        self.assertIsNot(visits.interval_index(), index)
+
+
+class TestCageOccupancy(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.visits = make_visits({
+            "mouse_1": [("A", 1, 11), ("B", 11, 12), ("A", 12, 15),
+                        ("A", 18, 20), ("B", 20, 40), ("A", 40, 70)],
+            "mouse_2": [("A", 5, 14), ("B", 14, 50)],
+            "mouse_3": [("A", 10, 30)],
+        })
+        cls.occupancy = cls.visits.cage_occupancy()
+
+    def test_cached(self):
+        self.assertIs(self.visits.cage_occupancy(), self.occupancy)
+
+    def test_occupancy(self):
+        out = self.occupancy.occupancy("A", [0, 2, 6, 10.5, 11.5, 100])
+        self.assertEqual(out.tolist(), [0, 1, 2, 3, 2, 0])
+
+    def test_occupancy_touching(self):
+        self.assertEqual(self.occupancy.occupancy("B", 20), 2)
+
+    def test_mice_present(self):
+        self.assertEqual(self.occupancy.mice_present("A", 13),
+                         ["mouse_1", "mouse_2", "mouse_3"])
+
+    def test_mice_present_empty(self):
+        self.assertEqual(self.occupancy.mice_present("A", 100), [])
+
+    def test_time_with_count(self):
+        out = self.occupancy.time_with_count("A", 0, 20)
+        self.assertEqual(out.tolist(), [1, 4 + 3, 3 + 2 + 2 + 2, 3])
+
+    def test_time_with_count_total(self):
+        self.assertEqual(self.occupancy.time_with_count("B", 0, 100).sum(),
+                         100)
+
+    def test_time_alone(self):
+        self.assertEqual(self.occupancy.time_alone("mouse_1", "A", 0, 100),
+                         4 + 30)
+
+    def test_time_alone_window(self):
+        self.assertEqual(self.occupancy.time_alone("mouse_2", "B", 0, 45),
+                         6 + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
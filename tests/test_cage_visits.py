@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 from __future__ import print_function, division, absolute_import
+import os
 import unittest
 from collections import OrderedDict
 
@@ -8,6 +9,8 @@ from pyEcoHAB import cage_visits as cv
 from pyEcoHAB import sample_data, data_path
 from pyEcoHAB import Loader
 from pyEcoHAB import Timeline
+from pyEcoHAB.utils import general as utils
+from test_base_functions import make_visits
 
 
 class TestGetVisits(unittest.TestCase):
@@ -295,6 +298,76 @@ class TestCalculateVisitsDurations(unittest.TestCase):
         self.assertEqual(all_vis, self.all_vB["mouse_2"])
 
 
+class TestCalculateVisitsDurationsIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.data = {
+            "mouse_1": [
+                ["A", 1, 11],
+                ["A", 12, 15],
+                ["A", 18, 20],
+                ["A", 40, 70],
+                ["A", 80, 90],
+                ["A", 110, 130]
+            ],
+            "mouse_2": [
+                ["A", 1, 11],
+                ["B", 12, 15],
+                ["A", 18, 20],
+                ["B", 40, 70],
+                ["A", 80, 90],
+                ["B", 110, 130]
+            ]
+        }
+        cls.index = make_visits(cls.data).interval_index()
+        cls.mice = ["mouse_1", "mouse_2"]
+
+    def test_address_A(self):
+        out = cv.calculate_visits_and_durations_index(self.index, self.mice,
+                                                      "A", 0, 100, 10,
+                                                      (1, 130))
+        expected = cv.calculate_visits_and_durations(self.data, self.mice,
+                                                     "A", 0, 100, 10)
+        self.assertEqual(out, expected)
+
+    def test_address_B_short_bin(self):
+        out = cv.calculate_visits_and_durations_index(self.index, self.mice,
+                                                      "B", 5, 95, 20,
+                                                      (1, 130))
+        expected = cv.calculate_visits_and_durations(self.data, self.mice,
+                                                     "B", 5, 95, 20)
+        self.assertEqual(out, expected)
+
+    def test_clipped_to_times(self):
+        out = cv.calculate_visits_and_durations_index(self.index, self.mice,
+                                                      "A", 0, 100, 10,
+                                                      (15, 85))
+        self.assertEqual(out[2]["mouse_1"][8], [5])
+
+
+class TestCalculateVisitsDurationsIndexData(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_3_mice")
+        cls.data = Loader(path)
+        config = Timeline(path)
+        cls.times = config.get_time_from_epoch("1 dark")
+        cls.prepared = utils.prepare_data(cls.data, cls.data.mice)
+        view = cls.data.window()
+        cls.data_times = (view.get_starttimes(cls.data.mice)[0],
+                          view.get_endtimes(cls.data.mice)[-1])
+
+    def test_same_as_prepared_data(self):
+        for address in self.data.cages:
+            out = cv.calculate_visits_and_durations_index(
+                self.data.interval_index, self.data.mice, address,
+                self.times[0], self.times[1], 3600, self.data_times)
+            expected = cv.calculate_visits_and_durations(
+                self.prepared, self.data.mice, address, self.times[0],
+                self.times[1], 3600)
+            self.assertEqual(out, expected)
+
+
 class TestGetActivity(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
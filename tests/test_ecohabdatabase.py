@@ -14,8 +14,7 @@ class TestSingleAntennaStats(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path, "20101010_110000.txt")
         setup_config = SetupConfig()
         cls.data = EcoHabDataBase(data, None, 2, setup_config)
         cls.config = Timeline(path)
@@ -38,6 +37,20 @@ class TestSingleAntennaStats(unittest.TestCase):
                                                   times[1], "8", 900)
         self.assertEqual(result, ([0, 0, 0, 1], [0, 0, 0, 1026/1000]))
 
+    def test_array(self):
+        times = self.config.get_time_from_epoch("ALL")
+        count, durations = self.data.get_registration_stats_array(
+            ["mouse_1"], ["1", "8"], times[0], times[1], 900)
+        self.assertEqual(count.tolist(), [[[2, 0, 0, 1], [0, 0, 0, 1]]])
+        self.assertEqual(durations[0, 1].tolist(), [0, 0, 0, 1026/1000])
+
+    def test_array_shape(self):
+        times = self.config.get_time_from_epoch("ALL")
+        count = self.data.get_registration_stats_array(
+            ["mouse_1", "mouse_2"], ["1", "2", "3"], times[0], times[1],
+            1800)[0]
+        self.assertEqual(count.shape, (2, 3, 2))
+
 
 if __name__ == '__main__':
     unittest.main()
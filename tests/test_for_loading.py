@@ -3,13 +3,21 @@
 #encoding: utf-8
 from __future__ import print_function, division, absolute_import
 import os
+import bz2
 import glob
+import gzip
+import lzma
+import shutil
+import tarfile
+import tempfile
 import unittest
+from collections import OrderedDict
 import numpy as np
 import pyEcoHAB.utils.for_loading as uf
-import pyEcoHAB.utils.general as ut
+from pyEcoHAB.utils import BaseFunctions
 from pyEcoHAB import data_path
 from pyEcoHAB.SetupConfig import SetupConfig
+from test_utility_functions import get_animal_position
 
 
 SAME_PIPE = {
@@ -158,70 +166,342 @@ class TestTimeToSec(unittest.TestCase):
         self.assertRaises(ValueError, uf.time_to_sec, tt=string)
 
 
-class TestReformatDateTime(unittest.TestCase):
-    def test_1(self):
-        date = "2018.07.27"
-        time = "16:00:36.926"
-        out = "20180727 16:00:36.926"
-        self.assertEqual(uf.reformat_date_time(date, time), out)
+def read_reference(dir_path, fname):
+    """
+    Reference implementation of reading in a data file: registrations
+    are parsed line by line. read_single_file_array is tested against it.
+    """
+    hour, date, datenext, setup = uf.parse_fname(fname)
+    registrations = []
+    with uf.open_data_file(dir_path, fname) as f:
+        for line in f:
+            elements = line.split()
+            if len(elements) == 5:
+                ident, clock, antenna, duration, tag = elements
+                if hour[:2] == "23" and clock[:2] == "00":
+                    day = datenext
+                else:
+                    day = date
+            else:
+                ident, day, clock, antenna, duration, tag = elements[:6]
+                day = day.replace(".", "")
+            time = uf.time_to_sec("%s %s" % (day, clock))
+            registrations.append((int(ident), time, antenna, int(duration),
+                                  tag))
+    return np.array(registrations, dtype=uf.REGISTRATION_DTYPE), setup
 
 
-class TestProcessProcessLineMore(unittest.TestCase):
+class TestReadInSingleFile(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_short")
+        cls.out, setup = uf.read_single_file_array(path,
+                                                   "20101010_110000.txt")
+
     def test_1(self):
-        line = ["6406",	"2018.07.27", "16:00:29.329",
-                "7", "797", "0065-0161980646"]
-        out = ["6406", "20180727 16:00:29.329",
-               "7", "797", "0065-0161980646"]
-        self.assertEqual(uf.process_line_more_elements(line),
-                         out)
+        self.assertEqual(101, len(self.out))
 
     def test_2(self):
-        line = ["6406",	"2018.07.27", "16:00:29.329",
-                "7", "0065-0161980646"]
-        out = ["6406", "20180727 16:00:29.329",
-               "7", "0065-0161980646"]
-        self.assertEqual(uf.process_line_more_elements(line),
-                         out)
+        self.assertEqual(self.out.dtype.names,
+                         ("Id", "Time", "Antenna", "Duration", "Tag"))
 
+    def test_all_mice(self):
+        self.assertEqual(set(self.out["Tag"]), set(["mouse_1"]))
 
-class TestProcessLine5(unittest.TestCase):
-    def test1(self):
-        line = ["6406",	"16:00:29.329",
-                "7", "0065-0161980646"]
-        date = "20180727"
-        out = ["6406", "20180727 16:00:29.329",
-               "7", "0065-0161980646"]
-        self.assertEqual(uf.process_line_5_elements(line, date), out)
+    def test_last_line(self):
+        last_line = (15894, uf.time_to_sec("20101010 11:59:56.218"), "4",
+                     307, "mouse_1")
+        self.assertEqual(last_line, self.out[-1].tolist())
 
 
-class TestReadInSingleFile(unittest.TestCase):
+class TestReadInSingleFileArray(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short")
-        cls.out, setup = uf.read_single_file(path, "20101010_110000.txt")
+        cls.out, cls.setup = uf.read_single_file_array(path,
+                                                       "20101010_110000.txt")
+        cls.expected, setup = read_reference(path, "20101010_110000.txt")
+        path = os.path.join(data_path, "weird_short_com_no")
+        cls.out_com, cls.setup_com = uf.read_single_file_array(path,
+                                                               "COM1_20101010_110000.txt")
+        cls.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(cls.tmp_dir, "20101010_230000.txt"),
+                  "w") as f:
+            f.write("1\t23:59:58.100\t1\t200\tmouse_1\n")
+            f.write("2\t00:00:01.250\t2\t300\tmouse_1\n")
+            f.write("3\t2010.10.11\t00:00:02.500\t3\t400\tmouse_2\n")
 
-    def test_1(self):
-        self.assertEqual(101, len(self.out))
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
 
-    def test_2(self):
-        lines_len = set([len(line) for line in self.out])
-        self.assertEqual(lines_len, set([5]))
+    def check_reference(self, path, fname):
+        out, setup = uf.read_single_file_array(path, fname)
+        expected, expected_setup = read_reference(path, fname)
+        self.assertEqual(setup, expected_setup)
+        self.assertEqual(out.dtype, expected.dtype)
+        self.assertTrue(np.array_equal(out, expected))
 
-    def test_all_mice(self):
-        mice = set([line[-1] for line in self.out])
-        self.assertEqual(mice, set(["mouse_1"]))
+    def test_dtype(self):
+        self.assertEqual(self.out.dtype, self.expected.dtype)
 
-    def test_last_line(self):
-        last_line = ["15894", "20101010 11:59:56.218", "4",
-                     "307", "mouse_1"]
-        self.assertEqual(last_line, self.out[-1])
+    def test_same_as_reference(self):
+        self.assertTrue(np.array_equal(self.out, self.expected))
+
+    def test_same_as_reference_new_format(self):
+        path = os.path.join(data_path, "BALB_VPA_data_cohort_1")
+        self.check_reference(path, "20140616_120000.txt")
+
+    def test_same_as_reference_time_change(self):
+        path = os.path.join(data_path, "time_change")
+        self.check_reference(path, "20190331_100000.txt")
+
+    def test_same_as_reference_old_format_midnight(self):
+        self.check_reference(self.tmp_dir, "20101010_230000.txt")
+
+    def test_old_format_midnight(self):
+        out, setup = uf.read_single_file_array(self.tmp_dir,
+                                               "20101010_230000.txt")
+        self.assertEqual(out["Time"].tolist(),
+                         [uf.time_to_sec("20101010 23:59:58.100"),
+                          uf.time_to_sec("20101011 00:00:01.250"),
+                          uf.time_to_sec("20101011 00:00:02.500")])
+
+    def test_setup(self):
+        self.assertEqual(self.setup, "")
+
+    def test_setup_com(self):
+        self.assertEqual(self.setup_com, "COM1")
+
+
+class TestCompressedFiles(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_short_3_mice")
+        cls.fname = "20101010_110000.txt"
+        cls.reference, setup = uf.read_single_file_array(path, cls.fname)
+        cls.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(path, cls.fname), "rb") as f:
+            content = f.read()
+        for extension, opener in [(".gz", gzip.open), (".xz", lzma.open),
+                                  (".bz2", bz2.open)]:
+            with opener(os.path.join(cls.tmp_dir, cls.fname + extension),
+                        "wb") as f:
+                f.write(content)
+        with tarfile.open(os.path.join(cls.tmp_dir, "day.tar.gz"),
+                          "w:gz") as tar:
+            tar.add(os.path.join(path, cls.fname), arcname=cls.fname)
+            tar.add(os.path.join(cls.tmp_dir, cls.fname + ".xz"),
+                    arcname="COM1_20101010_120000.txt.xz")
+        with open(os.path.join(cls.tmp_dir, "notes.txt"), "w") as f:
+            f.write("not a data file")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_get_filenames(self):
+        self.assertEqual(sorted(uf.get_filenames(self.tmp_dir)),
+                         ["20101010_110000.txt.bz2",
+                          "20101010_110000.txt.gz",
+                          "20101010_110000.txt.xz",
+                          "day.tar.gz/20101010_110000.txt",
+                          "day.tar.gz/COM1_20101010_120000.txt.xz"])
+
+    def test_parse_fname(self):
+        out = uf.parse_fname("day.tar.gz/COM1_20101010_120000.txt.xz")
+        self.assertEqual(out, ("120000", "20101010", "20101011", "COM1"))
+
+    def test_gz(self):
+        out, setup = uf.read_single_file_array(self.tmp_dir,
+                                               self.fname + ".gz")
+        self.assertTrue(np.array_equal(out, self.reference))
+
+    def test_xz(self):
+        out, setup = uf.read_single_file_array(self.tmp_dir,
+                                               self.fname + ".xz")
+        self.assertTrue(np.array_equal(out, self.reference))
+
+    def test_bz2(self):
+        out, setup = uf.read_single_file_array(self.tmp_dir,
+                                               self.fname + ".bz2")
+        self.assertTrue(np.array_equal(out, self.reference))
+
+    def test_archive_member(self):
+        out, setup = uf.read_single_file_array(self.tmp_dir,
+                                               "day.tar.gz/" + self.fname)
+        self.assertTrue(np.array_equal(out, self.reference))
+
+    def test_compressed_archive_member(self):
+        fname = "day.tar.gz/COM1_20101010_120000.txt.xz"
+        out, setup = uf.read_single_file_array(self.tmp_dir, fname)
+        self.assertEqual(setup, "COM1")
+
+    def test_read_files(self):
+        fnames = sorted(uf.get_filenames(self.tmp_dir))
+        out = uf.read_files(self.tmp_dir, fnames, workers=2)
+        for data, setup in out:
+            self.assertTrue(np.array_equal(data, self.reference))
+
+    def test_group_fnames(self):
+        fnames = ["a.tar/1_0000.txt", "a.tar/2_0000.txt", "1_0000.txt.gz",
+                  "b.tar/1_0000.txt", "a.tar/3_0000.txt"]
+        self.assertEqual(uf.group_fnames(fnames),
+                         [fnames[:2], fnames[2:3], fnames[3:4], fnames[4:]])
+
+    def test_missing_member(self):
+        self.assertRaises(IOError, uf.read_archive_files, self.tmp_dir,
+                          ["day.tar.gz/20101010_130000.txt"])
+
+    def test_archive_members_cached(self):
+        path = os.path.join(self.tmp_dir, "day.tar.gz")
+        members = uf.archive_members(self.tmp_dir, "day.tar.gz")
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        self.assertEqual(uf._archive_members[key], members)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(uf.archive_members(self.tmp_dir, "day.tar.gz"),
+                         members)
+        self.assertIn((key[0], key[1], stat.st_mtime_ns + 10**9),
+                      uf._archive_members)
+
+
+class TestReadFiles(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "BALB_VPA_data_cohort_1")
+        cls.fnames = uf.get_filenames(path)[:6]
+        cls.serial = uf.read_files(path, cls.fnames)
+        cls.parallel = uf.read_files(path, cls.fnames, workers=2)
+
+    def test_len(self):
+        self.assertEqual(len(self.parallel), len(self.fnames))
+
+    def test_same_registrations(self):
+        for i, (data, setup) in enumerate(self.parallel):
+            self.assertTrue(np.array_equal(data, self.serial[i][0]))
+
+    def test_same_setups(self):
+        self.assertEqual([out[1] for out in self.parallel],
+                         [out[1] for out in self.serial])
+
+
+class TestRegistrationsFromRows(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = [["1", "23:59:59.5", "1", "100", "mouse_1"],
+                    ["2", "00:00:01.123", "2", "100", "mouse_1"],
+                    ["3", "2010.10.11", "00:00:02", "3", "10", "mouse_2",
+                     "extra"],
+                    ["4", "2010.10.11", "0:00:03.1", "3", "10", "mouse_2"]]
+        cls.out = uf.registrations_from_rows([row[:] for row in cls.rows],
+                                             "230000", "20101010",
+                                             "20101011")
+
+    def test_old_format_same_day(self):
+        self.assertEqual(self.out["Time"][0],
+                         uf.time_to_sec("20101010 23:59:59.5"))
+
+    def test_old_format_next_day(self):
+        self.assertEqual(self.out["Time"][1],
+                         uf.time_to_sec("20101011 00:00:01.123"))
+
+    def test_new_format(self):
+        self.assertEqual(self.out["Time"][2],
+                         uf.time_to_sec("20101011 00:00:02"))
+
+    def test_irregular_time(self):
+        self.assertEqual(self.out["Time"][3],
+                         uf.time_to_sec("20101011 0:00:03.1"))
+
+    def test_columns(self):
+        self.assertEqual(self.out[2].tolist(),
+                         (3, uf.time_to_sec("20101011 00:00:02"), "3", 10,
+                          "mouse_2"))
+
+    def test_wrong_format(self):
+        self.assertRaises(IOError, uf.registrations_from_rows,
+                          [["1", "2", "3"]], "110000", "20101010",
+                          "20101011")
+
+    def test_legal_tags(self):
+        out = uf.registrations_from_rows([row[:] for row in self.rows],
+                                         "230000", "20101010", "20101011",
+                                         legal_tags=["mouse_2"])
+        self.assertEqual(out["Id"].tolist(), [3, 4])
+
+    def test_remove_antennas(self):
+        out = uf.registrations_from_rows([row[:] for row in self.rows],
+                                         "230000", "20101010", "20101011",
+                                         remove_antennas=["1", "3"])
+        self.assertEqual(out[0].tolist(),
+                         (2, uf.time_to_sec("20101011 00:00:01.123"), "2",
+                          100, "mouse_1"))
+
+    def test_all_removed(self):
+        out = uf.registrations_from_rows([row[:] for row in self.rows],
+                                         "230000", "20101010", "20101011",
+                                         legal_tags=["mouse_3"])
+        self.assertEqual(len(out), 0)
+
+
+class TestFilterFnames(unittest.TestCase):
+    fnames = ["20101010_110000.txt", "20101010_120000.txt",
+              "20101010_130000.txt", "20101010_150000.txt"]
+
+    def test_file_start_time(self):
+        self.assertEqual(uf.file_start_time("20101010_110000.txt"),
+                         uf.time_to_sec("20101010 11:00:00"))
+
+    def test_file_start_time_setup(self):
+        self.assertEqual(uf.file_start_time("COM1_20101010_110000.txt"),
+                         uf.time_to_sec("20101010 11:00:00"))
+
+    def test_mask(self):
+        mask = (uf.time_to_sec("20101010 14:30:00"),
+                uf.time_to_sec("20101010 16:00:00"))
+        self.assertEqual(uf.filter_fnames(self.fnames, mask),
+                         ["20101010_130000.txt", "20101010_150000.txt"])
+
+    def test_mask_end(self):
+        mask = (uf.time_to_sec("20101010 11:30:00"),)
+        self.assertEqual(uf.filter_fnames(self.fnames, mask),
+                         ["20101010_110000.txt", "20101010_120000.txt"])
+
+    def test_no_margin(self):
+        mask = (uf.time_to_sec("20101010 12:00:00"),
+                uf.time_to_sec("20101010 13:00:00"))
+        self.assertEqual(uf.filter_fnames(self.fnames, mask, margin=0),
+                         ["20101010_110000.txt", "20101010_120000.txt"])
+
+    def test_unknown_format(self):
+        mask = (uf.time_to_sec("20101010 12:00:00"),
+                uf.time_to_sec("20101010 13:00:00"))
+        self.assertEqual(uf.filter_fnames(["a_b_c_d_e.txt"], mask),
+                         ["a_b_c_d_e.txt"])
+
+
+class TestMaskRegistrations(unittest.TestCase):
+    def test_mask(self):
+        data = np.zeros(5, dtype=uf.REGISTRATION_DTYPE)
+        data["Time"] = [1, 2, 3, 4, 5]
+        out = uf.mask_registrations(data, (2, 4))
+        self.assertEqual(out["Time"].tolist(), [2, 3])
+
+    def test_mask_end(self):
+        data = np.zeros(5, dtype=uf.REGISTRATION_DTYPE)
+        data["Time"] = [1, 2, 3, 4, 5]
+        out = uf.mask_registrations(data, (4,))
+        self.assertEqual(out["Time"].tolist(), [1, 2, 3])
 
 
 class TestRemoveGhostTags(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        cls.data, setup = uf.read_single_file(path, "20101010_110000.txt")
+        cls.array, setup = uf.read_single_file_array(path,
+                                                     "20101010_110000.txt")
+        cls.data = [list(row) for row in cls.array.tolist()]
 
     def test_removing_tags_1(self):
         out = uf.remove_ghost_tags(self.data, "mouse_1")
@@ -244,13 +524,68 @@ class TestRemoveGhostTags(unittest.TestCase):
             tags.add(line[4])
         self.assertEqual(sorted(tags), ["mouse_1", "mouse_2", "mouse_3"])
 
+    def test_ghost_tags(self):
+        counts = {}
+        for line in self.data:
+            counts[line[4]] = counts.get(line[4], 0) + 1
+        threshold = sorted(counts.values())[1]
+        out = uf.remove_ghost_tags(self.data, ghost_tags=True,
+                                   how_many_appearances=threshold)
+        tags = set()
+        for line in out:
+            tags.add(line[4])
+        self.assertEqual(sorted(tags),
+                         sorted([tag for tag in counts
+                                 if counts[tag] >= threshold]))
+
+    def test_ghost_tags_array(self):
+        out = uf.remove_ghost_tags(self.array, ghost_tags=True,
+                                   how_many_appearances=20)
+        expected = uf.remove_ghost_tags(self.data, ghost_tags=True,
+                                        how_many_appearances=20)
+        self.assertEqual(out["Id"].tolist(),
+                         [int(line[0]) for line in expected])
+
+    def test_ghost_tags_days(self):
+        out = uf.remove_ghost_tags(self.data, ghost_tags=True,
+                                   how_many_appearances=20, how_many_days=1)
+        expected = uf.remove_ghost_tags(self.data, ghost_tags=True,
+                                        how_many_appearances=20)
+        self.assertEqual(out, expected)
+
+
+class TestFindLegalTags(unittest.TestCase):
+    day = 24*3600
+
+    def test_counts(self):
+        tags = ["a", "b", "a", "c", "a", "b"]
+        out = uf.find_legal_tags(tags, range(6), 2)
+        self.assertEqual(out.tolist(), ["a", "b"])
+
+    def test_days(self):
+        # "b" is registered 3 times, but never twice in one day
+        tags = ["a", "b", "a", "b", "b"]
+        times = [0, 1, 2, self.day + 1, 2*self.day + 1]
+        out = uf.find_legal_tags(tags, times, 2, how_many_days=1)
+        self.assertEqual(out.tolist(), ["a"])
+
+    def test_days_whole_dataset(self):
+        tags = ["a", "b", "a", "b", "b"]
+        times = [0, 1, 2, self.day + 1, 2*self.day + 1]
+        out = uf.find_legal_tags(tags, times, 2)
+        self.assertEqual(out.tolist(), ["a", "b"])
+
+    def test_empty(self):
+        out = uf.find_legal_tags([], [], 2, how_many_days=1)
+        self.assertEqual(len(out), 0)
+
 
 class TestRemoveAntenna(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data = uf.from_raw_data(raw_data)
+        cls.data, setup = uf.read_single_file_array(path,
+                                                    "20101010_110000.txt")
 
     def test_no_antenna(self):
         data = uf.remove_one_antenna(self.data, None)
@@ -283,8 +618,8 @@ class TestRemoveAntennas(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data = uf.from_raw_data(raw_data)
+        cls.data, setup = uf.read_single_file_array(path,
+                                                    "20101010_110000.txt")
 
     def test_single_antenna_1(self):
         data = uf.remove_antennas(self.data, "1")
@@ -308,44 +643,39 @@ class TestRemoveAntennas(unittest.TestCase):
                          set(["mouse_1", "mouse_2"]))
 
 
-class TestTransformRaw(unittest.TestCase):
-    def test_date_1(self):
-        row = [1, "gugu", 2, 222, "AAA"]
-        self.assertRaises(ValueError, uf.transform_raw, row)
-
-    def test_correct(self):
-        row = [1, "20101010 11:00:49.020", 5, '102', 'mouse_3']
-        time = uf.time_to_sec(row[1])
-        out = uf.transform_raw(row)
-        out2 = (1, time,  5, 102, "mouse_3")
-        self.assertEqual(out, out2)
-
-
-class TestTransformAllData(unittest.TestCase):
+class TestAntennaTransitions(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        path = os.path.join(data_path, "weird_short_3_mice")
-        cls.raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data = uf.from_raw_data(cls.raw_data)
-
-    def test_len(self):
-        self.assertEqual(len(self.raw_data), self.data.shape[0])
-
-    def test_width(self):
-        width = set([len(data) for data in self.raw_data])
-        self.assertEqual(width, set([len(self.data.dtype)]))
-
-    def test_first_line(self):
-        line = uf.transform_raw(self.raw_data[0])
-        self.assertEqual(line, self.data[0].tolist())
+        data = np.array([("mouse_1", "1", 10., 500),
+                         ("mouse_2", "1", 10.5, 200),
+                         ("mouse_1", "2", 10.2, 100),
+                         ("mouse_2", "3", 11., 100),
+                         ("mouse_1", "1", 12., 100),
+                         ("mouse_1", "2", 12.05, 100)],
+                        dtype=[("Tag", "U10"), ("Antenna", "U4"),
+                               ("Time", float), ("Duration", float)])
+        cls.antennas, cls.count, cls.fast = uf.antenna_transitions(data)
+
+    def test_antennas(self):
+        self.assertEqual(self.antennas.tolist(), ["1", "2", "3"])
+
+    def test_count(self):
+        self.assertEqual(self.count.tolist(), [[0, 2, 1],
+                                               [1, 0, 0],
+                                               [0, 0, 0]])
+
+    def test_fast(self):
+        self.assertEqual(self.fast.tolist(), [[0, 2, 0],
+                                              [0, 0, 0],
+                                              [0, 0, 0]])
 
 
 class TestAntennaMismatch(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
         config = SetupConfig()
         cls.mismatch1 = uf.antenna_mismatch(data, config)
 
@@ -370,10 +700,11 @@ class TestSkippedAntennas(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
         config = SetupConfig()
         cls.mismatch1 = uf.skipped_registrations(data, config)
+        cls.by_distance = uf.skipped_by_distance(data, config)
 
     def test_1(self):
         self.assertEqual(2, self.mismatch1["skipped two"])
@@ -388,13 +719,19 @@ class TestSkippedAntennas(unittest.TestCase):
     def test_empty(self):
         self.assertRaises(Exception, uf.skipped_registrations, [])
 
+    def test_by_distance(self):
+        self.assertEqual(self.by_distance, OrderedDict([(1, 2), (2, 2), (3, 0)]))
+
+    def test_by_distance_empty(self):
+        self.assertRaises(Exception, uf.skipped_by_distance, [])
+
 
 class TestCheckAntennaPresence(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
         cls.config = SetupConfig()
         cls.presences = uf.check_antenna_presence(data, cls.config, 24*3600)
         cls.end = data["Time"][-1]
@@ -436,12 +773,12 @@ class TestTotalMismatches(unittest.TestCase):
         config = SetupConfig()
         cls.mismatched_pairs = config.mismatched_pairs
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data1, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data1 = uf.from_raw_data(raw_data1)
+        cls.data1, setup = uf.read_single_file_array(path,
+                                                     "20101010_110000.txt")
         cls.mismatch1 = uf.antenna_mismatch(cls.data1, config)
         path = os.path.join(data_path, "weird_short")
-        raw_data2, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data2 = uf.from_raw_data(raw_data2)
+        cls.data2, setup = uf.read_single_file_array(path,
+                                                     "20101010_110000.txt")
         cls.mismatch2 = uf.antenna_mismatch(cls.data2, config)
 
     def test_no_mismatches(self):
@@ -477,8 +814,8 @@ class TestRunDiagnostics(unittest.TestCase):
     def setUpClass(cls):
         config = SetupConfig()
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
         cls.mismatch1 = uf.antenna_mismatch(data, config)
         cls.presences1 = uf.check_antenna_presence(data, config, 24*3600)
         res_path = os.path.join(path, "Results")
@@ -489,8 +826,8 @@ class TestRunDiagnostics(unittest.TestCase):
         out1 = uf.run_diagnostics(data, 24*3600, res_path, config)
         cls.str11, cls.str12, cls.str13, cls.str14, cls.str15 = out1
         path = os.path.join(data_path, "weird_short")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
         cls.mismatch2 = uf.antenna_mismatch(data, config)
         cls.presences2 = uf.check_antenna_presence(data, config, 24*3600)
         res_path = os.path.join(path, "Results")
@@ -501,8 +838,8 @@ class TestRunDiagnostics(unittest.TestCase):
         out2 = uf.run_diagnostics(data, 24*3600, res_path, config)
         cls.str21, cls.str22, cls.str23, cls.str24, cls.str25 = out2
         path1 = os.path.join(data_path, "weird_very_short_3_mice")
-        raw_data1, setup = uf.read_single_file(path1, "20101010_110000.txt")
-        data1 = uf.from_raw_data(raw_data1)
+        data1, setup = uf.read_single_file_array(path1,
+                                                 "20101010_110000.txt")
         config1 = SetupConfig()
         res_path1 = os.path.join(path1, "Results")
         out = uf.run_diagnostics(data1, 24*3600, res_path1, config1)
@@ -605,22 +942,64 @@ class TestRunDiagnostics(unittest.TestCase):
         self.assertEqual(out, self.str14)
 
 
+class TestUpdateDiagnostics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        config = SetupConfig()
+        path = os.path.join(data_path, "weird_short_3_mice")
+        data, setup = uf.read_single_file_array(path, "20101010_110000.txt")
+        data = uf.remove_antennas(data, ["8"])
+        cls.full = uf.diagnostics_counts(data, config, 60)
+        half = len(data)//2
+        cls.counts = uf.diagnostics_counts(data[:half], config, 60)
+        tags, idx = np.unique(data["Tag"][:half][::-1], return_index=True)
+        last = data[:half][::-1][idx]
+        last.sort(order="Time")
+        uf.update_diagnostics(cls.counts, last, data[half:], config, 60)
+
+    def test_mismatches(self):
+        self.assertEqual(self.counts["mismatches"], self.full["mismatches"])
+
+    def test_skipped(self):
+        self.assertEqual(self.counts["skipped"], self.full["skipped"])
+
+    def test_skipped_by_distance(self):
+        self.assertEqual(self.counts["skipped_by_distance"],
+                         self.full["skipped_by_distance"])
+
+    def test_tunnels(self):
+        self.assertEqual(self.counts["tunnel_count"],
+                         self.full["tunnel_count"])
+        self.assertEqual(self.counts["tunnel_total_count"],
+                         self.full["tunnel_total_count"])
+
+    def test_counters(self):
+        self.assertEqual(self.counts["counters"], self.full["counters"])
+
+    def test_registrations(self):
+        self.assertEqual(self.counts["registrations"],
+                         self.full["registrations"])
+
+    def test_breaks(self):
+        self.assertEqual(self.counts["breaks"], self.full["breaks"])
+
+
 class TestTransformVisits(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        data = uf.from_raw_data(raw_data)
-        cls.data = ut.get_animal_position(data["Time"],
-                                          data["Antenna"],
-                                          "mouse_1", 2,
-                                          same_pipe=SAME_PIPE,
-                                          same_address=SAME_ADDRESS,
-                                          opposite_pipe=OPPOSITE_PIPE,
-                                          address=ADDRESS,
-                                          surrounding=SURROUNDING,
-                                          address_not_adjacent=NON_ADJACENT,
-                                          internal_antennas=[])
+        data, setup = uf.read_single_file_array(path,
+                                                "20101010_110000.txt")
+        cls.data = get_animal_position(data["Time"],
+                                       data["Antenna"],
+                                       "mouse_1", 2,
+                                       same_pipe=SAME_PIPE,
+                                       same_address=SAME_ADDRESS,
+                                       opposite_pipe=OPPOSITE_PIPE,
+                                       address=ADDRESS,
+                                       surrounding=SURROUNDING,
+                                       address_not_adjacent=NON_ADJACENT,
+                                       internal_antennas=[])
         cls.visits = uf.transform_visits(cls.data)
 
     def test1(self):
@@ -634,61 +1013,62 @@ class TestTransformVisits(unittest.TestCase):
         self.assertEqual(set(self.visits["Tag"]), out)
 
 
-class TestRenameAntennas(unittest.TestCase):
+class TestMergeSorted(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        path = os.path.join(data_path, "weird_short")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.old_data = uf.from_raw_data(raw_data)
-        cls.data = uf.rename_antennas("setup1", cls.old_data)
-
-    def test_1(self):
-        out = []
-        for i, row in enumerate(self.data["Antenna"]):
-            out.append(row == self.old_data["Antenna"][i]+"_setup1")
-        self.assertEqual(set(out), set([True]))
-
-    def test_2(self):
-        self.assertEqual(self.data.dtype, self.old_data.dtype)
-
-    def test_3(self):
-        self.assertTrue(np.all(self.data["Id"] == self.old_data["Id"]))
+        dtype = [("Time", float), ("Id", int)]
+        cls.data1 = np.array([(1., 0), (2., 1), (2., 2), (5., 3)],
+                             dtype=dtype)
+        cls.data2 = np.array([(0., 4), (2., 5), (6., 6)], dtype=dtype)
+        cls.data3 = np.array([(2., 7), (3., 8)], dtype=dtype)
+        cls.out = uf.merge_sorted([cls.data1, cls.data2, cls.data3])
 
-    def test_4(self):
-        self.assertTrue(np.all(self.data["Time"] == self.old_data["Time"]))
+    def test_times(self):
+        self.assertEqual(self.out["Time"].tolist(),
+                         [0., 1., 2., 2., 2., 2., 3., 5., 6.])
 
-    def test_5(self):
-        self.assertTrue(np.all(self.data["Duration"] ==
-                               self.old_data["Duration"]))
+    def test_ties(self):
+        self.assertEqual(self.out["Id"].tolist(),
+                         [4, 0, 1, 2, 5, 7, 8, 3, 6])
 
-    def test_6(self):
-        self.assertTrue(np.all(self.data["Tag"] == self.old_data["Tag"]))
+    def test_sort_ties(self):
+        data = np.array([(2., 3), (2., 1), (3., 0)],
+                        dtype=[("Time", float), ("Id", int)])
+        self.assertEqual(uf.sort_ties(data)["Id"].tolist(), [1, 3, 0])
 
 
-class TestAppendData(unittest.TestCase):
+class TestMergeRegistrations(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         path = os.path.join(data_path, "weird_short_3_mice")
-        raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data1 = uf.from_raw_data(raw_data)
-        cls.data2 = uf.from_raw_data(raw_data)
-        cls.data2["Time"] += 15*60
-        cls.combined_data = uf.append_data_sources([cls.data1, cls.data2])
-
-    def test1(self):
-        self.assertEqual(len(self.data1) + len(self.data2),
-                         len(self.combined_data))
-
-    def test2(self):
-        self.assertTrue(np.all((self.combined_data["Time"][1:] -
-                                self.combined_data["Time"][:-1]) > 0))
-
-    def test_mouse3(self):
-        indx = np.where(self.combined_data["Tag"] == "mouse_3")[0]
-        line1 = self.combined_data[indx[0]].copy()
-        line2 = self.combined_data[indx[1]].copy()
-        line1["Time"] += 15*60
-        self.assertTrue(np.all(line1 == line2))
+        data1, setup = uf.read_single_file_array(path, "20101010_110000.txt")
+        data2 = data1.copy()
+        data2["Time"] += 15*60
+        data2["Tag"][data2["Tag"] == "mouse_3"] = "mouse_4"
+        renamed = []
+        for data, name in [(data1, "setup1"), (data2, "setup2")]:
+            data = data.copy()
+            data["Antenna"] = np.char.add(data["Antenna"], "_%s" % name)
+            renamed.append(data)
+        cls.expected = np.concatenate(renamed)
+        cls.expected.sort(order="Time")
+        registrations = [BaseFunctions.Data(data1, None),
+                         BaseFunctions.Data(data2, None)]
+        cls.codes, cls.categories = uf.merge_registrations(
+            registrations, ["setup1", "setup2"])
+        cls.merged = BaseFunctions.Data.from_codes(cls.codes, cls.categories,
+                                                   data1.dtype)
+
+    def test_data(self):
+        self.assertTrue(np.array_equal(self.merged.data, self.expected))
+
+    def test_antennas(self):
+        self.assertEqual(self.categories["Antenna"].tolist(),
+                         sorted(set(self.expected["Antenna"])))
+
+    def test_tags(self):
+        self.assertEqual(self.categories["Tag"].tolist(),
+                         ["mouse_1", "mouse_2", "mouse_3", "mouse_4"])
 
 
 class TestTunnelErrors(unittest.TestCase):
@@ -698,14 +1078,16 @@ class TestTunnelErrors(unittest.TestCase):
         times = [1,   2,  2.5,   3,  4.5, 5.5, 6.5, 7.5, 10.5]
         durations = [3, 600,  3,    34,  55,  66, 1999, 200, 100]
         cls.pred_out = {"1 2": 1, "3 4": 0, "5 6": 1, "7 8": 0}
-        keys = cls.pred_out.keys()
-        cls.out, cls.tot = uf.incorrect_tunnel_single_mouse(keys,
-                                                            antennas,
-                                                            times, durations)
+        single_mouse = np.array([(i, t, a, d, "mouse_1") for i, (t, a, d)
+                                 in enumerate(zip(times, antennas,
+                                                  durations))],
+                                dtype=uf.REGISTRATION_DTYPE)
+        cls.out, cls.tot = uf.incorrect_tunnel_registrations(single_mouse,
+                                                             SetupConfig())
         cls.pred_tot = {"1 2": 3, "3 4": 1, "5 6": 1, "7 8": 0}
         path = os.path.join(data_path, "weird_very_short_3_mice")
-        cls.raw_data, setup = uf.read_single_file(path, "20101010_110000.txt")
-        cls.data = uf.from_raw_data(cls.raw_data)
+        cls.data, setup = uf.read_single_file_array(path,
+                                                    "20101010_110000.txt")
         config = SetupConfig()
         cls.out_i, cls.out_tot_i = uf.incorrect_tunnel_registrations(cls.data,
                                                                      config)
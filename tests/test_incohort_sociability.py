@@ -1,6 +1,8 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 from __future__ import print_function, division, absolute_import
 import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 
@@ -9,6 +11,7 @@ from pyEcoHAB.utils import general as utils
 from pyEcoHAB import data_path, sample_data
 from pyEcoHAB import Loader
 from pyEcoHAB import Timeline
+from test_base_functions import make_visits
 
 
 try:
@@ -17,370 +20,107 @@ except NameError:
     basestring = str
 
 
-class TestPrepareMouseIntervals(unittest.TestCase):
+def time_alone(intervals, mouse, address, t_start, t_end):
+    """Time spent alone at address by mouse between t_start and t_end,
+    intervals is a dict of (address, start, end) lists."""
+    ints = {other: [(max(s, t_start), min(e, t_end))
+                    for a, s, e in intervals[other]
+                    if a == address and s < t_end and e > t_start]
+            for other in intervals}
+    points = sorted(set(p for other in ints for i in ints[other]
+                        for p in i))
+    total = 0
+    for t0, t1 in zip(points[:-1], points[1:]):
+        middle = (t0 + t1)/2
+        present = [other for other in ints
+                   if any(s <= middle < e for s, e in ints[other])]
+        if present == [mouse]:
+            total += t1 - t0
+    return total
+
+
+class TestTimeAlone(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        mouse1 = [["cage B", 2, 3],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse2 = [["cage B", 0, 3],
-                  ["cage C", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage A", 10, 12],
-                  ["cage B", 13, 18],
-                  ["cage A", 22, 50],
-                  ]
         data = {
-            'mouse1': mouse1,
-            'mouse2': mouse2,
-            }
-        cls.out1 = ics.prepare_mice_intervals(data, "cage B")
-        cls.out2 = ics.prepare_mice_intervals(data, "cage C")
-        cls.out3 = ics.prepare_mice_intervals(data, "cage D")
-        cls.out4 = ics.prepare_mice_intervals(data, "cage A")
-
-    def test_check_mouse1(self):
-        out = {
-            'mouse1': [
-                [2, 14],
-                [3, 20],
-            ],
-            'mouse2': [
-                [0, 13],
-                [3, 18]]
-        }
-        self.assertEqual(self.out1, out)
-
-    def test_check_mouse2(self):
-        out = {
-            'mouse1': [
-                [10, 21],
-                [12, 28],
-            ],
-            'mouse2': [
-                [5],
-                [6]
-            ]
-        }
-        self.assertEqual(self.out2, out)
-
-    def test_check_mouse3(self):
-        out = {
-            'mouse1': [
-                [8, 31],
-                [9, 35],
-            ],
-            'mouse2': [
-                [8],
-                [9]
-            ]
+            "mouse1": [["cage B", 2, 3], ["cage A", 5, 6], ["cage D", 8, 9],
+                       ["cage C", 10, 12], ["cage B", 14, 20],
+                       ["cage C", 21, 28], ["cage D", 31, 35],
+                       ["cage A", 40, 45]],
+            "mouse2": [["cage B", 0, 3], ["cage C", 5, 6], ["cage D", 8, 9],
+                       ["cage A", 10, 12], ["cage B", 13, 18],
+                       ["cage A", 22, 50]],
+            "mouse3": [["cage B", 2, 3.1], ["cage A", 5, 6],
+                       ["cage D", 7, 10], ["cage C", 11, 15],
+                       ["cage B", 16, 25], ["cage C", 27, 35],
+                       ["cage D", 38, 45], ["cage A", 50, 52]],
         }
-        self.assertEqual(self.out3, out)
-
-    def test_check_mouse4(self):
-        out = {
-            'mouse1': [
-                [5, 40],
-                [6, 45],
-            ],
-            'mouse2': [
-                [10, 22],
-                [12, 50]]
-        }
-        self.assertEqual(self.out4, out)
-
-
-class TestCheckInterval(unittest.TestCase):
-    def setUp(self):
-        mouse1 = [["cage B", 2, 3],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse2 = [["cage B", 0, 3],
-                  ["cage C", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage A", 10, 12],
-                  ["cage B", 13, 18],
-                  ["cage A", 22, 50],
-                  ]
-        mouse3 = [["cage B", 2, 3.1],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse4 = [["cage B", 2, 2.5],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-
-        data = {
-            'mouse1': mouse1,
-            'mouse2': mouse2,
-            'mouse3': mouse3,
-            'mouse4': mouse4,
-            }
-        self.out1 = ics.prepare_mice_intervals(data, "cage B")
-        self.out2 = ics.prepare_mice_intervals(data, "cage C")
-        self.out3 = ics.prepare_mice_intervals(data, "cage D")
-        self.out4 = ics.prepare_mice_intervals(data, "cage A")
-
-    def test_address_mouse1_mouse2_remove_True(self):
-        im1 = self.out1['mouse1'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertTrue(out)
-
-    def test_address_mouse1_mouse2_im1(self):
-        im1 = self.out1['mouse1'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[14], [20]])
-
-    def test_address_mouse1_mouse2_im2(self):
-        im2 = self.out1['mouse1'][:]
-        im1 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[0, 13], [2, 18]])
-
-    def test_address_mouse3_mouse2_remove_False(self):
-        im1 = self.out1['mouse3'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertFalse(out)
-
-    def test_address_mouse3_mouse2_im1(self):
-        im1 = self.out1['mouse3'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[3, 14], [3.1, 20]])
-
-    def test_address_mouse3_mouse2_im2(self):
-        im2 = self.out1['mouse3'][:]
-        im1 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[0, 13], [2, 18]])
-
-    def test_address_mouse4_mouse2_remove_False(self):
-        im1 = self.out1['mouse4'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertTrue(out)
-
-    def test_address_mouse4_mouse2_im1(self):
-        im1 = self.out1['mouse4'][:]
-        im2 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[14], [20]])
-
-    def test_address_mouse4_mouse2_im2(self):
-        im2 = self.out1['mouse4'][:]
-        im1 = self.out1['mouse2'][:]
-        out = ics.check_interval(im1, im2, 0, 0)
-        self.assertEqual(im1, [[0, 2.5, 13], [2, 3, 18]])
-
-
-class TestRemoveOverlappingIntervals(unittest.TestCase):
-    def setUp(self):
-        mouse1 = [["cage B", 2, 3],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse2 = [["cage B", 0, 3],
-                  ["cage C", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage A", 10, 12],
-                  ["cage B", 13, 18],
-                  ["cage A", 22, 50],
-                  ]
-        mouse3 = [["cage B", 2, 3.1],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse4 = [["cage B", 2, 2.5],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-
-        data = {
-            'mouse1': mouse1,
-            'mouse2': mouse2,
-            'mouse3': mouse3,
-            'mouse4': mouse4,
-            }
-        self.out1 = ics.prepare_mice_intervals(data, "cage B")
-        self.out2 = ics.prepare_mice_intervals(data, "cage C")
-        self.out3 = ics.prepare_mice_intervals(data, "cage D")
-        self.out4 = ics.prepare_mice_intervals(data, "cage A")
-
-    def test_mouse1_mouse2_im1(self):
-        im1 = self.out1["mouse1"][:]
-        im2 = self.out1["mouse2"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[18], [20]])
-
-    def test_mouse1_mouse2_im2(self):
-        im2 = self.out1["mouse1"][:]
-        im1 = self.out1["mouse2"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[0, 13], [2, 14]])
-
-    def test_mouse3_mouse1_im1(self):
-        im1 = self.out1["mouse3"][:]
-        im2 = self.out1["mouse1"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[3], [3.1]])
-
-    def test_mouse3_mouse1_im2(self):
-        im2 = self.out1["mouse3"][:]
-        im1 = self.out1["mouse1"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[], []])
-
-    def test_mouse2_mouse3_im1(self):
-        im1 = self.out1["mouse2"][:]
-        im2 = self.out1["mouse3"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[0, 13], [2, 14]])
-
-    def test_mouse2_mouse3_im2(self):
-        im2 = self.out1["mouse2"][:]
-        im1 = self.out1["mouse3"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[3, 18], [3.1, 20]])
-
-    def test_mouse2_mouse4_im1(self):
-        im1 = self.out1["mouse2"][:]
-        im2 = self.out1["mouse4"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[0, 2.5, 13], [2, 3, 14]])
-
-    def test_mouse2_mouse4_im2(self):
-        im2 = self.out1["mouse2"][:]
-        im1 = self.out1["mouse4"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[18], [20]])
-
-    def test_mouse1_mouse2_im1_cage_4(self):
-        im1 = self.out4["mouse1"][:]
-        im2 = self.out4["mouse2"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[5], [6]])
-
-    def test_mouse1_mouse2_im2_cage_4(self):
-        im2 = self.out4["mouse1"][:]
-        im1 = self.out4["mouse2"][:]
-        ics.remove_overlapping_intervals(im1, im2)
-        self.assertEqual(im1, [[10, 22, 45], [12, 40, 50]])
-
-
-class TestMouseAlone(unittest.TestCase):
+        occupancy = make_visits(data).cage_occupancy()
+        cls.mice = sorted(data)
+        cls.out = {}
+        cls.expected = {}
+        for address in ["cage A", "cage B", "cage C", "cage D"]:
+            cls.out[address] = {mouse: occupancy.time_alone(mouse, address,
+                                                            0, 60)
+                                for mouse in cls.mice}
+            cls.expected[address] = {mouse: time_alone(data, mouse,
+                                                       address, 0, 60)
+                                     for mouse in cls.mice}
+
+    def test_time_alone(self):
+        for address in self.out:
+            for mouse in self.mice:
+                self.assertTrue(np.isclose(self.out[address][mouse],
+                                           self.expected[address][mouse]))
+
+    def test_time_window(self):
+        self.assertTrue(np.isclose(self.out["cage B"]["mouse3"], 5.1))
+
+
+class TestGetSolitude(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
-        mouse1 = [["cage B", 2, 3],
-                  ["cage A", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage C", 10, 12],
-                  ["cage B", 14, 20],
-                  ["cage C", 21, 28],
-                  ["cage D", 31, 35],
-                  ["cage A", 40, 45],
-                  ]
-        mouse2 = [["cage B", 0, 3],
-                  ["cage C", 5, 6],
-                  ["cage D", 8, 9],
-                  ["cage A", 10, 12],
-                  ["cage B", 13, 18],
-                  ["cage A", 22, 50],
-                  ]
-        mouse3 = [["cage B", 2, 3.1],
-                  ["cage A", 5, 6],
-                  ["cage D", 7, 10],
-                  ["cage C", 11, 15],
-                  ["cage B", 16, 25],
-                  ["cage C", 27, 35],
-                  ["cage D", 38, 45],
-                  ["cage A", 50, 52],
-                  ]
-        data = {
-            'mouse1': mouse1,
-            'mouse2': mouse2,
-            'mouse3': mouse3,
-            }
-        cls.out1 = ics.mouse_alone(data, "cage B")
-        cls.out2 = ics.mouse_alone(data, "cage C")
-        cls.out3 = ics.mouse_alone(data, "cage D")
-        cls.out4 = ics.mouse_alone(data, "cage A")
-
-    def test_address_1_mouse1(self):
-        self.assertEqual(self.out1["mouse1"], 0)
-
-    def test_address_1_mouse2(self):
-        self.assertEqual(self.out1["mouse2"], 3)
-
-    def test_address_1_mouse3(self):
-        self.assertEqual(self.out1["mouse3"], 5.1)
-
-    def test_address_2_mouse1(self):
-        self.assertEqual(self.out2["mouse1"], 7)
-
-    def test_address_2_mouse2(self):
-        self.assertEqual(self.out2["mouse2"], 1)
-
-    def test_address_2_mouse3(self):
-        self.assertEqual(self.out2["mouse3"], 10)
+        cls.res_dir = tempfile.mkdtemp()
+        cls.out = {}
+        cls.expected = {}
+        for name in ["weird_3_mice", "weird_short"]:
+            path = os.path.join(data_path, name)
+            data = Loader(path)
+            timeline = Timeline(path)
+            cls.out[name] = ics.get_solitude(data, timeline,
+                                             res_dir=cls.res_dir)
+            intervals = {mouse: list(zip(data.get_visit_addresses(mouse),
+                                         data.get_starttimes(mouse),
+                                         data.get_endtimes(mouse)))
+                         for mouse in data.mice}
+            cls.expected[name] = {}
+            for phase in utils.filter_dark_light(timeline.sections()):
+                t_start, t_end = timeline.get_time_from_epoch(phase)
+                for address in data.cages:
+                    for mouse in data.mice:
+                        cls.expected[name][address, mouse, phase] = \
+                            time_alone(intervals, mouse, address, t_start,
+                                       t_end)
 
-    def test_address_3_mouse1(self):
-        self.assertEqual(self.out3["mouse1"], 4)
-
-    def test_address_3_mouse2(self):
-        self.assertEqual(self.out3["mouse2"], 0)
-
-    def test_address_3_mouse3(self):
-        self.assertEqual(self.out3["mouse3"], 9)
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.res_dir)
 
-    def test_address_4_mouse1(self):
-        self.assertEqual(self.out4["mouse1"], 0)
+    def test_time_alone(self):
+        for name in self.expected:
+            for (address, mouse, phase), value in self.expected[name].items():
+                self.assertTrue(np.isclose(
+                    self.out[name][address][mouse][phase], value))
 
-    def test_address_4_mouse2(self):
-        self.assertEqual(self.out4["mouse2"], 25)
+    def test_alone(self):
+        out = self.out["weird_3_mice"]
+        self.assertTrue(np.isclose(out["cage A"]["mouse_1"]["1 dark"],
+                                   100.694))
 
-    def test_address_4_mouse3(self):
-        self.assertEqual(self.out4["mouse3"], 2)
+    def test_overlapping_visits(self):
+        out = self.out["weird_3_mice"]
+        self.assertTrue(np.isclose(out["cage C"]["mouse_2"]["1 dark"],
+                                   559.664))
 
 
 class TestMiceOverlap(unittest.TestCase):
@@ -747,6 +487,43 @@ class TestSinglePhaseResults(unittest.TestCase):
                          self.out["mouse_2"]["mouse_2"])
 
 
+class TestPrepareWindowsDataIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_3_mice")
+        config = Timeline(path)
+        cls.data = Loader(path)
+        cls.mice = cls.data.mice
+        cls.binned = {}
+        cls.windows = {}
+        for bins in [3600, "dark"]:
+            _, _, cls.binned[bins], _ = utils.prepare_binned_data(cls.data,
+                                                                  config,
+                                                                  bins,
+                                                                  cls.mice)
+            _, _, cls.windows[bins], _ = utils.prepare_binned_windows(config,
+                                                                      bins)
+
+    def check_results(self, bins):
+        for phase in self.windows[bins]:
+            for label, windows in self.windows[bins][phase].items():
+                data = utils.prepare_windows_data_index(
+                    self.data.interval_index, self.mice, self.data.cages,
+                    windows)
+                out = ics.single_phase_results(data, self.mice,
+                                               self.data.cages, 3600)
+                expected = ics.single_phase_results(
+                    self.binned[bins][phase][label], self.mice,
+                    self.data.cages, 3600)
+                self.assertEqual(out, expected)
+
+    def test_3600(self):
+        self.check_results(3600)
+
+    def test_dark(self):
+        self.check_results("dark")
+
+
 class TestGetIncohortSociability(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
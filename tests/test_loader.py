@@ -1,5 +1,8 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import os
+import shutil
+import tarfile
+import tempfile
 import unittest
 from datetime import date
 import numpy as np
@@ -40,6 +43,42 @@ class TestLoader(unittest.TestCase):
         my_data_set = Loader(self.path_with_com)
         self.assertEqual(my_data_set.chip_name, "COM1")
 
+    def test_com_no_workers(self):
+        my_data_set = Loader(self.path_with_com, workers=2)
+        self.assertEqual(my_data_set.chip_name, "COM1")
+
+    def test_workers(self):
+        my_data_set = Loader(self.path1, workers=2)
+        self.assertTrue(np.array_equal(my_data_set.registrations.data,
+                                       self.dataset1_standard.registrations.data))
+
+    def test_workers_visits(self):
+        my_data_set = Loader(self.path1, workers=2)
+        self.assertTrue(np.array_equal(my_data_set.visits.data,
+                                       self.dataset1_standard.visits.data))
+
+    def test_ghost_tag_appearances(self):
+        registrations = self.dataset1_standard.registrations.data
+        tags, counts = np.unique(registrations["Tag"], return_counts=True)
+        threshold = int(np.max(counts))
+        my_data_set = Loader(self.path1, check_for_ghost_tags=True,
+                             ghost_tag_appearances=threshold)
+        self.assertEqual(my_data_set.mice,
+                         tags[counts >= threshold].tolist())
+
+    def test_mask(self):
+        registrations = self.dataset1_standard.registrations.data
+        t_start = registrations["Time"][10]
+        t_end = registrations["Time"][-10]
+        my_data_set = Loader(self.path1, mask=(t_start, t_end))
+        self.assertTrue(np.array_equal(my_data_set.registrations.data,
+                                       registrations[10:-10]))
+
+    def test_mask_skips_files(self):
+        t_start = self.dataset1_standard.session_end + 10*3600
+        self.assertRaises(Exception, Loader, self.path1,
+                          mask=(t_start, t_start + 3600))
+
     def test_visit_threshold(self):
         self.assertEqual(self.dataset1.visit_threshold, 1.5)
 
@@ -117,6 +156,539 @@ class TestLoader(unittest.TestCase):
         out2 = self.dataset3.get_visits("mouse_2")
         self.assertEqual(len(out)-1, len(out2))
 
+    def test_visits_unmasked(self):
+        self.dataset2.get_visits(t_start=1286708669.65,
+                                 t_end=1286708768.349)
+        self.assertIsNone(self.dataset2.visits.mask)
+
+    def test_visits_array(self):
+        t_start, t_end = 1286708669.65, 1286708768.349
+        out = self.dataset2.get_visits(t_start=t_start, t_end=t_end,
+                                       output="array")
+        expected = self.dataset2.get_visits(t_start=t_start, t_end=t_end)
+        self.assertEqual(out["t_start"].tolist(),
+                         [visit.t_start for visit in expected])
+
+    def test_visits_array_cage(self):
+        out = self.dataset2.get_visits(t_start=1286708669.65,
+                                       t_end=1286708768.349, cage="cage C",
+                                       output="array")
+        self.assertEqual(out["address"].tolist(), ["cage C", "cage C"])
+
+    def test_visits_array_no_mice(self):
+        out = self.dataset2.get_visits(mice="mouse 2", output="array")
+        self.assertEqual(len(out), 0)
+
+    def test_visits_records(self):
+        out = self.dataset1.get_visits("mouse_1", output="records")
+        expected = self.dataset1.get_visits("mouse_1")
+        self.assertEqual([dict((k, visit[k]) for k in visit)
+                          for visit in out], expected)
+
+    def test_visits_records_attributes(self):
+        out = self.dataset2.get_visits(cage="cage A", output="records")
+        self.assertEqual(out[0].address, "cage A")
+
+    def test_visits_wrong_output(self):
+        self.assertRaises(ValueError, self.dataset2.get_visits,
+                          output="list")
+
+    def test_window_times(self):
+        t_start, t_end = 1286708669.65, 1286708768.349
+        view = self.dataset2.window(t_start, t_end)
+        self.dataset2.mask_data(t_start, t_end)
+        expected = self.dataset2.get_times("mouse_1").tolist()
+        self.dataset2.unmask_data()
+        self.assertEqual(view.get_times("mouse_1").tolist(), expected)
+
+    def test_window_visits(self):
+        t_start, t_end = 1286708669.65, 1286708768.349
+        view = self.dataset2.window(t_start, t_end)
+        self.dataset2.mask_data(t_start, t_end)
+        expected = self.dataset2.get_visit_addresses("mouse_1").tolist()
+        self.dataset2.unmask_data()
+        self.assertEqual(view.get_visit_addresses("mouse_1").tolist(),
+                         expected)
+
+    def test_window_dataset_unmasked(self):
+        self.dataset2.window(1286708669.65, 1286708768.349)
+        self.assertIsNone(self.dataset2.registrations.mask)
+
+    def test_window_no_bounds(self):
+        view = self.dataset2.window()
+        self.assertEqual(view.get_starttimes("mouse_1").tolist(),
+                         self.dataset2.get_starttimes("mouse_1").tolist())
+
+
+class TestLoaderDiagnostics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = os.path.join(data_path, "weird_very_short")
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.eager = Loader(cls.path, add_date=False,
+                           res_dir=os.path.join(cls.tmp_dir, "eager"))
+        cls.lazy = Loader(cls.path, add_date=False, diagnostics="lazy",
+                          res_dir=os.path.join(cls.tmp_dir, "lazy"))
+        cls.lazy_saved = os.path.exists(os.path.join(cls.lazy.res_dir,
+                                                     "diagnostics"))
+        cls.off = Loader(cls.path, add_date=False, diagnostics="off",
+                         res_dir=os.path.join(cls.tmp_dir, "off"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_eager_saved(self):
+        path = os.path.join(self.eager.res_dir, "diagnostics")
+        self.assertTrue(os.path.isdir(path))
+
+    def test_lazy_not_saved(self):
+        self.assertFalse(self.lazy_saved)
+
+    def test_lazy(self):
+        self.assertEqual(self.lazy.save_diagnostics(),
+                         self.eager.save_diagnostics())
+
+    def test_off(self):
+        self.assertIsNone(self.off.get_diagnostics())
+
+    def test_off_not_saved(self):
+        self.off.save_diagnostics()
+        path = os.path.join(self.tmp_dir, "off", "diagnostics")
+        self.assertFalse(os.path.exists(path))
+
+    def test_wrong_value(self):
+        self.assertRaises(ValueError, Loader, self.path,
+                          diagnostics="sometimes")
+
+
+class TestLoaderCompressed(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "weird_very_short")
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, "data")
+        os.mkdir(cls.path)
+        with tarfile.open(os.path.join(cls.path, "day.tar.xz"),
+                          "w:xz") as tar:
+            for fname in uf.get_filenames(path):
+                tar.add(os.path.join(path, fname), arcname=fname)
+        res_dir = os.path.join(cls.tmp_dir, "results")
+        cls.reference = Loader(path, res_dir=res_dir)
+        cls.data = Loader(cls.path, res_dir=res_dir, workers=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_registrations(self):
+        self.assertTrue(np.array_equal(self.data.registrations.data,
+                                       self.reference.registrations.data))
+
+    def test_visits(self):
+        self.assertTrue(np.array_equal(self.data.visits.data,
+                                       self.reference.visits.data))
+
+
+class TestLoaderMemmap(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.memmap_dir = os.path.join(cls.tmp_dir, "memmap")
+        res_dir = os.path.join(cls.tmp_dir, "results")
+        cls.reference = Loader(sample_data, res_dir=res_dir)
+        cls.data = Loader(sample_data, res_dir=res_dir,
+                          memmap_after_load=cls.memmap_dir)
+        cls.config = Timeline(sample_data)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_files(self):
+        self.data.visits
+        self.assertEqual(sorted(os.listdir(self.memmap_dir)),
+                         ["registrations_codes.npy",
+                          "registrations_grouped_rows.npy",
+                          "visits_codes.npy",
+                          "visits_grouped_rows.npy"])
+
+    def test_query_memmap(self):
+        self.assertIsInstance(self.data.visits.codes, np.memmap)
+        mouse = self.data.mice[0]
+        self.assertEqual(self.data.get_starttimes(mouse).tolist(),
+                         self.reference.get_starttimes(mouse).tolist())
+
+    def test_registrations(self):
+        self.assertTrue(np.array_equal(self.data.registrations.data,
+                                       self.reference.registrations.data))
+
+    def test_visits(self):
+        self.assertTrue(np.array_equal(self.data.visits.data,
+                                       self.reference.visits.data))
+
+    def test_diagnostics_in_chunks(self):
+        self.data.DIAGNOSTICS_CHUNK = 5000
+        out = self.data._diagnostics_in_chunks()
+        del self.data.DIAGNOSTICS_CHUNK
+        self.assertEqual(out, self.reference.get_diagnostics())
+
+    def test_activity(self):
+        res_dir = os.path.join(self.tmp_dir, "results")
+        out_1 = get_activity(self.data, self.config, 3600, res_dir=res_dir)
+        out_2 = get_activity(self.reference, self.config, 3600,
+                             res_dir=res_dir)
+        self.assertEqual(out_1, out_2)
+
+
+class TestSaveLoad(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(data_path, "weird_very_short")
+        cls.data = Loader(path, visit_threshold=1.5, add_date=False,
+                          res_dir=os.path.join(cls.tmp_dir, "results"),
+                          mask=(1286708669.65, 1286708968.349))
+        cls.data.save(os.path.join(cls.tmp_dir, "saved"))
+        cls.loaded = Loader.load(os.path.join(cls.tmp_dir, "saved"))
+        path = os.path.join(data_path, "BALB_VPA_data_cohort_1_divided")
+        data1 = Loader(os.path.join(path, "setup_1"),
+                       res_dir=os.path.join(cls.tmp_dir, "results"))
+        data2 = Loader(os.path.join(path, "setup_2"),
+                       res_dir=os.path.join(cls.tmp_dir, "results"))
+        config = os.path.join(path, "experiment_setup.txt")
+        cls.merged = Merger(config, os.path.join(cls.tmp_dir, "merged"),
+                            data1, data2, diagnostics="off")
+        cls.merged.save(os.path.join(cls.tmp_dir, "saved_merged"))
+        cls.loaded_merged = Merger.load(os.path.join(cls.tmp_dir,
+                                                     "saved_merged"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_class(self):
+        self.assertIsInstance(self.loaded, Loader)
+
+    def test_registrations(self):
+        self.assertTrue(np.array_equal(self.loaded.registrations.data,
+                                       self.data.registrations.data))
+
+    def test_visits(self):
+        self.assertTrue(np.array_equal(self.loaded.visits.data,
+                                       self.data.visits.data))
+
+    def test_memmap(self):
+        self.assertIsInstance(self.loaded.visits.codes, np.memmap)
+
+    def test_attributes(self):
+        for name in ["threshold", "prefix", "res_dir", "mice",
+                     "session_start", "session_end", "setup_name",
+                     "directions", "_fnames"]:
+            self.assertEqual(getattr(self.loaded, name),
+                             getattr(self.data, name))
+
+    def test_mask(self):
+        self.assertEqual(self.loaded.mask, list(self.data.mask))
+
+    def test_diagnostics(self):
+        self.assertEqual(self.loaded.save_diagnostics(),
+                         self.data.save_diagnostics())
+
+    def test_merger(self):
+        self.assertTrue(np.array_equal(self.loaded_merged.visits.data,
+                                       self.merged.visits.data))
+
+    def test_merger_antennas(self):
+        self.assertEqual(self.loaded_merged.all_antennas,
+                         self.merged.all_antennas)
+
+    def test_load_merger_as_loader(self):
+        self.assertRaises(TypeError, Loader.load,
+                          os.path.join(self.tmp_dir, "saved_merged"))
+
+
+class TestLoaderCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "BALB_VPA_data_cohort_1_divided",
+                            "setup_1")
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, "data")
+        os.mkdir(cls.path)
+        for fname in uf.get_filenames(path):
+            shutil.copy(os.path.join(path, fname), cls.path)
+        cls.res_dir = os.path.join(cls.tmp_dir, "results")
+        cls.cache_dir = os.path.join(cls.tmp_dir, "cache")
+        cls.fnames = uf.get_filenames(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def check_equal(self, **kwargs):
+        reference = Loader(self.path, res_dir=self.res_dir, **kwargs)
+        cached = Loader(self.path, res_dir=self.res_dir,
+                        cache=self.cache_dir, **kwargs)
+        self.assertTrue(np.array_equal(reference.registrations.data,
+                                       cached.registrations.data))
+
+    def test_default_cache_dir(self):
+        Loader(self.path, res_dir=self.res_dir, cache=True)
+        cache_dir = os.path.join(self.path, uf.CACHE_DIR)
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir,
+                                                    "manifest.json")))
+        shutil.rmtree(cache_dir)
+
+    def test_mask_ghost_tags(self):
+        full = Loader(self.path, res_dir=self.res_dir)
+        tags, counts = np.unique(full.registrations.data["Tag"],
+                                 return_counts=True)
+        threshold = int(np.max(counts))
+        full = Loader(self.path, res_dir=self.res_dir,
+                      check_for_ghost_tags=True,
+                      ghost_tag_appearances=threshold)
+        t_start = uf.file_start_time(sorted(self.fnames)[5])
+        mask = (t_start, t_start + 3600)
+        masked = Loader(self.path, res_dir=self.res_dir,
+                        check_for_ghost_tags=True,
+                        ghost_tag_appearances=threshold, mask=mask)
+        expected = uf.mask_registrations(full.registrations.data, mask)
+        self.assertTrue(len(expected))
+        self.assertTrue(np.array_equal(masked.registrations.data,
+                                       expected))
+
+    def test_no_cache(self):
+        Loader(self.path, res_dir=self.res_dir)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_first_load(self):
+        self.check_equal()
+
+    def test_second_load(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        self.check_equal()
+
+    def test_remove_antennas(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        self.check_equal(remove_antennas=["1"])
+
+    def test_legal_tags(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        self.check_equal(legal_tags=["0065-0136659459",
+                                     "0065-0136673193"])
+
+    def test_ghost_tags(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        self.check_equal(check_for_ghost_tags=True)
+
+    def test_rebuild(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir,
+               remove_antennas=["1"])
+        data = Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir,
+                      remove_antennas=["1"], rebuild_cache=True)
+        reference = Loader(self.path, res_dir=self.res_dir,
+                           remove_antennas=["1"])
+        self.assertTrue(np.array_equal(reference.registrations.data,
+                                       data.registrations.data))
+
+    def test_modified_file(self):
+        Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        fname = os.path.join(self.path, self.fnames[2])
+        with open(fname) as f:
+            lines = f.readlines()
+        try:
+            with open(fname, "w") as f:
+                f.writelines(lines[:-10])
+            self.check_equal()
+        finally:
+            with open(fname, "w") as f:
+                f.writelines(lines)
+
+    def test_new_file(self):
+        fname = os.path.join(self.path, self.fnames[-1])
+        backup = os.path.join(self.tmp_dir, self.fnames[-1])
+        shutil.move(fname, backup)
+        try:
+            Loader(self.path, res_dir=self.res_dir, cache=self.cache_dir)
+        finally:
+            shutil.move(backup, fname)
+        self.check_equal()
+
+
+class TestLazyVisits(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(data_path, "weird_very_short")
+        res_dir = os.path.join(cls.tmp_dir, "results")
+        cls.data = Loader(cls.path, res_dir=res_dir)
+        cls.calculated = list(cls.data._visits_cache)
+        cls.reference = Loader(cls.path, res_dir=res_dir)
+        cls.reference_1 = Loader(cls.path, res_dir=res_dir,
+                                 visit_threshold=1.)
+        cls.t_start = cls.reference.session_start + 600
+        cls.t_end = cls.reference.session_end - 600
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_not_calculated(self):
+        self.assertEqual(self.calculated, [])
+
+    def test_visits(self):
+        self.assertTrue(np.array_equal(self.data.visits.data,
+                                       self.reference.visits.data))
+
+    def test_cached(self):
+        self.assertIs(self.data.visits, self.data.visits)
+
+    def test_visits_for_threshold(self):
+        out = self.data.visits_for_threshold(1.).data
+        self.assertTrue(np.array_equal(out, self.reference_1.visits.data))
+
+    def test_visits_for_thresholds(self):
+        out = self.data.visits_for_thresholds([1., 2.])
+        self.assertTrue(np.array_equal(out[0].data,
+                                       self.reference_1.visits.data))
+        self.assertTrue(np.array_equal(out[1].data,
+                                       self.reference.visits.data))
+
+    def test_visits_for_thresholds_cached(self):
+        out = self.data.visits_for_thresholds([3., 3.])
+        self.assertIs(out[0], self.data.visits_for_threshold(3.))
+        self.assertIs(out[1], out[0])
+
+    def test_with_visit_threshold(self):
+        view = self.data.with_visit_threshold(1.)
+        self.assertTrue(np.array_equal(view.visits.data,
+                                       self.reference_1.visits.data))
+
+    def test_with_visit_threshold_cached(self):
+        view = self.data.with_visit_threshold(.5)
+        view.visits
+        self.assertIn(.5, self.data._visits_cache)
+
+    def test_with_visit_threshold_dataset(self):
+        self.data.with_visit_threshold(1.)
+        self.assertEqual(self.data.threshold, 2.)
+
+    def test_with_visit_threshold_masked(self):
+        data = Loader(self.path, res_dir=os.path.join(self.tmp_dir, "m"))
+        data.mask_data(self.t_start, self.t_end)
+        view = data.with_visit_threshold(1.)
+        self.reference_1.mask_data(self.t_start, self.t_end)
+        expected = self.reference_1.get_starttimes(self.reference_1.mice)
+        self.reference_1.unmask_data()
+        self.assertEqual(view.get_starttimes(view.mice).tolist(),
+                         expected.tolist())
+
+    def test_window(self):
+        data = Loader(self.path, res_dir=os.path.join(self.tmp_dir, "w"))
+        view = data.window(self.t_start, self.t_end)
+        expected = self.reference.window(self.t_start, self.t_end)
+        self.assertEqual(view.get_starttimes(data.mice).tolist(),
+                         expected.get_starttimes(data.mice).tolist())
+
+    def test_masked(self):
+        data = Loader(self.path, res_dir=os.path.join(self.tmp_dir, "mm"))
+        data.mask_data(self.t_start, self.t_end)
+        self.assertEqual(data.visits.mask, (self.t_start, self.t_end))
+
+
+class TestLoaderRefresh(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "BALB_VPA_data_cohort_1_divided",
+                            "setup_1")
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tmp_dir, "data")
+        os.mkdir(cls.path)
+        fnames = sorted(uf.get_filenames(path))
+        for fname in fnames[:10]:
+            shutil.copy(os.path.join(path, fname), cls.path)
+        cls.data = Loader(cls.path, res_dir=os.path.join(cls.tmp_dir, "res1"),
+                          add_date=False, max_break=600)
+        cls.before = len(cls.data.registrations.data)
+        cls.no_new = cls.data.refresh()
+        cls.data.visits
+        cls.data.visits_for_threshold(1.)
+        cls.lazy = Loader(cls.path, res_dir=os.path.join(cls.tmp_dir, "res3"),
+                          add_date=False, max_break=600, diagnostics="lazy")
+        cls.lazy.get_diagnostics()
+        cls.mapped = Loader(cls.path,
+                            res_dir=os.path.join(cls.tmp_dir, "res4"),
+                            add_date=False, max_break=600,
+                            memmap_after_load=os.path.join(cls.tmp_dir,
+                                                           "memmap"))
+        cls.mapped.visits
+        for fname in fnames[10:]:
+            shutil.copy(os.path.join(path, fname), cls.path)
+        cls.new = cls.data.refresh()
+        cls.lazy.refresh()
+        cls.mapped.refresh()
+        cls.reference = Loader(cls.path,
+                               res_dir=os.path.join(cls.tmp_dir, "res2"),
+                               add_date=False, max_break=600)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def test_no_new_files(self):
+        self.assertEqual(self.no_new, 0)
+
+    def test_count(self):
+        self.assertEqual(self.before + self.new,
+                         len(self.reference.registrations.data))
+
+    def test_registrations(self):
+        self.assertTrue(np.array_equal(self.data.registrations.data,
+                                       self.reference.registrations.data))
+
+    def test_visits(self):
+        self.assertTrue(np.array_equal(self.data.visits.data,
+                                       self.reference.visits.data))
+
+    def test_visits_other_threshold(self):
+        out = self.data.visits_for_threshold(1.).data
+        expected = self.reference.visits_for_threshold(1.).data
+        self.assertTrue(np.array_equal(out, expected))
+
+    def test_visits_not_calculated(self):
+        self.assertTrue(np.array_equal(self.lazy.visits.data,
+                                       self.reference.visits.data))
+
+    def test_mice(self):
+        self.assertEqual(self.data.mice, self.reference.mice)
+
+    def test_session_end(self):
+        self.assertEqual(self.data.session_end, self.reference.session_end)
+
+    def test_diagnostics(self):
+        path1 = os.path.join(self.data.res_dir, "diagnostics")
+        path2 = os.path.join(self.reference.res_dir, "diagnostics")
+        for fname in os.listdir(path2):
+            with open(os.path.join(path1, fname)) as f1:
+                with open(os.path.join(path2, fname)) as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+    def test_memmap_visits(self):
+        self.assertTrue(np.array_equal(self.mapped.visits.data,
+                                       self.reference.visits.data))
+
+    def test_memmap_registrations(self):
+        self.assertTrue(np.array_equal(self.mapped.registrations.data,
+                                       self.reference.registrations.data))
+
+    def test_diagnostics_lazy(self):
+        self.assertEqual(self.lazy.save_diagnostics(),
+                         self.reference.save_diagnostics())
+
 
 class TestMerger(unittest.TestCase):
     @classmethod
@@ -131,6 +703,14 @@ class TestMerger(unittest.TestCase):
         cls.data = Merger(config, cls.res_dir, cls.data1, cls.data2)
         cls.original_data = Loader(sample_data)
 
+    def test_workers(self):
+        config = os.path.join(os.path.dirname(self.path1),
+                              "experiment_setup.txt")
+        data = Merger(config, self.res_dir, self.data1, self.data2,
+                      workers=2)
+        self.assertTrue(np.array_equal(data.visits.data,
+                                       self.data.visits.data))
+
     def test_1(self):
         self.assertEqual(self.data.res_dir,
                          "%s_%s" % (self.res_dir,
@@ -2,8 +2,13 @@
 from __future__ import print_function, division, absolute_import
 import os
 import unittest
+import numpy as np
 from pyEcoHAB import SetupConfig, ExperimentSetupConfig
 from pyEcoHAB import data_path
+from pyEcoHAB.utils.general import PAIR_ALLOWED, PAIR_SKIPPED_ONE
+from pyEcoHAB.utils.general import PAIR_SKIPPED_TWO, PAIR_SKIPPED_MORE
+from pyEcoHAB.utils.general import HOP_UNREACHABLE
+from pyEcoHAB.utils import general as utils
 
 # In the first scripts for EcoHAB data analysis,
 # the antennas were numbered from 1 to 8. The cages
@@ -1510,5 +1515,170 @@ class TestExperimentSetupConfig(unittest.TestCase):
         self.assertEqual(calculated, expected)
 
 
+
+class TestCompiledTables(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "test_setups")
+        cls.standard = SetupConfig()
+        cls.internal = SetupConfig(path=path, fname="setup_internal.txt")
+
+    def code(self, config, pair):
+        a1, a2 = pair.split(" ")
+        return config.antenna_codes[a1], config.antenna_codes[a2]
+
+    def check_category(self, config, pairs, category):
+        for pair in pairs:
+            self.assertEqual(config.pair_category[self.code(config, pair)],
+                             category)
+
+    def test_skipped_one(self):
+        self.check_category(self.standard, self.standard.skipped_one(),
+                            PAIR_SKIPPED_ONE)
+
+    def test_skipped_two(self):
+        self.check_category(self.standard, self.standard.skipped_two(),
+                            PAIR_SKIPPED_TWO)
+
+    def test_skipped_more(self):
+        self.check_category(self.internal, self.internal.skipped_more(),
+                            PAIR_SKIPPED_MORE)
+
+    def test_allowed(self):
+        self.check_category(self.internal, self.internal.allowed_pairs(),
+                            PAIR_ALLOWED)
+
+    def test_hop_distance(self):
+        self.assertEqual(self.standard.hop_distance[self.code(self.standard,
+                                                              "1 2")], 1)
+        self.assertEqual(self.standard.hop_distance[self.code(self.standard,
+                                                              "1 1")], 0)
+        self.assertEqual(self.standard.hop_distance[self.code(self.standard,
+                                                              "1 3")], 2)
+
+    def test_hop_distance_exact(self):
+        self.assertEqual(self.standard.hop_distance[self.code(self.standard,
+                                                              "1 5")], 4)
+        self.assertEqual(self.standard.hop_distance[self.code(self.standard,
+                                                              "2 5")], 3)
+
+    def test_hops(self):
+        self.assertEqual(self.standard.hops(["1", "2"], ["5", "6"]), 3)
+        self.assertEqual(self.standard.hops(["1", "2"], ["3", "4"]), 1)
+
+    def test_compartment_graph(self):
+        graph = self.standard.compartment_graph
+        self.assertEqual(sorted(graph["1"]), ["cage A", "tunnel 1"])
+        self.assertEqual(sorted(graph["tunnel 1"]), ["1", "2"])
+
+    def test_unreachable(self):
+        text = self.standard.to_text().replace("[cage A]",
+                                               "[cage E]\ninternal = 9\n\n"
+                                               "[cage A]")
+        config = SetupConfig.from_text(text)
+        nine = config.antenna_codes["9"]
+        self.assertTrue((config.hop_distance[nine, :nine] ==
+                         HOP_UNREACHABLE).all())
+        self.assertEqual(config.hop_distance[nine, nine], 0)
+        self.assertIn("9 1", config.skipped_more())
+
+    def test_cached_copies(self):
+        pairs = self.standard.all_pairs
+        pairs.pop()
+        self.assertEqual(len(self.standard.all_pairs), 64)
+
+    def test_antenna_transitions(self):
+        config = self.internal
+        antennas = config.all_antennas[::-1]
+        out = config.antenna_transitions(antennas)
+        expected = utils.get_antenna_transitions(
+            antennas, config.same_tunnel, config.same_address,
+            config.opposite_tunnel, config.address,
+            config.address_surrounding, config.address_non_adjacent,
+            config.internal_antennas)
+        addresses = np.array(out[0] + ["none"])
+        expected_addresses = np.array(expected[0] + ["none"])
+        self.assertEqual(addresses[out[1]].tolist(),
+                         expected_addresses[expected[1]].tolist())
+        self.assertEqual(out[2].tolist(), expected[2].tolist())
+        self.assertEqual(out[3].tolist(), expected[3].tolist())
+
+    def test_antenna_transitions_unknown(self):
+        out = self.standard.antenna_transitions(["1", "9"])
+        self.assertEqual(out[1][1, 1], -2)
+
+
+class TestRingSetup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        text = "[setup]\nname = ring\n"
+        for i in range(12):
+            text += "[cage %02d]\nentrance1 = %d\nentrance2 = %d\n" % (
+                i, 2*i + 1, (2*i - 1) % 24 + 1)
+            text += "[tunnel %02d]\nentrance1 = %d\nentrance2 = %d\n" % (
+                i, 2*i + 1, 2*i + 2)
+        cls.config = SetupConfig.from_text(text)
+
+    def test_hop_distance(self):
+        codes = self.config.antenna_codes
+        self.assertEqual(self.config.hop_distance[codes["1"], codes["13"]],
+                         12)
+        self.assertEqual(self.config.hop_distance.max(), 12)
+
+    def test_opposite_tunnel(self):
+        self.assertEqual(self.config.opposite_tunnel["1"],
+                         sorted(["5", "6", "21", "22"]))
+
+    def test_skipped_two(self):
+        self.assertEqual(len(self.config.skipped_two()), 24*2)
+        self.assertIn("1 4", self.config.skipped_two())
+        self.assertIn("1 22", self.config.skipped_two())
+
+    def test_skipped_more(self):
+        self.assertEqual(len(self.config.skipped_more()),
+                         24*24 - 24*(3 + 2 + 2))
+
+
+class TestFromText(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(data_path, "test_setups")
+        cls.config = SetupConfig(path=path, fname="setup_internal.txt")
+        cls.restored = SetupConfig.from_text(cls.config.to_text())
+        path1 = os.path.join(data_path, "test_experiment_setups")
+        config1 = SetupConfig(path1, "setup1.txt")
+        config2 = SetupConfig(path1, "setup2.txt")
+        full_path = os.path.join(path1, "experiment_setup.txt")
+        cls.experiment = ExperimentSetupConfig(full_path, ecohab_1=config1,
+                                               ecohab_2=config2)
+        text = cls.experiment.to_text()
+        cls.restored_experiment = ExperimentSetupConfig.from_text(text)
+
+    def test_name(self):
+        self.assertEqual(self.restored.name, self.config.name)
+
+    def test_internal_antennas(self):
+        self.assertEqual(self.restored.internal_antennas,
+                         self.config.internal_antennas)
+
+    def test_address(self):
+        self.assertEqual(self.restored.address, self.config.address)
+
+    def test_skipped_one(self):
+        self.assertEqual(self.restored.skipped_one(),
+                         self.config.skipped_one())
+
+    def test_experiment_antennas(self):
+        self.assertEqual(self.restored_experiment.all_antennas,
+                         self.experiment.all_antennas)
+
+    def test_experiment_directions(self):
+        self.assertEqual(self.restored_experiment.directions,
+                         self.experiment.directions)
+
+    def test_experiment_mismatched_pairs(self):
+        self.assertEqual(self.restored_experiment.mismatched_pairs,
+                         self.experiment.mismatched_pairs)
+
 if __name__ == '__main__':
     unittest.main()
@@ -10,6 +10,7 @@ from collections import OrderedDict
 import numpy as np
 
 from pyEcoHAB.utils import general as uf
+from pyEcoHAB.utils import for_loading as ufl
 from pyEcoHAB import data_path
 from pyEcoHAB import Loader
 from pyEcoHAB import Timeline
@@ -79,6 +80,76 @@ SURROUNDING = {
 }
 
 
+def get_animal_position(times, antennas, mouse, threshold, same_pipe,
+                        same_address, opposite_pipe, address, surrounding,
+                        address_not_adjacent, internal_antennas):
+    """
+    Reference implementation of inferring visits of a single animal
+    from its registrations, one pair of registrations at a time.
+    The vectorized get_animal_positions is tested against it.
+    """
+    out = []
+    i = 0
+    if len(times) < 2:
+        return []
+    t_start, an_start = times[0], antennas[0]
+    t_end, an_end = times[1], antennas[1]
+    while i < len(times) - 1:
+        delta_t = t_end - t_start
+        if an_start in internal_antennas:
+            while an_end == an_start:
+                i = i + 1
+                try:
+                    t_end, an_end = times[i+1], antennas[i+1]
+                except IndexError:
+                    out.append((address[an_start], mouse,
+                                t_start, t_end, t_end-t_start, True))
+                    return out
+            out.append((address[an_start], mouse,
+                        t_start, t_end, t_end-t_start, True))
+        elif an_end in internal_antennas:
+            an_old_end = an_end
+            while an_end == an_old_end:
+                i = i + 1
+                try:
+                    an_end = antennas[i+1]
+                    t_end = times[i+1]
+                except IndexError:
+                    out.append((address[an_old_end], mouse,
+                                t_start, t_end, t_end-t_start, True))
+                    return out
+            out.append((address[an_old_end], mouse,
+                        t_start, t_end, t_end-t_start, True))
+
+        elif delta_t < threshold:
+            pass
+        elif an_end == an_start:
+            out.append((address[an_start], mouse,
+                        t_start, t_end, delta_t, True))
+        elif an_start in same_pipe and an_end in same_pipe[an_start]:
+            pass
+        elif an_end in same_address[an_start]:
+            out.append((address[an_start], mouse,
+                        t_start, t_end, delta_t, True))
+        elif (min(an_start, an_end), max(an_start, an_end)) in surrounding:
+            out.append((surrounding[(min(an_start, an_end),
+                                     max(an_start, an_end))],
+                        mouse, t_start, t_end, delta_t, False))
+        elif an_start in opposite_pipe and an_end in opposite_pipe[an_start]:
+            pass
+        else:
+            out.append((address_not_adjacent[an_start],
+                        mouse, t_start, t_end, delta_t, False))
+
+        i = i + 1
+        try:
+            an_start, an_end = antennas[i], antennas[i+1]
+            t_start, t_end = times[i], times[i+1]
+        except IndexError:
+            return out
+    return out
+
+
 class TestFilter(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -1016,133 +1087,133 @@ class TestPrepareData(unittest.TestCase):
 
 class TestGetAnimalPositions(unittest.TestCase):
     def test_threshold(self):
-        out = uf.get_animal_position([2, 3], ["2", "2"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 3], ["2", "2"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual(out, [])
 
     def test_pipe_1(self):
-        out = uf.get_animal_position([2, 3], ["1", "2"], "mouse_1", 1,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 3], ["1", "2"], "mouse_1", 1,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual(out, [])
 
     def test_pipe_2(self):
-        out = uf.get_animal_position([2, 3], ["3", "4"], "mouse_1", 1,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 3], ["3", "4"], "mouse_1", 1,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual(out, [])
 
     def test_pipe_3(self):
-        out = uf.get_animal_position([2, 3], ["5", "6"], "mouse_1", 1,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 3], ["5", "6"], "mouse_1", 1,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual(out, [])
 
     def test_pipe_4(self):
-        out = uf.get_animal_position([2, 3], ["7", "8"], "mouse_1", 1,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 3], ["7", "8"], "mouse_1", 1,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual(out, [])
 
     def test_chamber_A1(self):
-        out = uf.get_animal_position([2, 6], ["1", "8"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["1", "8"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage A", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_A2(self):
-        out = uf.get_animal_position([2, 6], ["8", "1"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["8", "1"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage A", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_B1(self):
-        out = uf.get_animal_position([2, 6], ["2", "3"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["2", "3"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage B", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_B2(self):
-        out = uf.get_animal_position([2, 6], ["3", "2"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["3", "2"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage B", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_C1(self):
-        out = uf.get_animal_position([2, 6], ["4", "5"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["4", "5"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage C", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_C2(self):
-        out = uf.get_animal_position([2, 6], ["5", "4"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["5", "4"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage C", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_D1(self):
-        out = uf.get_animal_position([2, 6], ["6", "7"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["6", "7"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage D", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chamber_D2(self):
-        out = uf.get_animal_position([2, 6], ["7", "6"], "mouse_1", 2,
-                                     same_pipe=SAME_PIPE,
-                                     same_address=SAME_ADDRESS,
-                                     opposite_pipe=OPPOSITE_PIPE,
-                                     address=ADDRESS, surrounding=SURROUNDING,
-                                     address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                     internal_antennas=[])
+        out = get_animal_position([2, 6], ["7", "6"], "mouse_1", 2,
+                                  same_pipe=SAME_PIPE,
+                                  same_address=SAME_ADDRESS,
+                                  opposite_pipe=OPPOSITE_PIPE,
+                                  address=ADDRESS, surrounding=SURROUNDING,
+                                  address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                  internal_antennas=[])
         self.assertEqual([("cage D", "mouse_1", 2, 6, 4, True)], out)
 
     def test_chambers_with_internal_antennas(self):
@@ -1177,23 +1248,163 @@ class TestGetAnimalPositions(unittest.TestCase):
             "2": "cage A",  # "4",
         }
         SURROUNDING = {}
-        o1 = uf.get_animal_position(times, positions, "mouse_1", 2,
-                                    same_pipe=SAME_PIPE,
-                                    same_address=SAME_ADDRESS,
-                                    opposite_pipe=OPPOSITE_PIPE,
-                                    address=ADDRESS, surrounding=SURROUNDING,
-                                    address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                    internal_antennas=["8"])
-        o2 = uf.get_animal_position(times2, positions2, "mouse_1", 2,
-                                    same_pipe=SAME_PIPE,
-                                    same_address=SAME_ADDRESS,
-                                    opposite_pipe=OPPOSITE_PIPE,
-                                    address=ADDRESS, surrounding=SURROUNDING,
-                                    address_not_adjacent=ADDRESS_NON_ADJACENT,
-                                    internal_antennas=[])
+        o1 = get_animal_position(times, positions, "mouse_1", 2,
+                                 same_pipe=SAME_PIPE,
+                                 same_address=SAME_ADDRESS,
+                                 opposite_pipe=OPPOSITE_PIPE,
+                                 address=ADDRESS, surrounding=SURROUNDING,
+                                 address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                 internal_antennas=["8"])
+        o2 = get_animal_position(times2, positions2, "mouse_1", 2,
+                                 same_pipe=SAME_PIPE,
+                                 same_address=SAME_ADDRESS,
+                                 opposite_pipe=OPPOSITE_PIPE,
+                                 address=ADDRESS, surrounding=SURROUNDING,
+                                 address_not_adjacent=ADDRESS_NON_ADJACENT,
+                                 internal_antennas=[])
         self.assertEqual(o1, o2)
 
 
+class TestGetAnimalPositionsVectorized(unittest.TestCase):
+    def positions(self, times, antennas, mouse_ids, threshold,
+                  internal_antennas):
+        names = sorted(set(antennas))
+        addresses, table, valid, internal = uf.get_antenna_transitions(
+            names, SAME_PIPE, SAME_ADDRESS, OPPOSITE_PIPE, ADDRESS,
+            SURROUNDING, ADDRESS_NON_ADJACENT, internal_antennas)
+        codes = [names.index(antenna) for antenna in antennas]
+        out = uf.get_animal_positions(times, codes, mouse_ids, threshold,
+                                      table, valid, internal)
+        address_idx, ids, starts, ends, validity = out
+        return [(addresses[a], "mouse_%d" % ids[i], starts[i], ends[i],
+                 ends[i] - starts[i], validity[i])
+                for i, a in enumerate(address_idx)]
+
+    def expected(self, times, antennas, mouse, threshold, internal_antennas):
+        return get_animal_position(times, antennas, mouse, threshold,
+                                   SAME_PIPE, SAME_ADDRESS, OPPOSITE_PIPE,
+                                   ADDRESS, SURROUNDING,
+                                   ADDRESS_NON_ADJACENT,
+                                   internal_antennas)
+
+    def test_transitions_same_pipe(self):
+        out = uf.get_antenna_transitions(["1", "2"], SAME_PIPE, SAME_ADDRESS,
+                                         OPPOSITE_PIPE, ADDRESS, SURROUNDING,
+                                         ADDRESS_NON_ADJACENT, [])
+        self.assertEqual(out[1][0, 1], -1)
+
+    def test_transitions_internal(self):
+        out = uf.get_antenna_transitions(["1", "8"], SAME_PIPE, SAME_ADDRESS,
+                                         OPPOSITE_PIPE, ADDRESS, SURROUNDING,
+                                         ADDRESS_NON_ADJACENT, ["8"])
+        self.assertEqual(out[3].tolist(), [False, True])
+
+    def test_no_internal(self):
+        times = [2, 3, 6, 12, 13, 20, 21, 30, 31, 40]
+        antennas = ["1", "2", "3", "5", "6", "6", "7", "8", "2", "4"]
+        out = self.positions(times, antennas, [1]*len(times), 2, [])
+        self.assertEqual(out, self.expected(times, antennas, "mouse_1", 2,
+                                            []))
+
+    def test_internal(self):
+        times = [2, 3, 6, 12, 13, 20, 21, 30, 31, 40, 41]
+        antennas = ["1", "8", "8", "8", "1", "2", "8", "8", "3", "8", "8"]
+        out = self.positions(times, antennas, [1]*len(times), 2, ["8"])
+        self.assertEqual(out, self.expected(times, antennas, "mouse_1", 2,
+                                            ["8"]))
+
+    def test_internal_first(self):
+        times = [2, 3, 6, 12, 13, 20]
+        antennas = ["8", "8", "1", "2", "8", "1"]
+        out = self.positions(times, antennas, [1]*len(times), 2, ["8"])
+        self.assertEqual(out, self.expected(times, antennas, "mouse_1", 2,
+                                            ["8"]))
+
+    def test_more_mice(self):
+        times = [2, 3, 6, 12, 13, 1, 5, 8, 9]
+        antennas = ["1", "8", "8", "3", "4", "8", "1", "2", "8"]
+        mouse_ids = [1, 1, 1, 1, 1, 2, 2, 2, 2]
+        out = self.positions(times, antennas, mouse_ids, 2, ["8"])
+        expected = self.expected(times[:5], antennas[:5], "mouse_1", 2,
+                                 ["8"])
+        expected += self.expected(times[5:], antennas[5:], "mouse_2", 2,
+                                  ["8"])
+        self.assertEqual(out, expected)
+
+    def test_single_registration(self):
+        out = self.positions([2], ["1"], [1], 2, [])
+        self.assertEqual(out, [])
+
+    def test_dataset(self):
+        path = os.path.join(data_path, "weird_short_3_mice")
+        data, setup = ufl.read_single_file_array(path, "20101010_110000.txt")
+        data = data[np.argsort(data["Tag"], kind="stable")]
+        mice = sorted(set(data["Tag"]))
+        mouse_ids = [mice.index(tag) + 1 for tag in data["Tag"]]
+        out = self.positions(data["Time"].tolist(), data["Antenna"].tolist(),
+                             mouse_ids, 2, [])
+        expected = []
+        for mouse in mice:
+            registrations = data[data["Tag"] == mouse]
+            expected += self.expected(registrations["Time"].tolist(),
+                                      registrations["Antenna"].tolist(),
+                                      mouse, 2, [])
+        self.assertEqual(out, expected)
+
+    def test_workers(self):
+        times = [2, 3, 6, 12, 13, 1, 5, 8, 9, 3, 4, 10]
+        antennas = ["1", "8", "8", "3", "4", "8", "1", "2", "8", "5", "6",
+                    "7"]
+        mouse_ids = [1, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3]
+        names = sorted(set(antennas))
+        codes = [names.index(antenna) for antenna in antennas]
+        table, valid, internal = uf.get_antenna_transitions(
+            names, SAME_PIPE, SAME_ADDRESS, OPPOSITE_PIPE, ADDRESS,
+            SURROUNDING, ADDRESS_NON_ADJACENT, ["8"])[1:]
+        out1 = uf.calculate_animal_positions(times, codes, mouse_ids, 2,
+                                             table, valid, internal)
+        out2 = uf.calculate_animal_positions(times, codes, mouse_ids, 2,
+                                             table, valid, internal,
+                                             workers=2)
+        self.assertEqual([a.tolist() for a in out1],
+                         [a.tolist() for a in out2])
+
+    def sweep_data(self):
+        times = [2, 3, 6, 12, 13, 1, 5, 8, 9, 3, 4, 10]
+        antennas = ["1", "8", "8", "3", "4", "8", "1", "2", "8", "5", "6",
+                    "7"]
+        mouse_ids = [1, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3]
+        names = sorted(set(antennas))
+        codes = [names.index(antenna) for antenna in antennas]
+        table, valid, internal = uf.get_antenna_transitions(
+            names, SAME_PIPE, SAME_ADDRESS, OPPOSITE_PIPE, ADDRESS,
+            SURROUNDING, ADDRESS_NON_ADJACENT, ["8"])[1:]
+        return times, codes, mouse_ids, table, valid, internal
+
+    def test_sweep(self):
+        times, codes, mouse_ids, table, valid, internal = self.sweep_data()
+        out = uf.get_animal_positions_sweep(times, codes, mouse_ids,
+                                            [0.5, 2, 5], table, valid,
+                                            internal)
+        for threshold, positions in zip([0.5, 2, 5], out):
+            expected = uf.get_animal_positions(times, codes, mouse_ids,
+                                               threshold, table, valid,
+                                               internal)
+            self.assertEqual([a.tolist() for a in positions],
+                             [a.tolist() for a in expected])
+
+    def test_sweep_workers(self):
+        times, codes, mouse_ids, table, valid, internal = self.sweep_data()
+        out1 = uf.calculate_animal_positions_sweep(times, codes, mouse_ids,
+                                                   [1, 3], table, valid,
+                                                   internal)
+        out2 = uf.calculate_animal_positions_sweep(times, codes, mouse_ids,
+                                                   [1, 3], table, valid,
+                                                   internal, workers=2)
+        self.assertEqual([[a.tolist() for a in out] for out in out1],
+                         [[a.tolist() for a in out] for out in out2])
+
+
 class TestDictToArray2D(unittest.TestCase):
     @classmethod
     def setUpClass(cls):